@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+from __future__ import with_statement
+
+"""
+Benchmarks for the submission script on large, generated classes.
+
+Generates T-Square and Canvas bulk submission zips (and a matching Canvas gradebook roll) of any
+size, runs TSquare.execute and Canvas.execute on them and writes the end-to-end and per phase
+times to a json file, so regressions show up at 1k and 10k students instead of in the middle of
+grading.
+"""
+
+__author__ = "Marie Weeks"
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import string
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import resource
+import multiprocessing
+from StringIO import StringIO
+from contextlib import contextmanager
+import SubmissionFix
+
+
+MODES = {
+    'default': {},
+    'stream': {'stream': True},
+}
+
+
+class BenchConfig(object):
+    """Shape of a generated class and its submissions."""
+
+    def __init__(self, students=1000, files=3, size=4096, zipRatio=0.1, tarRatio=0.05, targzRatio=0.1,
+                 resubmitted=0.1, late=0.1, quiz=False, sections=4, seed=2110):
+        self.students = students
+        self.files = files
+        self.size = size
+        self.zipRatio = zipRatio
+        self.tarRatio = tarRatio
+        self.targzRatio = targzRatio
+        self.resubmitted = resubmitted
+        self.late = late
+        self.quiz = quiz
+        self.sections = sections
+        self.seed = seed
+
+    def asDict(self):
+        return dict(self.__dict__)
+
+
+def studentNames(count):
+    """Return count distinct 'Last, First' names. Canvas file names can't hold digits, so only letters are used."""
+
+    names = []
+    for i in range(count):
+        letters = ''
+        n = i
+        while True:
+            letters = string.ascii_lowercase[n % 26] + letters
+            n = n // 26 - 1
+            if n < 0:
+                break
+        names.append('Student{last}, Bench{first}'.format(last=letters, first=letters[::-1]))
+    return names
+
+
+def _payload(rng, size):
+    """Return size bytes of assembly-like text that compresses roughly like real submissions."""
+
+    words = ['ADD', 'AND', 'NOT', 'BR', 'JMP', 'JSR', 'LD', 'LDR', 'LEA', 'ST', 'STR', 'TRAP', 'R0', 'R1',
+             'R2', 'R3', 'R4', 'R5', 'R6', 'R7', '#1', '#-1', 'x3000', '.FILL', '.BLKW', 'HALT', '\n']
+    out = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        out.append(word)
+        length += len(word) + 1
+    return ' '.join(out)[:size]
+
+
+def _nestedArchive(rng, kind, files, size):
+    """Return the bytes of a zip, tar or tar.gz holding a folder of files."""
+
+    buf = StringIO()
+    if kind == 'zip':
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as nested:
+            for i in range(files):
+                nested.writestr('project/part{i}.asm'.format(i=i), _payload(rng, size))
+    else:
+        tar = tarfile.open(fileobj=buf, mode='w:gz' if kind == 'tar.gz' else 'w')
+        for i in range(files):
+            data = _payload(rng, size)
+            info = tarfile.TarInfo('project/part{i}.asm'.format(i=i))
+            info.size = len(data)
+            tar.addfile(info, StringIO(data))
+        tar.close()
+    return buf.getvalue()
+
+
+def _submissionFiles(rng, config):
+    """Return list of (filename, data) a single student submits."""
+
+    roll = rng.random()
+    for kind, ratio in (('zip', config.zipRatio), ('tar', config.tarRatio), ('tar.gz', config.targzRatio)):
+        if roll < ratio:
+            return [('project.' + kind, _nestedArchive(rng, kind, config.files, config.size))]
+        roll -= ratio
+    return [('part{i}.asm'.format(i=i), _payload(rng, config.size)) for i in range(config.files)]
+
+
+def makeTSquareZip(path, config):
+    """Write a T-Square bulk submission zip for the configured class.
+
+    Late students get a timestamp after the benchmark due time, 02/28/05 23:55 US/Eastern.
+    """
+
+    rng = random.Random(config.seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zfile:
+        for name in studentNames(config.students):
+            folder = 'Homework 0/{name}({hash:032x})/'.format(name=name, hash=rng.getrandbits(128))
+            zfile.writestr(folder + os.path.basename(folder[:-1]) + '_submissionText.html', '<p></p>')
+            stamp = '20050301060000000' if rng.random() < config.late else '20050228200000000'
+            zfile.writestr(folder + 'timestamp.txt', stamp)
+            for filename, data in _submissionFiles(rng, config):
+                zfile.writestr(folder + 'Submission attachment(s)/' + filename, data)
+
+
+def makeCanvasZip(path, config):
+    """Write a Canvas bulk submission zip for the configured class.
+
+    Resubmitted files get Canvas' '-1' suffix, late students the '_late_' marker and with quiz set
+    all files use the quiz based naming.
+    """
+
+    rng = random.Random(config.seed)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zfile:
+        for i, name in enumerate(studentNames(config.students)):
+            squished = SubmissionFix.NameIndex.squish(name).lower()
+            late = rng.random() < config.late
+            resubmitted = rng.random() < config.resubmitted
+            for filename, data in _submissionFiles(rng, config):
+                if resubmitted:
+                    base, ext = filename.split('.', 1)
+                    filename = '{base}-1.{ext}'.format(base=base, ext=ext)
+                if config.quiz:
+                    entry = '{name}{id}_question_{q}_{id}_{filename}'.format(name=squished, id=i, q=i % 7, filename=filename)
+                elif late:
+                    entry = '{name}_late_{id}_{id}_{filename}'.format(name=squished, id=i, filename=filename)
+                else:
+                    entry = '{name}_{id}_{id}_{filename}'.format(name=squished, id=i, filename=filename)
+                zfile.writestr(entry, data)
+
+
+def makeRoll(path, config):
+    """Write a Canvas gradebook export for the configured class, spreading students over sections."""
+
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Student', 'ID', 'SIS Login ID', 'Section'] + ['HW{i:02d}'.format(i=i) for i in range(12)])
+        writer.writerow(['    Points Possible', '', '', ''] + ['100'] * 12)
+        for i, name in enumerate(studentNames(config.students)):
+            section = 'Bench Course - A{s}'.format(s=i % config.sections + 1)
+            writer.writerow([name, str(i), 'bench{i}'.format(i=i), section] + ['90'] * 12)
+
+
+@contextmanager
+def suppressOutput():
+    with open(os.devnull, 'w') as devnull:
+        oldstdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = oldstdout
+
+
+@contextmanager
+def inDirectory(path):
+    base = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(base)
+
+
+def runOnce(manager, workdir, bulk, roll, options):
+    """Run one manager on a generated zip in a fresh output folder and return its profile."""
+
+    output = tempfile.mkdtemp(prefix='out_', dir=workdir)
+    shutil.rmtree(output)
+    profiler = SubmissionFix.Profiler()
+    with inDirectory(workdir):
+        start = time.time()
+        with suppressOutput():
+            if manager == 'tsquare':
+                due = ['02/28/05', '23:55'] if SubmissionFix.findTime else None
+                SubmissionFix.TSquare.execute(bulk, output, None, None, due, profiler=profiler, **options)
+            else:
+                SubmissionFix.Canvas.execute(bulk, roll, output, None, None, None, profiler=profiler, **options)
+        total = time.time() - start
+    shutil.rmtree(output, ignore_errors=True)
+    result = profiler.report()
+    result['total'] = total
+    result['peakRssKb'] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return result
+
+
+def runIsolated(*args):
+    """Run runOnce in a fresh process, so its peak memory is not hidden by earlier runs or the generator."""
+
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(runOnce, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def runBenchmarks(configs, modes, managers, repeat=1, workdir=None):
+    """Generate each configured class and time every manager and mode on it.
+
+    Returns:
+        List of result dictionaries, one per run
+    """
+
+    results = []
+    workdir = workdir or tempfile.mkdtemp(prefix='submissionfix_bench_')
+    try:
+        for config in configs:
+            bulk = {'tsquare': os.path.join(workdir, 'tsquare.zip'), 'canvas': os.path.join(workdir, 'canvas.zip')}
+            roll = os.path.join(workdir, 'roll.csv')
+            makeTSquareZip(bulk['tsquare'], config)
+            makeCanvasZip(bulk['canvas'], config)
+            makeRoll(roll, config)
+
+            for manager in managers:
+                for mode in modes:
+                    for run in range(repeat):
+                        result = runIsolated(manager, workdir, bulk[manager], roll, MODES[mode])
+                        result.update({'manager': manager, 'mode': mode, 'run': run,
+                                       'zipBytes': os.path.getsize(bulk[manager]), 'config': config.asDict()})
+                        results.append(result)
+                        print '{manager:8} {mode:10} {students:6} students  {total:8.3f}s  {peak:8.1f} MB'.format(
+                            manager=manager, mode=mode, students=config.students, total=result['total'],
+                            peak=result['peakRssKb'] / 1024.0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main(sysargs):
+    parser = argparse.ArgumentParser(description='Time the submission script on generated bulk submission zips.')
+    parser.add_argument('-n', '--students', help='class sizes to benchmark (default: 1000)', type=int, nargs='+',
+                        default=[1000])
+    parser.add_argument('-f', '--files', help='files per student (default: 3)', type=int, default=3)
+    parser.add_argument('-s', '--size', help='bytes per file (default: 4096)', type=int, default=4096)
+    parser.add_argument('--zip', help='fraction of students submitting a zip (default: 0.1)', type=float, default=0.1)
+    parser.add_argument('--tar', help='fraction of students submitting a tar (default: 0.05)', type=float, default=0.05)
+    parser.add_argument('--targz', help='fraction of students submitting a tar.gz (default: 0.1)', type=float,
+                        default=0.1)
+    parser.add_argument('--resubmitted', help='fraction of Canvas students who resubmitted (default: 0.1)', type=float,
+                        default=0.1)
+    parser.add_argument('--late', help='fraction of late students (default: 0.1)', type=float, default=0.1)
+    parser.add_argument('--quiz', help='use Canvas quiz based file names', action='store_true')
+    parser.add_argument('-m', '--managers', help='submission managers to time', nargs='+',
+                        choices=['tsquare', 'canvas'], default=['tsquare', 'canvas'])
+    parser.add_argument('--modes', help='extraction modes to time', nargs='+', choices=sorted(MODES),
+                        default=sorted(MODES))
+    parser.add_argument('-r', '--repeat', help='runs per benchmark (default: 1)', type=int, default=1)
+    parser.add_argument('--memory-budget', help=('fail if the peak memory of any run exceeds this many MB,'
+                        ' whatever the number of students (default: 128)'), type=int, default=128)
+    parser.add_argument('-o', '--output', help='json file for results (default: bench_results.json)',
+                        default='bench_results.json')
+    args = parser.parse_args(sysargs[1:])
+
+    configs = [BenchConfig(students=n, files=args.files, size=args.size, zipRatio=args.zip, tarRatio=args.tar,
+                           targzRatio=args.targz, resubmitted=args.resubmitted, late=args.late, quiz=args.quiz)
+               for n in args.students]
+    results = runBenchmarks(configs, args.modes, args.managers, args.repeat)
+
+    budgetKb = args.memory_budget * 1024
+    over = [r for r in results if r['peakRssKb'] > budgetKb]
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'memoryBudgetKb': budgetKb, 'results': results}, f, indent=2,
+                  sort_keys=True)
+    print "\nResults written to " + args.output
+
+    for r in over:
+        print "Over memory budget: {manager} {mode} with {students} students used {peak:.1f} MB".format(
+            manager=r['manager'], mode=r['mode'], students=r['config']['students'], peak=r['peakRssKb'] / 1024.0)
+    return 1 if over else 0
+
+
+if __name__ == '__main__' :
+    sys.exit(main(sys.argv))
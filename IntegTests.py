@@ -11,6 +11,7 @@ import os
 import sys
 import shutil
 import argparse
+import tempfile
 import unittest
 from contextlib import contextmanager
 from subprocess import Popen, PIPE
@@ -25,6 +26,18 @@ def openLog():
 class TestIntegration(unittest.TestCase):
 	"""Integration tests for the submission fix script."""
 
+	def setUp(self):
+		# keep Canvas roll caches out of the real ~/.cache
+		self.cacheHome = os.environ.get('XDG_CACHE_HOME')
+		os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(os.environ['XDG_CACHE_HOME'], ignore_errors=True)
+		if self.cacheHome is None:
+			del os.environ['XDG_CACHE_HOME']
+		else:
+			os.environ['XDG_CACHE_HOME'] = self.cacheHome
+
 	@contextmanager
 	def tempTestDir(self, args, test, answer, testset, roll=None):
 		with self.tempDirectory() as path:
@@ -118,6 +131,19 @@ class TestIntegration(unittest.TestCase):
 		self.logTest(os.getcwd(), test, results)
 		return all(student in out for student in lateStudents)
 
+	def incrementalTestDir(self, args, test, answer, testset, junk, roll=None):
+		with self.tempDirectory() as path:
+			shutil.copy(os.path.abspath(testset), path)
+			if roll:
+				shutil.copy(os.path.abspath(roll), path)
+			testfile = os.path.abspath('testingtxt1.txt')
+			with self.inDirectory(path):
+				with self.suppressOutput():
+					SubmissionFix.main(args)
+					shutil.copy(testfile, junk)
+					SubmissionFix.main(args)
+			self.assertTrue(self.existingPathsTest(path, test, answer))
+
 	def existingPathsTest(self, base, test, paths):
 		self.logTest(base, test, ['[{exists}]  {path}\n'.format(exists=str(os.path.exists(p)), path=p) for p in paths])
 		return all([os.path.exists(p) for p in paths])	
@@ -320,6 +346,127 @@ class TestTSquareIntegration(TestIntegration, unittest.TestCase):
 		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
 		self.tempTestDir(['', 'testing_set8.zip', 'tsquare', '-mall'], 'T-Square - Homework 0, -m all, Tar Multiple Folders', answer, 'testing_set8.zip', 'testroll.csv')
 
+	#Stream tests
+	def test_pathExistsStream(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--stream'], 'T-Square - Homework 0, --stream', answer, 'testing_set1.zip')
+
+	def test_pathExistsStreamPathParens(self):
+		answer = self.pathTestSetup(os.path.join('NewFolder'))
+		self.tempTestDir(['', 'testing_set2.zip', 'tsquare', '-pNewFolder', '--stream'], 'T-Square - Homework 0, -path --stream', answer, 'testing_set2.zip')
+
+	def test_pathExistsStreamTarMove1Nested(self):
+		files = [os.path.join('Texts','testingtxt1.txt'),'patriots.asm']
+		names = [('Anderson, Donald', '20f5d6b21d3d2b3685f2144bc2fc771d'), ('Baker, Kenneth', 'd30f7f7f153271e28c4b632db9fa0b01'),
+					 ('Boss, Big', '41b1318bf1cce2d9a40761b02bab065e'), ('Campbell, Roy', '39b73fb441b1c611f3a50be2b8693f03'),
+					 ('Emmerich, Hal', 'c664acb099c59b2a4940773012d9ca40'), ('Fox, Grey', 'f8049726520d8dc911a7014af736e302'),
+					 ('Hunter, Naomi', 'd860291b770a7dadd23af116c5334caa'), ('Ling, Mei', '29eb03d07be7696caba2f608ac7b8a71'),
+					 ('Mantis, Psycho', '04a6c6c02d714a17cdd6aab5107008e4'), ('Miller, Kazuhira', 'f5cd92c317cec73b96ede092a62adcfe'), 
+					 ('Ocelot, Revolver', 'ef95ea7fbb72b57b38bd5aa7efcf8ca3'), ('Octopus, Decoy', '53a36da95a92702adfa25cb1e221a0d2'),
+					 ('Raven, Vulcan', '8d6da48c03e4e95fad55843d1ed84211'), ('Romanenko, Nastasha', '6569a8e2f02a2611a34106bd2d77f941'), 
+					 ('Silverburgh, Meryl', '205105fa7784a73c91e1412cfc886f65'), ('Snake, Liquid', 'e60a34764ec988f9d4597fe7825cdd63'), 
+					 ('Snake, Solid', '437e86082822caa972544f09da5f1050'), ('Snake, Solidus', 'de2caa5dd90df87e03cfe62780a58c94'), 
+					 ('Wolf, Sniper', '4f4002d30d729c89bb7fca07bf693c2c')]
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_set6.zip', 'tsquare', '-m1', '--stream'], 'T-Square - Homework 0, -m 1, --stream, Tar Nested', answer, 'testing_set6.zip', 'testroll.csv')
+
+	def test_lateStudentsListedStream(self):
+		students = ['Fox, Grey', 'Ling, Mei']
+		self.lateTempTestDir(['testing_set1.zip','tsquare', '-t', '02/28/05','23:55', '--stream'], 'T-Square - Homework 0, -time --stream', 'testing_set1.zip', students)
+
+	def test_noSubStudentsListedStream(self):
+		students = ['Hunter, Naomi', 'Emmerich, Hal']
+		self.lateTempTestDir(['testing_set9.zip','tsquare', '--stream'], 'T-Square - Homework 0, --stream, No Submissions', 'testing_set9.zip', students)
+
+	def test_pathExistsStreamCSVWrong(self):
+		answer = self.pathTestSetup()
+		csv = os.path.abspath('testingcsv5.csv')
+		self.exitTempTestDir(['', 'testing_set1.zip','tsquare', '-c' + csv, '--stream'], 'T-Square - Homework 0, -csv Wrong, --stream', answer, 'testing_set1.zip')
+
+	#Jobs tests
+	def test_pathExistsTarMoveAllJobs(self):
+		files = ['testingtxt1.txt','patriots.asm']
+		names = [('Anderson, Donald', '20f5d6b21d3d2b3685f2144bc2fc771d'), ('Baker, Kenneth', 'd30f7f7f153271e28c4b632db9fa0b01'),
+					 ('Boss, Big', '41b1318bf1cce2d9a40761b02bab065e'), ('Campbell, Roy', '39b73fb441b1c611f3a50be2b8693f03'),
+					 ('Emmerich, Hal', 'c664acb099c59b2a4940773012d9ca40'), ('Fox, Grey', 'f8049726520d8dc911a7014af736e302'),
+					 ('Hunter, Naomi', 'd860291b770a7dadd23af116c5334caa'), ('Ling, Mei', '29eb03d07be7696caba2f608ac7b8a71'),
+					 ('Mantis, Psycho', '04a6c6c02d714a17cdd6aab5107008e4'), ('Miller, Kazuhira', 'f5cd92c317cec73b96ede092a62adcfe'), 
+					 ('Ocelot, Revolver', 'ef95ea7fbb72b57b38bd5aa7efcf8ca3'), ('Octopus, Decoy', '53a36da95a92702adfa25cb1e221a0d2'),
+					 ('Raven, Vulcan', '8d6da48c03e4e95fad55843d1ed84211'), ('Romanenko, Nastasha', '6569a8e2f02a2611a34106bd2d77f941'), 
+					 ('Silverburgh, Meryl', '205105fa7784a73c91e1412cfc886f65'), ('Snake, Liquid', 'e60a34764ec988f9d4597fe7825cdd63'), 
+					 ('Snake, Solid', '437e86082822caa972544f09da5f1050'), ('Snake, Solidus', 'de2caa5dd90df87e03cfe62780a58c94'), 
+					 ('Wolf, Sniper', '4f4002d30d729c89bb7fca07bf693c2c')]
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_set7.zip', 'tsquare', '-mall', '-j4'], 'T-Square - Homework 0, -m all, -j 4, Tar', answer, 'testing_set7.zip', 'testroll.csv')
+
+	def test_pathExistsThreads(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--threads', '4'], 'T-Square - Homework 0, --threads 4', answer, 'testing_set1.zip')
+
+	#Incremental tests
+	def test_pathExistsIncrementalUntouched(self):
+		junk = os.path.join(os.getcwd(), 'test_folder', 'NewFolder', 'Fox, Grey', 'testingtxt1.txt')
+		answer = self.pathTestSetup('NewFolder') + [junk]
+		self.incrementalTestDir(['', 'testing_set1.zip', 'tsquare', '-pNewFolder', '--incremental'], 'T-Square - Homework 0, -path --incremental twice', answer, 'testing_set1.zip', junk)
+
+	def test_pathExistsStreamThreads(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--stream', '--threads', '4'], 'T-Square - Homework 0, --stream --threads 4', answer, 'testing_set1.zip')
+
+	def test_lateStudentsListedJobs(self):
+		students = ['Fox, Grey', 'Ling, Mei']
+		self.lateTempTestDir(['testing_set1.zip','tsquare', '-t', '02/28/05','23:55', '-j4'], 'T-Square - Homework 0, -time -j 4', 'testing_set1.zip', students)
+
+	#Report tests
+	def test_lateStudentsListedReport(self):
+		students = ['Fox, Grey', 'Ling, Mei']
+		self.lateTempTestDir(['testing_set1.zip','tsquare', '-t', '02/28/05','23:55', '-r'], 'T-Square - Homework 0, -time -report', 'testing_set1.zip', students)
+
+	def test_noSubStudentsListedReport(self):
+		students = ['Hunter, Naomi', 'Emmerich, Hal']
+		self.lateTempTestDir(['testing_set9.zip','tsquare', '-r'], 'T-Square - Homework 0, -report, No Submissions', 'testing_set9.zip', students)
+
+	def test_reportExtractsNothing(self):
+		with self.tempDirectory() as path:
+			shutil.copy(os.path.abspath('testing_set1.zip'), path)
+			with self.inDirectory(path):
+				with self.suppressOutput():
+					SubmissionFix.main(['', 'testing_set1.zip', 'tsquare', '-r', '-pNewFolder'])
+			self.assertEqual(os.listdir(path), ['testing_set1.zip'])
+
+	#Plan tests
+	def test_planExtractsNothing(self):
+		with self.tempDirectory() as path:
+			shutil.copy(os.path.abspath('testing_set1.zip'), path)
+			with self.inDirectory(path):
+				with self.suppressOutput():
+					SubmissionFix.main(['', 'testing_set1.zip', 'tsquare', '--plan', '-pNewFolder'])
+			self.assertEqual(sorted(os.listdir(path)), ['submissionfix_plan.json', 'testing_set1.zip'])
+
+	#Profile tests
+	def test_pathExistsProfile(self):
+		answer = self.pathTestSetup() + [os.path.join(os.getcwd(), 'test_folder', 'profile.json')]
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--profile', 'profile.json', '-j2'], 'T-Square - Homework 0, --profile -j 2', answer, 'testing_set1.zip')
+
+	def test_pathExistsExec(self):
+		answer = self.pathTestSetup()
+		answer += [os.path.join(os.path.dirname(p), 'graded.txt') for p in answer if p.endswith('patriots.asm')]
+		answer.append(os.path.join(os.getcwd(), 'test_folder', 'exec.json'))
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--exec', 'touch graded.txt', '--exec-workers', '3', '--exec-summary', 'exec.json'], 'T-Square - Homework 0, --exec --exec-workers 3', answer, 'testing_set1.zip')
+
+	def test_pathExistsFollow(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--follow', '--follow-timeout', '0'], 'T-Square - Homework 0, --follow', answer, 'testing_set1.zip')
+
+	def test_pathExistsOutputArchive(self):
+		answer = [os.path.join(os.getcwd(), 'test_folder', 'graded.tar.gz')]
+		self.tempTestDir(['', 'testing_set6.zip', 'tsquare', '-m1', '--output-archive', 'graded.tar.gz'], 'T-Square - Homework 0, -m 1 --output-archive, Tar Nested', answer, 'testing_set6.zip')
+
+	def test_pathExistsShards(self):
+		answer = self.pathTestSetup('shard1')
+		answer.append(os.path.join(os.getcwd(), 'test_folder', 'shards.json'))
+		self.tempTestDir(['', 'testing_set1.zip', 'tsquare', '--shards', '1', '--shard-table', 'shards.json'], 'T-Square - Homework 0, --shards 1', answer, 'testing_set1.zip')
+
 	#Testing functions and setup
 	def pathTestSetup(self, root=None, testsetNames=None):
 		basePath = os.path.join(os.getcwd(), 'test_folder')
@@ -398,6 +545,15 @@ class TestCanvasIntegration(TestIntegration, unittest.TestCase):
 		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
 		self.tempTestDir(['', 'testing_setc4.zip', 'canvas', 'testroll.csv'], 'Canvas - Homework 0, No Flags, Zip', answer, 'testing_setc4.zip', 'testroll.csv')
 
+	def test_pathExistsZipQuarantined(self):
+		files = [os.path.join('Quarantine', 'HW01.zip')]
+		names = ['Anderson, Donald', 'Baker, Kenneth','Boss, Big', 'Campbell, Roy', 'Emmerich, Hal', 'Fox, Grey',
+					 'Hunter, Naomi', 'Ling, Mei', 'Mantis, Psycho', 'Miller, Kazuhira', 'Ocelot, Revolver', 'Octopus, Decoy', 
+					 'Raven, Vulcan', 'Romanenko, Nastasha', 'Silverburgh, Meryl', 'Snake, Liquid', 
+					 'Snake, Solid', 'Snake, Solidus', 'Wolf, Sniper']
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_setc4.zip', 'canvas', 'testroll.csv', '--stream', '--max-archive-files', '1'], 'Canvas - Homework 0, --stream --max-archive-files 1, Zip', answer, 'testing_setc4.zip', 'testroll.csv')
+
 	def test_pathExistsTargz(self):
 		files = [os.path.join('sasakijohnny_1111_1111_HW01','testingtxt1.txt'), os.path.join('sasakijohnny_1111_1111_HW01','patriots.asm')]
 		names = ['Anderson, Donald', 'Baker, Kenneth','Boss, Big', 'Campbell, Roy', 'Emmerich, Hal', 'Fox, Grey',
@@ -434,6 +590,23 @@ class TestCanvasIntegration(TestIntegration, unittest.TestCase):
 		answer = self.pathTestSetup(testsetNames=names)
 		self.tempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv', '-sa1'], 'Canvas - Homework 0, -s a1', answer, 'testing_setc1.zip', 'testroll.csv')
 
+	def test_pathExistsNoCache(self):
+		answer = self.pathTestSetup()
+		cache = SubmissionFix.RosterCache(os.path.join('test_folder', 'testroll.csv')).path
+		self.tempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv', '--no-cache'], 'Canvas - Homework 0, --no-cache', answer, 'testing_setc1.zip', 'testroll.csv')
+		self.assertFalse(os.path.exists(cache))
+		self.tempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv'], 'Canvas - Homework 0, roll cached', answer, 'testing_setc1.zip', 'testroll.csv')
+		self.assertTrue(os.path.exists(cache))
+
+	def test_pathExistsIndex(self):
+		answer = self.pathTestSetup() + [os.path.join(os.getcwd(), 'test_folder', 'index.jsonl')]
+		self.tempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv', '--index', 'index.jsonl'], 'Canvas - Homework 0, --index', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	def test_pathExistsSections(self):
+		answer = self.pathTestSetup('TA_A1', ['Snake, Solid', 'Fox, Grey', 'Hunter, Naomi', 'Raven, Vulcan'])
+		answer += self.pathTestSetup('TA_B2', ['Snake, Liquid', 'Silverburgh, Meryl', 'Mantis, Psycho', 'Miller, Kazuhira'])
+		self.tempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv', '--sections', 'a1', 'b2', '--path-template', 'TA_{section}'], 'Canvas - Homework 0, --sections a1 b2 --path-template TA_{section}', answer, 'testing_setc1.zip', 'testroll.csv')
+
 	def test_pathExistsQuizzes(self):
 		answer = self.pathTestSetup()
 		self.tempTestDir(['', 'testing_setc8.zip', 'canvas', 'testroll.csv'], 'Canvas - Homework 0, No flags, Quiz Based Submissions', answer, 'testing_setc8.zip', 'testroll.csv')
@@ -487,6 +660,101 @@ class TestCanvasIntegration(TestIntegration, unittest.TestCase):
 		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
 		self.tempTestDir(['', 'testing_setc11.zip', 'canvas', 'testroll.csv', '-mall'], 'Canvas - Homework 0, -m all, Tar', answer, 'testing_setc11.zip', 'testroll.csv')
 
+	#Stream tests
+	def test_pathExistsStream(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--stream'], 'Canvas - Homework 0, --stream', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	def test_pathExistsStreamPathCSV(self):
+		names = ['Boss, Big', 'Campbell, Roy', 'Hunter, Naomi', 'Ocelot, Revolver', 'Silverburgh, Meryl', 'Snake, Liquid', 'Snake, Solid']
+		answer = self.pathTestSetup('NewFolder', testsetNames=names)
+		csv = os.path.abspath('testingcsv1.csv')
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '-pNewFolder', '-c' + csv, '--stream'], 'Canvas - Homework 0, -path -csv --stream', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	def test_pathExistsStreamResubmit(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc2.zip', 'canvas', 'testroll.csv', '--stream'], 'Canvas - Homework 0, --stream, Resubmitted files', answer, 'testing_setc2.zip', 'testroll.csv')
+
+	def test_pathExistsStreamTarMove1Nested(self):
+		files = [os.path.join('Texts','testingtxt1.txt'),'patriots.asm']
+		names = ['Anderson, Donald', 'Baker, Kenneth','Boss, Big', 'Campbell, Roy', 'Emmerich, Hal', 'Fox, Grey',
+					 'Hunter, Naomi', 'Ling, Mei', 'Mantis, Psycho', 'Miller, Kazuhira', 'Ocelot, Revolver', 'Octopus, Decoy', 
+					 'Raven, Vulcan', 'Romanenko, Nastasha', 'Silverburgh, Meryl', 'Snake, Liquid', 
+					 'Snake, Solid', 'Snake, Solidus', 'Wolf, Sniper']
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_setc10.zip', 'canvas', 'testroll.csv', '-m1', '--stream'], 'Canvas - Homework 0, -m 1, --stream, Tar', answer, 'testing_setc10.zip', 'testroll.csv')
+
+	def test_pathExistsStreamCSVWrong(self):
+		answer = self.pathTestSetup()
+		csv = os.path.abspath('testingcsv5.csv')
+		self.exitTempTestDir(['', 'testing_setc1.zip','canvas', 'testroll.csv', '-c' + csv, '--stream'], 'Canvas - Homework 0, -csv Wrong, --stream', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	#Jobs tests
+	def test_pathExistsTarMoveAllJobs(self):
+		files = ['testingtxt1.txt','patriots.asm']
+		names = ['Anderson, Donald', 'Baker, Kenneth','Boss, Big', 'Campbell, Roy', 'Emmerich, Hal', 'Fox, Grey',
+					 'Hunter, Naomi', 'Ling, Mei', 'Mantis, Psycho', 'Miller, Kazuhira', 'Ocelot, Revolver', 'Octopus, Decoy', 
+					 'Raven, Vulcan', 'Romanenko, Nastasha', 'Silverburgh, Meryl', 'Snake, Liquid', 
+					 'Snake, Solid', 'Snake, Solidus', 'Wolf, Sniper']
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_setc11.zip', 'canvas', 'testroll.csv', '-mall', '-j4'], 'Canvas - Homework 0, -m all, -j 4, Tar', answer, 'testing_setc11.zip', 'testroll.csv')
+
+	def test_pathExistsTarMoveAllStreamThreads(self):
+		files = ['testingtxt1.txt','patriots.asm']
+		names = ['Anderson, Donald', 'Baker, Kenneth','Boss, Big', 'Campbell, Roy', 'Emmerich, Hal', 'Fox, Grey',
+					 'Hunter, Naomi', 'Ling, Mei', 'Mantis, Psycho', 'Miller, Kazuhira', 'Ocelot, Revolver', 'Octopus, Decoy', 
+					 'Raven, Vulcan', 'Romanenko, Nastasha', 'Silverburgh, Meryl', 'Snake, Liquid', 
+					 'Snake, Solid', 'Snake, Solidus', 'Wolf, Sniper']
+		answer = self.addToSetup(['Sasaki, Johnny'], files, self.pathTestSetup(testsetNames=names))
+		self.tempTestDir(['', 'testing_setc11.zip', 'canvas', 'testroll.csv', '-mall', '--stream', '--threads', '4'], 'Canvas - Homework 0, -m all, --stream, --threads 4, Tar', answer, 'testing_setc11.zip', 'testroll.csv')
+
+	def test_pathExistsThreads(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--threads', '4'], 'Canvas - Homework 0, --threads 4', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	def test_pathExistsDedup(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--dedup'], 'Canvas - Homework 0, --dedup', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	def test_pathExistsStreamDedupThreads(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--dedup', '--stream', '--threads', '4'], 'Canvas - Homework 0, --dedup --stream --threads 4', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	#Incremental tests
+	def test_pathExistsIncrementalUntouched(self):
+		junk = os.path.join(os.getcwd(), 'test_folder', 'NewFolder', 'Snake, Solid', 'testingtxt1.txt')
+		answer = self.pathTestSetup('NewFolder') + [junk]
+		self.incrementalTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '-pNewFolder', '--incremental'], 'Canvas - Homework 0, -path --incremental twice', answer, 'testing_setc1.zip', junk, 'testroll.csv')
+
+	def test_pathExistsStreamThreads(self):
+		answer = self.pathTestSetup()
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--stream', '--threads', '4'], 'Canvas - Homework 0, --stream --threads 4', answer, 'testing_setc1.zip', 'testroll.csv')
+
+	#Report tests
+	def test_reportExtractsNothing(self):
+		with self.tempDirectory() as path:
+			shutil.copy(os.path.abspath('testing_setc1.zip'), path)
+			shutil.copy(os.path.abspath('testroll.csv'), path)
+			with self.inDirectory(path):
+				with self.suppressOutput():
+					SubmissionFix.main(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '-r', '-pNewFolder'])
+			self.assertEqual(sorted(os.listdir(path)), ['testing_setc1.zip', 'testroll.csv'])
+
+	#Plan tests
+	def test_planExtractsNothing(self):
+		with self.tempDirectory() as path:
+			shutil.copy(os.path.abspath('testing_setc1.zip'), path)
+			shutil.copy(os.path.abspath('testroll.csv'), path)
+			with self.inDirectory(path):
+				with self.suppressOutput():
+					SubmissionFix.main(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--plan', 'plan.json'])
+			self.assertEqual(sorted(os.listdir(path)), ['plan.json', 'testing_setc1.zip', 'testroll.csv'])
+
+	#Profile tests
+	def test_pathExistsStreamProfile(self):
+		answer = self.pathTestSetup() + [os.path.join(os.getcwd(), 'test_folder', 'submissionfix_profile.json')]
+		self.tempTestDir(['', 'testing_setc1.zip', 'canvas', 'testroll.csv', '--stream', '--profile'], 'Canvas - Homework 0, --stream --profile', answer, 'testing_setc1.zip', 'testroll.csv')
+
 	#Testing functions and setup
 	def pathTestSetup(self, root=None, testsetNames=None):
 		basePath = os.path.join(os.getcwd(), 'test_folder')
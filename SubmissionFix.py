@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 from __future__ import with_statement
 from datetime import datetime, date
-from subprocess import Popen, PIPE
 
 """
 This script extracts student submissions from both T-Square and Canvas bundled
@@ -16,28 +15,72 @@ __author__ = "Marie Weeks"
 import os
 import sys
 import csv
+import json
 import struct
+import marshal
+import sqlite3
+import hashlib
+import heapq
 import shutil
+import zlib
 import zipfile
 import tarfile
 import argparse
 import re
+import io
 import time
+import pipes
+import Queue
+import itertools
+import traceback
+import subprocess
+import tempfile
+import threading
+import multiprocessing
+from contextlib import contextmanager
 
 
 try :
     from pytz import timezone
     import pytz
     findTime = True
+    _eastern = timezone('US/Eastern')
 except ImportError :
     findTime = False
 
+try :
+    from backports import lzma
+except ImportError :
+    lzma = None
+
+try :
+    import resource
+except ImportError :
+    resource = None
+
+try :
+    import zstandard
+except ImportError :
+    zstandard = None
+
+try :
+    import fcntl
+except ImportError :
+    fcntl = None
+
 _student_file_patterns = tuple(map(re.compile, [
     r'^(?P<student>[^0-9]+)\d+_question_(\d+_){2}(?P<filename>.*)$',
     r'^(?P<student>[^_0-9]+)_(\d+_){2}(?P<filename>.*)$',
-    r'^(?P<student>[^_0-9]+)_late_(\d+_){2}(?P<filename>.*)$'
+    r'^(?P<student>[^_0-9]+)(?P<late>_late_)(\d+_){2}(?P<filename>.*)$'
 ]))
 
+_timestamp_pattern = re.compile(r"^(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})")
+
+_quarantine_folder = 'Quarantine'
+_shard_folder = 'shard{n}'
+_descriptor_signature = 'PK\x07\x08'
+_FICLONE = 0x40049409
+
 def requiredLength(nargs):
     """Checks that input arguments for given flag are of the specified number.
 
@@ -57,194 +100,2664 @@ def requiredLength(nargs):
             setattr(args, self.dest, values)
     return RequiredLength
 
-def extract(directory):
+def byteSize(text):
+    """Parse a number of bytes with an optional K, M or G suffix (powers of 1024), for argparse.
+
+    Raises:
+        ArgumentTypeError: if text is not a size
+    """
+    match = re.match(r'^(\d+)([KMG]?)B?$', text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError('"{text}" is not a size such as 500M or 2G'.format(text=text))
+    return int(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' ')
+
+def extract(directory, flattener=None, governor=None):
     """Extracts any zip or tar files in given directory
 
-    Looks through files in the input directory, extracting every zip and tar file. Resulting
-    files appear alongside archive file in the directory.
+    Looks through files in the input directory, extracting every zip and tar file in order of
+    their names. Resulting files appear alongside archive file in the directory, at their
+    flattened location if a Flattener is given.
 
     Args:
         directory: directory to be searched for archive files
+        flattener: Flattener rewriting the paths of extracted files (optional)
+        governor: Governor enforcing extraction limits (optional)
+    """
+
+    for fn in sorted(os.listdir(directory)) :
+        if archiveType(fn) :
+            unarchive(directory, os.path.join(directory, fn), flattener, governor)
+
+
+class Flattener(object):
+    """Rewrites paths inside a student folder to where flattening (the move option) puts them.
+
+    With move '1' the first folder of a path is dropped, with 'all' only the file name is kept and
+    folders disappear. Paths are relative to the student folder and folders end in a separator.
+    Folders named in keep (T-Square's 'Text') are left as they are. Files are never written over:
+    a file whose flattened path is already taken is reported, skipped and added to clashes. A path
+    is only taken once its file is written, so files going to the same folder need to be written
+    one at a time.
+    """
+
+    def __init__(self, move, keep=()):
+        self.move = move
+        self.keep = keep
+        self.clashes = []
+
+    def path(self, relative):
+        """Return the flattened path, or None for a folder that flattening removes."""
+
+        parts = relative.split(os.sep)
+        if len(parts) == 1 or parts[0] in self.keep:
+            return relative
+        parts = parts[1:] if self.move == '1' else parts[-1:]
+        if parts == ['']:
+            return None
+        return os.path.join(*parts)
+
+    def target(self, directory, relative):
+        """Return where the file or folder at relative goes in directory, or None if it is skipped."""
+
+        flattened = self.path(relative)
+        if flattened is None:
+            return None
+        path = os.path.join(directory, flattened)
+        if not flattened.endswith(os.sep) and os.path.lexists(path):
+            self.clashes.append(relative)
+            print ("Warning: Flattening '{file}' would overwrite '{other}' in {folder}. The file was skipped,"
+                    " please manually check their files.".format(file=relative, other=flattened,
+                                                                 folder=os.path.basename(directory)))
+            return None
+        return path
+
+
+class ExtractionLimits(object):
+    """Limits on what the archives students submit may extract to. Limits left as None are not enforced.
+
+    Archive limits apply to each archive on its own, student limits to everything extracted from
+    all of one student's archives. The ratio is the number of bytes an archive extracts to over
+    the size of the archive itself.
+    """
+
+    def __init__(self, archiveBytes=None, archiveFiles=None, ratio=None, studentBytes=None, studentFiles=None):
+        self.archiveBytes = archiveBytes
+        self.archiveFiles = archiveFiles
+        self.ratio = ratio
+        self.studentBytes = studentBytes
+        self.studentFiles = studentFiles
+
+    def __nonzero__(self):
+        return any(limit is not None for limit in self.__dict__.itervalues())
+
+
+class LimitExceeded(RuntimeError):
+    pass
+
+
+class Governor(object):
+    """Enforces extraction limits on the archives extracted into student folders.
+
+    Every archive is counted by its own ArchiveGuard while it is extracted, so extraction stops as
+    soon as a limit is passed. What the archive extracted up to then is removed, the archive is
+    kept in the student's Quarantine folder and listed in violations. Guards may be used from
+    several threads at once. A copy sent to a pool worker keeps the counts so far.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.violations = []
+        self._students = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def guard(self, archive, size):
+        """Return an ArchiveGuard for an archive of size bytes at the base of its student folder."""
+
+        return ArchiveGuard(self, archive, size)
+
+    def quarantine(self, guard, reason):
+        """Remove what the guarded archive extracted and list it as a violation.
+
+        Returns:
+            Path in the student's Quarantine folder to keep the archive at
+        """
+
+        guard.cleanup()
+        self._count(guard.folder, -guard.files, -guard.bytes)
+        student = os.path.basename(guard.folder)
+        with self._lock:
+            self.violations.append('  {student}: {archive} ({reason})'.format(student=student, archive=guard.name,
+                                                                               reason=reason))
+        folder = os.path.join(guard.folder, _quarantine_folder)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        print "Warning: Quarantined archive that {reason}. File: {path}".format(reason=reason, path=guard.path)
+        return os.path.join(folder, guard.name)
+
+    def _count(self, folder, files, size):
+        """Add to what a student folder's archives extracted and return the new [files, bytes] totals."""
+
+        with self._lock:
+            used = self._students.setdefault(os.path.abspath(folder), [0, 0])
+            used[0] += files
+            used[1] += size
+            return list(used)
+
+
+class ArchiveGuard(object):
+    """Counts the files and bytes one archive extracts, raising LimitExceeded once a limit is passed."""
+
+    def __init__(self, governor, path, size):
+        self.governor = governor
+        self.limits = governor.limits
+        self.path = path
+        self.name = os.path.basename(path)
+        self.folder = os.path.dirname(path)
+        self.size = size
+        self.files = 0
+        self.bytes = 0
+        self.written = []
+
+    def addFile(self, path):
+        """Count a file or folder about to be extracted to path."""
+
+        if not os.path.lexists(path):
+            self.written.append(path)
+        self.files += 1
+        files, size = self.governor._count(self.folder, 1, 0)
+        if self.limits.archiveFiles is not None and self.files > self.limits.archiveFiles:
+            raise LimitExceeded('extracts more than {n} files'.format(n=self.limits.archiveFiles))
+        if self.limits.studentFiles is not None and files > self.limits.studentFiles:
+            raise LimitExceeded('extracts more than {n} files for the student'.format(n=self.limits.studentFiles))
+
+    def addBytes(self, count):
+        """Count bytes about to be extracted."""
+
+        self.bytes += count
+        files, size = self.governor._count(self.folder, 0, count)
+        if self.limits.archiveBytes is not None and self.bytes > self.limits.archiveBytes:
+            raise LimitExceeded('extracts more than {n} bytes'.format(n=self.limits.archiveBytes))
+        if self.limits.ratio is not None and self.bytes > self.limits.ratio * max(self.size, 1):
+            raise LimitExceeded('has a compression ratio over {n:g}'.format(n=self.limits.ratio))
+        if self.limits.studentBytes is not None and size > self.limits.studentBytes:
+            raise LimitExceeded('extracts more than {n} bytes for the student'.format(n=self.limits.studentBytes))
+
+    def cleanup(self):
+        """Remove the files and folders the archive extracted."""
+
+        for path in reversed(self.written):
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    os.rmdir(path)
+                elif os.path.lexists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+            parent = os.path.dirname(path.rstrip(os.sep))
+            while parent.startswith(self.folder + os.sep):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+
+def archiveType(filename):
+    """Return 'zip' or 'tar' if the file name is one of the archives students' files are extracted from."""
+
+    if filename.endswith('.zip'):
+        return 'zip'
+    if filename.find('.tar') >= 0:
+        return 'tar'
+    return None
+
+
+def sniffArchive(header):
+    """Return the format of an archive from its first 262 bytes.
+
+    Returns one of 'zip', 'gzip', 'bzip2', 'xz' or 'tar', or None if the bytes are not the start of
+    any of them. The file name is not used, so zip files renamed to .tar are still recognized.
+    """
+
+    if header.startswith('PK\x03\x04') or header.startswith('PK\x05\x06'):
+        return 'zip'
+    if header.startswith('\x1f\x8b'):
+        return 'gzip'
+    if header.startswith('BZh'):
+        return 'bzip2'
+    if header.startswith('\xfd7zXZ\x00'):
+        return 'xz'
+    if header[257:262] == 'ustar':
+        return 'tar'
+    return None
+
+
+class ReplayReader(object):
+    """Read-only file object that returns already read bytes before the rest of a stream."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), ''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+            if len(data) < size:
+                data += self.stream.read(size - len(data))
+        return data
+
+
+class ChecksumReader(object):
+    """Read-only file object that keeps the CRC32 of everything read from a stream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.crc = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        return data
+
+
+class DecompressReader(object):
+    """Read-only file object that decompresses a stream as it is read."""
+
+    def __init__(self, stream, decompressor, chunkSize=64 * 1024):
+        self.stream = stream
+        self.decompressor = decompressor
+        self.chunkSize = chunkSize
+        self.buffer = ''
+
+    def read(self, size=-1):
+        while size is None or size < 0 or len(self.buffer) < size:
+            chunk = self.stream.read(self.chunkSize)
+            if not chunk:
+                break
+            self.buffer += self.decompressor.decompress(chunk)
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+_archiveErrors = (zipfile.BadZipfile, tarfile.TarError, struct.error, zlib.error, EOFError, IOError)
+
+
+def extractArchive(source, directory, spoolSize=32 * 1024 * 1024, flattener=None, guard=None, written=None):
+    """Extracts a zip or tar archive from an open file object into the given directory.
+
+    The format is detected from the first bytes of the archive rather than its name. Tar files
+    (plain, gzip, bzip2, or xz if the lzma module is installed) are extracted in one pass while
+    they are read, so source does not need to be seekable. Zip files need to be seekable and are
+    spooled to memory or a temporary file if source is not. Members named '.' are skipped and
+    members that would end up outside of directory ('..' or absolute paths, folders that are
+    links out of it, and links pointing out of it) are skipped with a warning. With a Flattener,
+    members are written straight to their flattened location. With an ArchiveGuard, every member
+    is counted against the extraction limits before and while it is written and LimitExceeded is
+    raised as soon as one is passed. Given a written list, (path, size, crc) is added to it for
+    every file as soon as it is written, with the CRC32 of tar members read back from the file.
+
+    Args:
+        source: file object positioned at the start of the archive
+        directory: directory where files will be extracted to
+        spoolSize: largest zip to spool to memory when source is not seekable
+        flattener: Flattener rewriting member paths relative to directory (optional)
+        guard: ArchiveGuard counting what is extracted (optional)
+        written: list of the files extracted (optional)
+
+    Returns:
+        kind: format of the archive, or None if source is not an archive (nothing is extracted)
+    """
+
+    header = source.read(262)
+    kind = sniffArchive(header)
+    if kind is None:
+        return None
+
+    if kind == 'zip':
+        if getattr(source, 'seekable', lambda: False)():
+            source.seek(-len(header), os.SEEK_CUR)
+        else:
+            spool = tempfile.SpooledTemporaryFile(spoolSize)
+            spool.write(header)
+            shutil.copyfileobj(source, spool)
+            spool.seek(0)
+            source = spool
+        with zipfile.ZipFile(source) as zfile:
+            for info in zfile.infolist():
+                path = _memberPath(directory, entryPath('', info.filename), flattener)
+                if not path:
+                    continue
+                if guard:
+                    guard.addFile(path)
+                if path.endswith(os.sep):
+                    if not os.path.isdir(path):
+                        os.makedirs(path)
+                else:
+                    writeEntry(zfile, info, path, guard=guard)
+                    if written is not None:
+                        written.append((path, info.file_size, info.CRC))
+        return kind
+
+    stream = ReplayReader(header, source)
+    mode = 'r|'
+    if kind == 'gzip':
+        mode = 'r|gz'
+    elif kind == 'bzip2':
+        mode = 'r|bz2'
+    elif kind == 'xz':
+        if lzma is None:
+            raise tarfile.CompressionError('lzma module is needed for xz archives')
+        stream = DecompressReader(stream, lzma.LZMADecompressor())
+
+    tar = tarfile.open(fileobj=stream, mode=mode)
+    try:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name == '.':
+                continue
+            if os.path.isabs(name) or name == '..' or name.startswith('..' + os.sep):
+                print "Warning: Skipping archive member outside of the student folder: " + member.name
+                continue
+            path = _memberPath(directory, os.path.join(name, '') if member.isdir() else name, flattener)
+            if not path:
+                continue
+            if member.issym():
+                target = os.path.join(os.path.dirname(path), member.linkname)
+            elif member.islnk():
+                target = os.path.join(directory, member.linkname)
+            else:
+                target = directory
+            if not _insideFolder(directory, target):
+                print "Warning: Skipping archive link to outside of the student folder: " + member.name
+                continue
+            if guard:
+                guard.addFile(path)
+                guard.addBytes(member.size)
+            member.name = os.path.relpath(path, directory).replace(os.sep, '/')
+            if not member.isdir():
+                removeFile(path)
+            tar.extract(member, directory)
+            if written is not None and (member.isreg() or member.islnk()):
+                written.append((path, os.path.getsize(path), fileCrc(path)))
+    finally:
+        tar.close()
+    return kind
+
+
+def fileCrc(path, chunkSize=1024 * 1024):
+    """Return the CRC32 of the file at path, as in ZipInfo."""
+
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunkSize), ''):
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+
+def _memberPath(directory, relative, flattener):
+    """Return where the archive member at relative goes in directory, or None if it is skipped.
+
+    Members in a folder that leads out of directory, through a link extracted before them, are
+    skipped with a warning.
+    """
+
+    if not relative:
+        return None
+    path = flattener.target(directory, relative) if flattener else os.path.join(directory, relative)
+    if path and not _insideFolder(directory, os.path.dirname(path.rstrip(os.sep))):
+        print "Warning: Skipping archive member outside of the student folder: " + relative
+        return None
+    return path
+
+
+def _insideFolder(directory, path):
+    """Check if path, with every link in it followed, is directory or somewhere inside it."""
+
+    root = os.path.realpath(directory)
+    real = os.path.realpath(path)
+    return real == root or real.startswith(os.path.join(root, ''))
+
+
+def unarchive(directory, archive, flattener=None, governor=None):
+    """Extracts an archive file into the given directory and removes it.
+
+    If the file is not an archive, a warning is printed and the file is left in place. If
+    extraction fails partway through, an error is printed and the archive is kept so the user can
+    extract it manually. If it passes one of the governor's limits, it is quarantined.
+
+    Args:
+        directory: directory where files will be extracted to
+        archive: zip or tar file to extract
+        flattener: Flattener rewriting the paths of extracted files (optional)
+        governor: Governor enforcing extraction limits (optional)
+    """
+
+    guard = governor.guard(archive, os.path.getsize(archive)) if governor else None
+    try:
+        with io.open(archive, 'rb') as f:
+            kind = extractArchive(f, directory, flattener=flattener, guard=guard)
+    except LimitExceeded as e:
+        shutil.move(archive, governor.quarantine(guard, str(e)))
+        return
+    except _archiveErrors:
+        print ("Error: Extraction failed. Extract archive manually. "
+                "File: " + archive)
+        return
+
+    if not kind:
+        print ("Warning: Could not open archive. "
+                "The file could have been compressed as another type and renamed. "
+                "File: " + archive)
+        return
+    os.remove(archive)
+
+
+def expandEntry(zfile, info, path, spoolSize=32 * 1024 * 1024, flattener=None, governor=None, written=None):
+    """Extracts an archive a student submitted straight out of the bulk submission zip.
+
+    The archive's contents are extracted next to where the archive itself would have been
+    written, without ever writing the archive to disk. Archives up to spoolSize bytes are read
+    into memory, larger ones are extracted while they are decompressed from the bulk zip (see
+    extractArchive). If the archive cannot be extracted, a warning is printed and it is written to
+    path as is, like unarchive leaves it behind. If it passes one of the governor's limits, it is
+    written to the student's Quarantine folder instead. Given a written list, (path, archive,
+    size, crc) is added to it for every file left on disk, with archive the name of the archive
+    for files extracted from it and None for the archive itself.
+
+    Args:
+        zfile: open bulk submission zip
+        info: ZipInfo of the student's archive
+        path: path the archive would be written to
+        spoolSize: largest archive to extract from memory
+        flattener: Flattener rewriting the paths of extracted files (optional)
+        governor: Governor enforcing extraction limits (optional)
+        written: list of the files written (optional)
+    """
+
+    directory = os.path.dirname(path)
+    if info.file_size <= spoolSize:
+        source = io.BytesIO(zfile.read(info))
+    else:
+        source = zfile.open(info)
+
+    guard = governor.guard(path, info.file_size) if governor else None
+    extracted = []
+    try:
+        with source:
+            kind = extractArchive(source, directory, spoolSize, flattener, guard, extracted)
+    except LimitExceeded as e:
+        quarantined = governor.quarantine(guard, str(e))
+        writeEntry(zfile, info, quarantined)
+        if written is not None:
+            written.append((quarantined, None, info.file_size, info.CRC))
+        return
+    except _archiveErrors:
+        kind = None
+
+    if written is not None:
+        written.extend((name, os.path.basename(path), size, crc) for name, size, crc in extracted)
+    if not kind:
+        print ("Warning: Could not extract archive. "
+                "The file could have been compressed as another type and renamed. "
+                "File: " + path)
+        writeEntry(zfile, info, path)
+        if written is not None:
+            written.append((path, None, info.file_size, info.CRC))
+
+
+class NestedArchive(object):
+    """Read-only random access to the members of an archive a student submitted.
+
+    The archive is spooled to memory (or a temporary file past spoolSize) once, decompressing xz
+    tars on the way, so its members can then be read in any order. Members are keyed by the path
+    they are extracted to with the same rules as extractArchive: folders, '.' and members outside
+    of the archive are left out, and with a Flattener paths are where flattening puts them. kind
+    is None, and there are no members, if source is not an archive.
+    """
+
+    def __init__(self, source, spoolSize=32 * 1024 * 1024, flattener=None):
+        self.members = {}
+        self.archive = None
+        header = source.read(262)
+        self.kind = sniffArchive(header)
+        if self.kind is None:
+            return
+
+        stream = ReplayReader(header, source)
+        if self.kind == 'xz':
+            if lzma is None:
+                raise tarfile.CompressionError('lzma module is needed for xz archives')
+            stream = DecompressReader(stream, lzma.LZMADecompressor())
+        self.spool = tempfile.SpooledTemporaryFile(spoolSize)
+        shutil.copyfileobj(stream, self.spool)
+        self.spool.seek(0)
+
+        if self.kind == 'zip':
+            self.archive = zipfile.ZipFile(self.spool)
+            members = [(entryPath('', info.filename), info) for info in self.archive.infolist()]
+        else:
+            self.archive = tarfile.open(fileobj=self.spool)
+            members = [(self._memberName(member), member) for member in self.archive if member.isfile()]
+        for name, member in members:
+            if not name or name.endswith(os.sep):
+                continue
+            if flattener:
+                name = flattener.path(name)
+            self.members.setdefault(name, member)
+
+    def open(self, name):
+        """Return a file object with the bytes of the member at name.
+
+        Members are read whole, as the spooled archive can only be read at one place at a time.
+        """
+
+        member = self.members[name]
+        if self.kind == 'zip':
+            return io.BytesIO(self.archive.read(member))
+        return io.BytesIO(self.archive.extractfile(member).read())
+
+    def stat(self, name):
+        """Return (size, date_time) of the member at name, with date_time as in ZipInfo."""
+
+        member = self.members[name]
+        if self.kind == 'zip':
+            return member.file_size, member.date_time
+        return member.size, time.localtime(member.mtime)[:6]
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.spool.close()
+
+    def _memberName(self, member):
+        """Return the path a tar member is extracted to, or None if extractArchive skips it."""
+
+        name = os.path.normpath(member.name)
+        if name == '.' or os.path.isabs(name) or name == '..' or name.startswith('..' + os.sep):
+            return None
+        return name
+
+
+class SubmissionView(object):
+    """Read-only view of the student folders a bulk submission zip extracts to, without extracting it.
+
+    Students and file paths follow the manager's naming rules, the same as extraction, including
+    T-Square's Text folder and the move option. Nothing is read from the zip until a file is
+    opened, and then only that file is decompressed. Archives a student submitted are opened the
+    first time a file is looked up that one of them could provide, and stay open until the view is
+    closed. Unless the move option is set, that is any file, since an archive's file replaces a
+    submitted file of the same name. Usable as a context manager:
+
+        with manager.view('submissions.zip') as view:
+            for student in view.students():
+                source = view[student].open('hw.c').read()
+    """
+
+    def __init__(self, manager, zippy, spoolSize=32 * 1024 * 1024):
+        self.manager = manager
+        self.spoolSize = spoolSize
+        self.flattener = manager._flattener(manager.flatten)
+        self.zfile = CentralDirectory(zippy)
+        self._entries = {}
+        self._planned = {}
+        self._folders = {}
+        for info, student, filename, reason in manager._layout(self.zfile):
+            if student is None:
+                continue
+            entries = self._entries.setdefault(student, {})
+            planned = self._planned.setdefault(student, set())
+            if reason:
+                continue
+            if filename.endswith(os.sep):
+                planned.add(filename.rstrip(os.sep))
+            else:
+                entries[filename] = info
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getitem__(self, student):
+        if student not in self._folders:
+            self._folders[student] = StudentView(self, student, self._entries[student], self._planned[student])
+        return self._folders[student]
+
+    def __contains__(self, student):
+        return student in self._entries
+
+    def __iter__(self):
+        return iter(self.students())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def students(self):
+        """Return the sorted names of the students with a folder."""
+
+        return sorted(self._entries)
+
+    def close(self):
+        """Close the bulk submission zip and every archive opened from it."""
+
+        for folder in self._folders.values():
+            folder.close()
+        self.zfile.close()
+
+    def _openArchive(self, info):
+        """Return the NestedArchive of a student's archive, with kind None if it can't be opened."""
+
+        try:
+            with self.zfile.open(info) as source:
+                return NestedArchive(source, self.spoolSize, self.flattener)
+        except _archiveErrors:
+            return NestedArchive(io.BytesIO(''))
+
+
+class StudentView(object):
+    """Read-only view of one student's folder in a SubmissionView."""
+
+    def __init__(self, view, student, entries, planned=()):
+        self.view = view
+        self.student = student
+        self.entries = entries
+        self.planned = planned
+        self._members = None
+        self._origins = {}
+
+    def __contains__(self, name):
+        path = self._path(name)
+        if path in self.entries and not self.view.manager._expandsInStream(path):
+            return True
+        return path in self._index()
+
+    def files(self):
+        """Return the sorted paths of every file in the folder, including those extracted from archives."""
+
+        return sorted(self._index())
+
+    def folders(self):
+        """Return the sorted paths of every folder in the folder, the ones files are in and empty ones."""
+
+        folders = set(self.planned)
+        for name in self._index():
+            name = os.path.dirname(name)
+            while name and name not in folders:
+                folders.add(name)
+                name = os.path.dirname(name)
+        return sorted(folders)
+
+    def stat(self, name):
+        """Return (size, date_time) of the file at name, with date_time as in ZipInfo.
+
+        Raises:
+            IOError: if the folder has no such file
+        """
+
+        path = self._path(name)
+        if path not in self._index():
+            raise IOError("No such file in {student}'s submission: {name}".format(student=self.student, name=name))
+        archive, member = self._index()[path]
+        if archive is None:
+            return member.file_size, member.date_time
+        return archive.stat(member)
+
+    def origin(self, name):
+        """Return (entry, archive) for the file at name.
+
+        entry is the ZipInfo of the bulk zip entry the file comes from and archive the name of the
+        submitted archive it was extracted from (None if it is directly in the zip).
+        """
+
+        path = self._path(name)
+        if path not in self._index():
+            raise IOError("No such file in {student}'s submission: {name}".format(student=self.student, name=name))
+        archive, member = self._index()[path]
+        if archive is None:
+            return member, None
+        return self._origins[path]
+
+    def open(self, name):
+        """Return a read-only file object with the contents of the file at name in the folder.
+
+        Raises:
+            IOError: if the folder has no such file
+        """
+
+        path = self._path(name)
+        if self.view.flattener and path in self.entries and not self.view.manager._expandsInStream(path):
+            return self.view.zfile.open(self.entries[path])
+        if path not in self._index():
+            raise IOError("No such file in {student}'s submission: {name}".format(student=self.student, name=name))
+        archive, member = self._index()[path]
+        if archive is None:
+            return self.view.zfile.open(member)
+        return archive.open(path)
+
+    def close(self):
+        """Close the student's archives. They are opened again if needed."""
+
+        for archive, member in (self._members or {}).values():
+            if archive is not None:
+                archive.close()
+        self._members = None
+
+    def _path(self, name):
+        return os.path.normpath(name.replace('/', os.sep))
+
+    def _index(self):
+        """Return every file in the folder mapped to (NestedArchive or None, member), opening the
+        student's archives the first time.
+
+        Like extraction, files directly in the zip come first, then the archives' files in order of
+        the archives' names. A file extracted from an archive replaces one already at its path,
+        unless folders are flattened, where the first one is kept. An archive that can't be opened
+        is a file of its own.
+        """
+
+        if self._members is None:
+            members = {}
+            archives = []
+            for filename, info in sorted(self.entries.items()):
+                if self.view.manager._expandsInStream(filename):
+                    archives.append((filename, info))
+                else:
+                    members[filename] = (None, info)
+            for filename, info in archives:
+                archive = self.view._openArchive(info)
+                if archive.kind is None:
+                    members[filename] = (None, info)
+                for name in archive.members:
+                    if name not in members or not self.view.flattener:
+                        members[name] = (archive, name)
+                        self._origins[name] = (info, filename)
+            self._members = members
+        return self._members
+
+
+class ArchiveSink(object):
+    """Writes student folders into a single tar stream instead of a directory tree.
+
+    The compression is picked from the file name: .tar, .tar.gz (or .tgz), .tar.bz2 (or .tbz2)
+    and .tar.zst (or .tzst), which needs the zstandard module. With path '-' the tar is written
+    to stdout, uncompressed. Any other name raises ValueError.
     """
 
-    for fn in os.listdir(directory) :
-        if fn.endswith('.zip') :
-            unzip(directory, os.path.join(directory, fn))
-        if fn.find('.tar') >= 0 :
-            untar(directory, os.path.join(directory, fn))
+    suffixes = (('.tar', 'w|'), ('.tar.gz', 'w|gz'), ('.tgz', 'w|gz'), ('.tar.bz2', 'w|bz2'), ('.tbz2', 'w|bz2'),
+                ('.tar.zst', 'zst'), ('.tzst', 'zst'))
+
+    def __init__(self, path):
+        self.path = path
+        self.files = 0
+        self.bytes = 0
+        self._compressor = None
+        self._output = None
+
+        mode = self.mode(path)
+        if mode is None:
+            raise ValueError('Unsupported archive type: ' + path)
+        if mode == 'zst' and zstandard is None:
+            raise tarfile.CompressionError('zstandard module is needed for .zst archives')
+        if path == '-':
+            out = sys.__stdout__
+        else:
+            out = self._output = open(path, 'wb')
+        if mode == 'zst':
+            out = self._compressor = zstandard.ZstdCompressor().stream_writer(out)
+            mode = 'w|'
+        self.tar = tarfile.open(fileobj=out, mode=mode)
+
+    @classmethod
+    def mode(cls, path):
+        """Return the tarfile mode for writing to path ('zst' for zstandard), or None if it is not supported."""
+
+        if path == '-':
+            return 'w|'
+        for suffix, mode in cls.suffixes:
+            if path.endswith(suffix):
+                return mode
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def addFolder(self, name, dateTime=None):
+        """Add a folder at name (a relative path) to the archive."""
+
+        member = self._member(name, dateTime)
+        member.type = tarfile.DIRTYPE
+        member.mode = 0755
+        self.tar.addfile(member)
+
+    def addFile(self, name, source, size, dateTime=None):
+        """Add size bytes read from the file object source to the archive as the file at name."""
+
+        member = self._member(name, dateTime)
+        member.size = size
+        member.mode = 0644
+        self.tar.addfile(member, source)
+        self.files += 1
+        self.bytes += size
+
+    def close(self):
+        """Finish the archive and its compression, leaving stdout open."""
+
+        self.tar.close()
+        if self._compressor is not None:
+            self._compressor.flush(zstandard.FLUSH_FRAME)
+        if self._output is not None:
+            self._output.close()
+        else:
+            sys.__stdout__.flush()
+
+    def _member(self, name, dateTime):
+        member = tarfile.TarInfo(name.replace(os.sep, '/'))
+        if dateTime:
+            member.mtime = time.mktime(tuple(dateTime) + (0, 0, -1))
+        else:
+            member.mtime = time.time()
+        return member
+
+
+class IndexWriter(object):
+    """Writes one record per extracted file to a JSON Lines file, or an SQLite database.
+
+    Files ending in .db, .sqlite or .sqlite3 are SQLite databases with a single 'files' table,
+    anything else gets one json object per line. Every record has the fields in columns.
+    """
+
+    columns = ('student', 'section', 'source', 'path', 'size', 'crc', 'late', 'archive')
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self.database = os.path.splitext(path)[1] in ('.db', '.sqlite', '.sqlite3')
+        if self.database:
+            if os.path.exists(path):
+                os.remove(path)
+            self._connection = sqlite3.connect(path)
+            self._connection.execute('CREATE TABLE files (student TEXT, section TEXT, source TEXT, path TEXT,'
+                                     ' size INTEGER, crc TEXT, late INTEGER, archive TEXT)')
+        else:
+            self._file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, record):
+        """Add a record, a dictionary with the index's columns."""
+
+        if self.database:
+            self._connection.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     [record[column] for column in self.columns])
+        else:
+            self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.records += 1
+
+    def close(self):
+        if self.database:
+            self._connection.execute('CREATE INDEX files_student ON files (student)')
+            self._connection.commit()
+            self._connection.close()
+        else:
+            self._file.close()
+
+
+def prepareTimeCheck(time):
+    """Prepares user input timestamp for later use
+
+    Takes in a timestamp in the format 'mm/dd/yy HH:MM' to be used as a due date for an assignment and
+    converts it into a localized datetime object. This feature only works if the user has the pytz
+    module installed.
+
+    Args:
+        time: duedate timestamp in format 'mm/dd/yy HH:MM'
+    """
+    if not findTime :
+        print "\nModule pytz not found. To use the late submission checking feature, please install pytz.\n"
+        return None
+
+    duetime = datetime.strptime(time[0] + " " + time[1], "%m/%d/%y %H:%M")
+    duetime = _eastern.localize(duetime)
+    return duetime
+
+# manager of a process pool worker, set once per worker by _initWorker
+_workerManager = None
+
+def _initWorker(manager):
+    """Keep the manager in a process pool worker, so it is handed over once instead of with every call."""
+
+    global _workerManager
+    _workerManager = manager
+
+def _callMethod(args, manager=None):
+    """Call a manager method from a process pool worker.
+
+    Python 2 cannot pickle bound methods, so pool workers are handed the method name and its
+    arguments, and call it on the manager _initWorker kept. Outside of a pool, the manager is
+    passed in instead.
+
+    Args:
+        args: tuple of (method name, tuple of arguments)
+        manager: manager to call the method on instead of the worker's (optional)
+    """
+
+    name, params = args
+    return getattr(_workerManager if manager is None else manager, name)(*params)
+
+def _timedCall(args, manager=None):
+    """Call a manager method like _callMethod and return (seconds taken, result)."""
+
+    start = time.time()
+    result = _callMethod(args, manager)
+    return time.time() - start, result
+
+class CentralDirectory(zipfile.ZipFile):
+    """Read-only zip whose central directory is read one entry at a time.
+
+    ZipFile reads the whole central directory and keeps a ZipInfo for every entry while it is
+    open, which for the 100k entry zips of large classes is a lot of memory held for the whole
+    run. This only finds where the central directory is when opened, and entries() parses it in
+    small chunks, so memory does not grow with the number of entries. namelist, infolist and
+    getinfo are empty; entries are opened by their ZipInfo.
+    """
+
+    def _RealGetContents(self):
+        try:
+            endrec = zipfile._EndRecData(self.fp)
+        except IOError:
+            raise zipfile.BadZipfile("File is not a zip file")
+        if not endrec:
+            raise zipfile.BadZipfile("File is not a zip file")
+
+        self._size = endrec[zipfile._ECD_SIZE]
+        # concat is zero, unless the zip was appended to another file
+        self._concat = endrec[zipfile._ECD_LOCATION] - self._size - endrec[zipfile._ECD_OFFSET]
+        if endrec[zipfile._ECD_SIGNATURE] == zipfile.stringEndArchive64:
+            self._concat -= zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+        self.start_dir = endrec[zipfile._ECD_OFFSET] + self._concat
+        self._comment = endrec[zipfile._ECD_COMMENT]
+
+    def entries(self, chunkSize=64 * 1024):
+        """Yield the ZipInfo of every entry in the order of the central directory."""
+
+        position = self.start_dir
+        end = self.start_dir + self._size
+        buf = ''
+        while position < end or buf:
+            while len(buf) < zipfile.sizeCentralDir:
+                chunk = self._readDirectory(position, end, chunkSize)
+                position += len(chunk)
+                buf += chunk
+
+            centdir = struct.unpack(zipfile.structCentralDir, buf[:zipfile.sizeCentralDir])
+            if centdir[zipfile._CD_SIGNATURE] != zipfile.stringCentralDir:
+                raise zipfile.BadZipfile("Bad magic number for central directory")
+            nameLength = centdir[zipfile._CD_FILENAME_LENGTH]
+            extraLength = centdir[zipfile._CD_EXTRA_FIELD_LENGTH]
+            recordLength = zipfile.sizeCentralDir + nameLength + extraLength + centdir[zipfile._CD_COMMENT_LENGTH]
+            while len(buf) < recordLength:
+                chunk = self._readDirectory(position, end, chunkSize)
+                position += len(chunk)
+                buf += chunk
+
+            record, buf = buf[:recordLength], buf[recordLength:]
+            yield self._entryInfo(centdir, record, nameLength, extraLength)
+
+    def _readDirectory(self, position, end, chunkSize):
+        """Read the next chunk of the central directory, starting at position."""
+
+        # the handle may have been used to read entries since the last chunk
+        self.fp.seek(position)
+        chunk = self.fp.read(min(chunkSize, end - position))
+        if not chunk:
+            raise zipfile.BadZipfile("Truncated central directory")
+        return chunk
+
+    def _entryInfo(self, centdir, record, nameLength, extraLength):
+        """Build the ZipInfo of a central directory record the same way ZipFile does."""
+
+        start = zipfile.sizeCentralDir
+        info = zipfile.ZipInfo(record[start:start + nameLength])
+        info.extra = record[start + nameLength:start + nameLength + extraLength]
+        info.comment = record[start + nameLength + extraLength:]
+        info.header_offset = centdir[zipfile._CD_LOCAL_HEADER_OFFSET]
+        (info.create_version, info.create_system, info.extract_version, info.reserved,
+            info.flag_bits, info.compress_type, t, d,
+            info.CRC, info.compress_size, info.file_size) = centdir[1:12]
+        info.volume, info.internal_attr, info.external_attr = centdir[15:18]
+        info._raw_time = t
+        info.date_time = ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F, t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
+        info._decodeExtra()
+        info.header_offset += self._concat
+        info.filename = info._decodeFilename()
+        return info
+
+class GrowingFile(object):
+    """Read-only file that waits for more bytes at the end of a file that is still being written.
+
+    The file is finished once finished (a threading.Event) is set or, without one, once it has not
+    grown for idle seconds. Only then do reads come up short, and ended is set.
+    """
+
+    def __init__(self, path, idle=30, finished=None, poll=0.2):
+        self.file = io.open(path, 'rb')
+        self.idle = idle
+        self.finished = finished
+        self.poll = poll
+        self.ended = False
+
+    def read(self, size):
+        """Read size bytes, waiting for them to be written if needed."""
+
+        data = ''
+        while len(data) < size:
+            chunk = self.readsome(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def readsome(self, size):
+        """Read up to size bytes, only waiting if there are none yet. Returns '' once the file is finished."""
+
+        return self._waitFor(lambda: self.file.read(size))
+
+    def skip(self, count):
+        """Move count bytes ahead, waiting for them to be written. Returns False if the file ends first."""
+
+        target = self.file.tell() + count
+        if not self._waitFor(lambda: os.fstat(self.file.fileno()).st_size >= target):
+            return False
+        self.file.seek(target)
+        return True
+
+    def drain(self):
+        """Wait for the file to be finished."""
+
+        self._waitFor(lambda: False)
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, position):
+        self.file.seek(position)
+
+    def close(self):
+        self.file.close()
+
+    def _waitFor(self, check):
+        """Return the result of check once it is true, or its false result once the file is finished."""
+
+        waited = 0
+        while True:
+            # checked before, so bytes written just before the file is finished are still read
+            done = self.finished is not None and self.finished.is_set()
+            result = check()
+            if result:
+                return result
+            if done or (self.finished is None and waited >= self.idle):
+                self.ended = True
+                return result
+            time.sleep(self.poll)
+            waited += self.poll
+
+class LocalHeaders(zipfile.ZipFile):
+    """Read-only zip read front to back from its local file headers, while it is still being written.
+
+    The central directory is only at the end of a zip, so CentralDirectory can't start on a bulk
+    zip that is still downloading (or read from stdin). entries() instead walks the local header in
+    front of every entry and yields its ZipInfo as soon as all of the entry's data has arrived (see
+    GrowingFile for when the file counts as finished). The size of entries written with a data
+    descriptor is found by decompressing them, or for stored entries by finding the descriptor.
+    Once the central directory has arrived it is checked against the entries seen: entries that
+    could not be walked are yielded from it and entries with another size or CRC are listed in
+    mismatched. If the file ends first, truncated is set and only the complete entries before the
+    end are yielded. The zip must be given by path; entries are opened by ZipInfo, as with
+    CentralDirectory.
+    """
+
+    def __init__(self, path, idle=30, finished=None, poll=0.2, chunkSize=64 * 1024):
+        self.idle = idle
+        self.finished = finished
+        self.poll = poll
+        self.chunkSize = chunkSize
+        self.truncated = False
+        self.mismatched = []
+        zipfile.ZipFile.__init__(self, path)
+
+    def _RealGetContents(self):
+        # entries are found by walking the zip, not from its central directory
+        pass
+
+    def entries(self):
+        """Yield the ZipInfo of every entry in the order of the zip, as soon as it is complete."""
+
+        stream = GrowingFile(self.filename, self.idle, self.finished, self.poll)
+        seen = {}
+        try:
+            while True:
+                position = stream.tell()
+                signature = stream.read(4)
+                if signature != zipfile.stringFileHeader:
+                    break
+                info = self._walkEntry(stream, position)
+                if info is None:
+                    break
+                seen[position] = info
+                yield info
+
+            if signature in (zipfile.stringCentralDir, zipfile.stringEndArchive64, zipfile.stringEndArchive):
+                self._walkDirectory(stream, signature)
+            elif not stream.ended:
+                # an entry that can't be walked, so the rest can only be found in the central directory
+                stream.drain()
+        finally:
+            stream.close()
+
+        try:
+            central = CentralDirectory(self.filename)
+        except zipfile.BadZipfile:
+            self.truncated = True
+            return
+        with central:
+            for info in central.entries():
+                local = seen.get(info.header_offset)
+                if local is None:
+                    yield info
+                elif ((local.filename, local.CRC, local.compress_size, local.file_size) !=
+                        (info.filename, info.CRC, info.compress_size, info.file_size)):
+                    self.mismatched.append(info.filename)
+
+    def _walkEntry(self, stream, position):
+        """Read the local header and data of the entry at position, whose signature was just read.
+
+        Returns:
+            ZipInfo of the entry, or None if the file ends first or the entry's size can't be found
+        """
+
+        header = stream.read(zipfile.sizeFileHeader - 4)
+        if len(header) < zipfile.sizeFileHeader - 4:
+            return None
+        fheader = struct.unpack(zipfile.structFileHeader, zipfile.stringFileHeader + header)
+        nameLength = fheader[zipfile._FH_FILENAME_LENGTH]
+        extraLength = fheader[zipfile._FH_EXTRA_FIELD_LENGTH]
+        name = stream.read(nameLength)
+        extra = stream.read(extraLength)
+        if len(name) < nameLength or len(extra) < extraLength:
+            return None
+
+        info = zipfile.ZipInfo(name)
+        info.extra = extra
+        info.header_offset = position
+        (info.extract_version, _, info.flag_bits, info.compress_type, t, d,
+            info.CRC, info.compress_size, info.file_size) = fheader[1:10]
+        info._raw_time = t
+        info.date_time = ((d >> 9) + 1980, (d >> 5) & 0xF, d & 0x1F, t >> 11, (t >> 5) & 0x3F, (t & 0x1F) * 2)
+        info._decodeExtra()
+        info.filename = info._decodeFilename()
+
+        start = stream.tell()
+        if not info.flag_bits & 0x08:
+            return info if stream.skip(info.compress_size) else None
+
+        # sizes and CRC follow the data in a descriptor, with 8 byte sizes if the entry is zip64
+        zip64 = self._hasZip64(extra)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            size = self._deflatedSize(stream)
+        elif info.compress_type == zipfile.ZIP_STORED:
+            size = self._storedSize(stream, zip64)
+        else:
+            size = None
+        if size is None:
+            return None
+
+        stream.seek(start + size)
+        descriptor = stream.read(24 if zip64 else 16)
+        signed = descriptor.startswith(_descriptor_signature)
+        if signed:
+            descriptor = descriptor[4:]
+        fields = '<LQQ' if zip64 else '<LLL'
+        length = struct.calcsize(fields)
+        if len(descriptor) < length:
+            return None
+        info.CRC, info.compress_size, info.file_size = struct.unpack(fields, descriptor[:length])
+        if info.compress_size != size:
+            return None
+        stream.seek(start + size + length + (4 if signed else 0))
+        return info
+
+    def _hasZip64(self, extra):
+        """Check if a local header's extra field has a zip64 record."""
+
+        while len(extra) >= 4:
+            kind, length = struct.unpack('<HH', extra[:4])
+            if kind == 1:
+                return True
+            extra = extra[4 + length:]
+        return False
+
+    def _deflatedSize(self, stream):
+        """Return the compressed size of the deflated data at the stream's position, or None if it ends first."""
+
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        size = 0
+        while not decompressor.unused_data:
+            chunk = stream.readsome(self.chunkSize)
+            if not chunk:
+                return None
+            size += len(chunk)
+            # inflate a chunk at a time, so a zip bomb can't fill memory
+            data = chunk
+            while data and not decompressor.unused_data:
+                decompressor.decompress(data, self.chunkSize)
+                data = decompressor.unconsumed_tail
+        return size - len(decompressor.unused_data)
+
+    def _storedSize(self, stream, zip64):
+        """Return the size of the stored data at the stream's position, found from the signed data
+        descriptor after it, or None if the file ends first.
+        """
+
+        fields = '<4sLQQ' if zip64 else '<4sLLL'
+        length = struct.calcsize(fields)
+        offset = 0
+        buf = ''
+        while True:
+            chunk = stream.readsome(self.chunkSize)
+            if not chunk:
+                return None
+            buf += chunk
+            i = buf.find(_descriptor_signature)
+            while i >= 0 and i + length <= len(buf):
+                _, crc, compressSize, fileSize = struct.unpack(fields, buf[i:i + length])
+                if compressSize == fileSize == offset + i:
+                    return offset + i
+                i = buf.find(_descriptor_signature, i + 1)
+            # keep a descriptor that is not all there yet, or what could be the start of a signature
+            start = i if i >= 0 else max(len(buf) - len(_descriptor_signature) + 1, 0)
+            offset += start
+            buf = buf[start:]
+
+    def _walkDirectory(self, stream, signature):
+        """Read up to the end of the central directory, whose first signature was just read.
+
+        Returns:
+            True if the whole central directory arrived, False if the file ended first
+        """
+
+        while signature != zipfile.stringEndArchive:
+            if signature == zipfile.stringCentralDir:
+                record = stream.read(zipfile.sizeCentralDir - 4)
+                if len(record) < zipfile.sizeCentralDir - 4:
+                    return False
+                centdir = struct.unpack(zipfile.structCentralDir, signature + record)
+                skip = (centdir[zipfile._CD_FILENAME_LENGTH] + centdir[zipfile._CD_EXTRA_FIELD_LENGTH] +
+                        centdir[zipfile._CD_COMMENT_LENGTH])
+            elif signature == zipfile.stringEndArchive64:
+                size = stream.read(8)
+                if len(size) < 8:
+                    return False
+                skip = struct.unpack('<Q', size)[0]
+            elif signature == zipfile.stringEndArchive64Locator:
+                skip = zipfile.sizeEndCentDir64Locator - 4
+            else:
+                return False
+            if not stream.skip(skip):
+                return False
+            signature = stream.read(4)
+
+        record = stream.read(zipfile.sizeEndCentDir - 4)
+        if len(record) < zipfile.sizeEndCentDir - 4:
+            return False
+        return stream.skip(struct.unpack(zipfile.structEndArchive, signature + record)[zipfile._ECD_COMMENT_SIZE])
+
+def spoolStream(source, chunkSize=64 * 1024):
+    """Copy a stream such as stdin to a temporary zip file on a background thread.
+
+    Returns:
+        (path, finished): path of the temporary file, which the caller removes, and a
+        threading.Event set once the whole stream is copied, to read it with LocalHeaders
+    """
+
+    handle, path = tempfile.mkstemp(prefix='submissions_', suffix='.zip')
+    finished = threading.Event()
+
+    def copy():
+        try:
+            with os.fdopen(handle, 'wb') as dest:
+                for chunk in iter(lambda: os.read(source.fileno(), chunkSize), ''):
+                    dest.write(chunk)
+                    dest.flush()
+        finally:
+            finished.set()
+
+    worker = threading.Thread(target=copy)
+    worker.daemon = True
+    worker.start()
+    return path, finished
+
+def zipEntries(zfile):
+    """Iterate over the ZipInfo of every entry, lazily if zfile is a CentralDirectory or LocalHeaders."""
+
+    if isinstance(zfile, (CentralDirectory, LocalHeaders)):
+        return zfile.entries()
+    return iter(zfile.infolist())
+
+def entryPath(directory, filename):
+    """Return the path a zip entry is extracted to, dropping unsafe path parts like ZipFile.extract."""
+
+    parts = [p for p in filename.split('/') if p not in ('', '.', '..')]
+    path = os.path.join(directory, *parts)
+    if filename.endswith('/'):
+        path = os.path.join(path, '')
+    return path
+
+def removeFile(path):
+    """Remove the file or link at path, if any, so writing there never changes a file linked to it."""
+
+    if os.path.islink(path) or os.path.isfile(path):
+        os.remove(path)
+
+def writeEntry(zfile, info, path, chunkSize=1024 * 1024, guard=None):
+    """Decompress a single zip entry to the given path, creating parent folders as needed.
+
+    A file already at path is replaced rather than written over, so files --dedup linked to it
+    keep their contents. With an ArchiveGuard, every chunk is counted before it is written, so a
+    file that decompresses to far more than its stated size is stopped once it passes the
+    extraction limits.
+    """
+
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+    removeFile(path)
+    with zfile.open(info) as source, open(path, 'wb') as dest:
+        if guard is None:
+            shutil.copyfileobj(source, dest, chunkSize)
+            return
+        for chunk in iter(lambda: source.read(chunkSize), ''):
+            guard.addBytes(len(chunk))
+            dest.write(chunk)
+
+class ByteBudget(object):
+    """Counts bytes held in memory by extraction threads, blocking when the budget is used up."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self.limit)
+        with self._condition:
+            while self.used and self.used + size > self.limit:
+                self._condition.wait()
+            self.used += size
+        return size
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+class EntryWriter(object):
+    """Writes zip entries to disk, decompressing them on several threads if asked.
+
+    Each thread opens its own handle on the zip and pulls groups of (entry, path) tasks from a
+    shared queue, so entries are decompressed in parallel (zlib releases the GIL while inflating).
+    Every entry is copied in chunks of at most chunkSize bytes and the chunks held by all threads
+    together never exceed the byte budget. Submitted archives that are extracted in memory count
+    against the budget with their full size, up to spoolSize. With a single thread, entries are
+    written as soon as their group is complete.
+
+    Entries may be handed over in groups, one per student folder (see group()). Each group is
+    written on a single thread: its plain entries first, then its submitted archives in order of
+    their names, like extract() does after the zip is extracted. So an archive's file replaces a
+    submitted file of the same name, or with a Flattener the submitted file is the one kept, and
+    two of a student's archives never take the same flattened path. Once a group is written, done
+    is called with its folder on the thread that wrote it, and the seconds it took are added to
+    times. With record set, done is also handed a list of (path, source, archive, size, crc) for
+    every file the group wrote, in the order they were written, with source the name of the zip
+    entry and archive as in expandEntry (else None). Entries handed over outside a group are each
+    a group of their own.
+
+    With dedup set, entries with the same CRC32 and size in the central directory are only written
+    once. The rest are left to the end of their group and, once the group of the first copy is
+    written too, checked with a SHA-1 against the first copy as it is on disk, since an archive may
+    have extracted over it. Identical ones share the first copy's data: as a copy-on-write clone
+    where the file system supports it (btrfs, XFS), else as a hardlink. They are written normally
+    if they differ or neither works. Writing a file anywhere else replaces it, so a hardlinked copy
+    never changes.
+
+    With a Flattener, submitted archives are extracted straight to their flattened location. With
+    a Governor, they are held to its extraction limits. Every handle on the zip is opened with
+    opener, such as LocalHeaders for a zip that is still being written.
+    """
+
+    def __init__(self, zippy, threads=1, budget=64 * 1024 * 1024, chunkSize=1024 * 1024,
+                 spoolSize=32 * 1024 * 1024, dedup=False, flattener=None, governor=None, opener=CentralDirectory,
+                 done=None, record=False):
+        self.zippy = zippy
+        self.opener = opener
+        self.threads = threads
+        self.chunkSize = chunkSize
+        self.spoolSize = spoolSize
+        self.dedup = dedup
+        self.flattener = flattener
+        self.governor = governor
+        self.done = done
+        self.record = record
+        self.times = {}
+        self.linked = 0
+        self.cloned = 0
+        self.savedBytes = 0
+        self._group = None
+        self._copies = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self._budget = ByteBudget(budget)
+        self._errors = []
+        self._workers = []
+        self._zfile = None
+
+        if threads > 1:
+            self._queue = Queue.Queue(threads * 4)
+            for _ in range(threads):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        else:
+            self._zfile = opener(zippy)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def group(self, folder=None):
+        """Start a new group of entries for folder, handing over the one before it to be written."""
+
+        self._endGroup()
+        self._group = _EntryGroup(folder, self.record)
+
+    def _endGroup(self):
+        if self._group is not None:
+            self._dispatch(self._group)
+        self._group = None
+
+    def write(self, info, path, expand=False):
+        """Queue a zip entry to be written to path. Entries ending in '/' only create the folder.
+
+        If expand is set, the entry is a submitted archive whose contents are extracted into the
+        folder of path instead (see expandEntry).
+        """
+
+        if info.filename.endswith('/'):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            return
+
+        group = self._group or _EntryGroup(record=self.record)
+        if self.dedup and not expand and info.file_size:
+            key = (info.CRC, info.file_size)
+            if key in self._copies:
+                group.duplicates.append((info, path, key))
+            else:
+                self._copies[key] = (path, group)
+                group.entries.append((info, path, expand))
+        elif expand:
+            group.expansions.append((info, path, expand))
+        else:
+            group.entries.append((info, path, expand))
+
+        if self._group is None:
+            self._dispatch(group)
+
+    def close(self):
+        """Wait for all queued entries to be written. Reraises the first error a thread ran into."""
+
+        self._endGroup()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if self._zfile:
+            self._zfile.close()
+            self._zfile = None
+        if self._errors:
+            raise self._errors[0]
+        if self.dedup:
+            print "Linked {linked} identical files, saving {saved} bytes.".format(linked=self.linked,
+                                                                                saved=self.savedBytes)
+
+    def _dispatch(self, group):
+        """Hand a group to a single thread, to be written in order."""
+
+        if self._workers:
+            self._queue.put(group)
+        else:
+            self._writeGroup(self._zfile, group)
+
+    def _writeGroup(self, zfile, group):
+        start = time.time()
+        try:
+            for info, path, expand in group.entries + sorted(group.expansions, key=lambda task: task[1]):
+                if self._errors:
+                    return
+                size = self.spoolSize if expand else self.chunkSize
+                held = self._budget.acquire(min(info.file_size, size)) if self._workers else 0
+                try:
+                    self._materialize(zfile, info, path, expand, held or self.chunkSize, group.files)
+                finally:
+                    self._budget.release(held)
+            for info, path, key in group.duplicates:
+                self._linkDuplicate(zfile, info, path, key, group)
+        finally:
+            group.written.set()
+        if group.folder is not None:
+            with self._lock:
+                self.times[group.folder] = self.times.get(group.folder, 0.0) + time.time() - start
+            if self.done:
+                self.done(group.folder, group.files)
+
+    def _linkDuplicate(self, zfile, info, path, key, group):
+        """Link an entry held back as a duplicate to the first copy written, if really identical."""
+
+        copyPath, copyGroup = self._copies[key]
+        if copyGroup is not group:
+            copyGroup.written.wait()
+        if copyPath not in self._hashes:
+            self._hashes[copyPath] = self._hashFile(copyPath)
+
+        if self._hashEntry(zfile, info) == self._hashes[copyPath] and self._link(copyPath, path):
+            with self._lock:
+                self.linked += 1
+                self.savedBytes += info.file_size
+        else:
+            writeEntry(zfile, info, path, self.chunkSize)
+        if group.files is not None:
+            group.files.append((path, info.filename, None, info.file_size, info.CRC))
+
+    def _hashEntry(self, zfile, info):
+        with zfile.open(info) as source:
+            return self._hash(source)
+
+    def _hashFile(self, path):
+        """Return the SHA-1 of the file at path, or None if it is gone (such as a quarantined copy)."""
+
+        try:
+            with open(path, 'rb') as source:
+                return self._hash(source)
+        except IOError:
+            return None
+
+    def _hash(self, source):
+        sha = hashlib.sha1()
+        for chunk in iter(lambda: source.read(self.chunkSize), ''):
+            sha.update(chunk)
+        return sha.digest()
+
+    def _link(self, source, path):
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        removeFile(path)
+        if self._clone(source, path):
+            with self._lock:
+                self.cloned += 1
+            return True
+        try:
+            os.link(source, path)
+        except (OSError, AttributeError):
+            return False
+        return True
+
+    def _clone(self, source, path):
+        """Make path a copy-on-write clone of source (Linux FICLONE), returning False where unsupported."""
+
+        if fcntl is None:
+            return False
+        try:
+            with open(source, 'rb') as src, open(path, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), _FICLONE, src.fileno())
+        except IOError:
+            removeFile(path)
+            return False
+        return True
+
+    def _work(self):
+        with self.opener(self.zippy) as zfile:
+            while True:
+                group = self._queue.get()
+                if group is None:
+                    break
+
+                try:
+                    self._writeGroup(zfile, group)
+                except Exception as e:
+                    self._errors.append(e)
+
+    def _materialize(self, zfile, info, path, expand, chunkSize, files=None):
+        if expand:
+            written = None if files is None else []
+            expandEntry(zfile, info, path, self.spoolSize, self.flattener, self.governor, written)
+            if files is not None:
+                files.extend((name, info.filename, archive, size, crc) for name, archive, size, crc in written)
+        else:
+            writeEntry(zfile, info, path, chunkSize)
+            if files is not None:
+                files.append((path, info.filename, None, info.file_size, info.CRC))
+
+class _EntryGroup(object):
+    """The entries, submitted archives and held back duplicates of one EntryWriter group.
+
+    files lists the files written for the group if they are recorded, else it is None.
+    """
+
+    def __init__(self, folder=None, record=False):
+        self.folder = folder
+        self.entries = []
+        self.expansions = []
+        self.duplicates = []
+        self.files = [] if record else None
+        self.written = threading.Event()
+
+class NameIndex(object):
+    """Case-insensitive index of student names for constant time lookups.
+
+    Each name is normalized once when it is added: uppercased for matching names from a csv or
+    a section list, and squished (uppercased with non-word characters removed) for matching the
+    names Canvas puts in front of submission files.
+    """
+
+    _nonWord = re.compile(r'\W+')
+
+    def __init__(self, names=()):
+        self.names = {}
+        self.squished = {}
+        for name in names:
+            self.add(name)
+
+    @classmethod
+    def fromRoll(cls, roster):
+        """Create an index from a roll dictionary that already maps squished names to names."""
+
+        index = cls()
+        index.squished = dict(roster)
+        index.names = dict((name.upper(), name) for name in roster.itervalues())
+        return index
+
+    @classmethod
+    def squish(cls, name):
+        """Format a name the way Canvas does in file names ('lastfirstmiddle'), in uppercase."""
+
+        return cls._nonWord.sub('', name).upper()
+
+    def add(self, name):
+        self.names[name.upper()] = name
+        self.squished[self.squish(name)] = name
+
+    def find(self, squishedName):
+        """Return the name matching a squished name, or None if there is no such name."""
+
+        return self.squished.get(squishedName.upper())
+
+    def __contains__(self, name):
+        return name.upper() in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return self.names.itervalues()
+
+class BadCSVError(RuntimeError):
+    pass
+
+class MismatchError(RuntimeError):
+    pass
+
+class Manifest(object):
+    """Record of the zip entries that were extracted for each student in a destination folder.
+
+    The manifest is kept as a json file in the destination. For each student it lists the planned
+    zip entries with their CRC32, size and timestamp as found in the zip's central directory, so a
+    later run on a newer download of the same assignment can tell which students resubmitted
+    without decompressing anything. The manifest is discarded if the flatten (move) option changed.
+    """
+
+    filename = '.submissionfix_manifest.json'
+
+    def __init__(self, directory, move=None):
+        self.path = os.path.join(directory, self.filename)
+        self.directory = directory
+        self.move = move
+        self.students = {}
+        self.current = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                saved = json.load(f)
+            if saved.get('move') == move:
+                self.students = saved.get('students', {})
+
+    def update(self, manager, zippy):
+        """Read the planned entries of the zip and return the set of students that changed.
+
+        A student changed if any of their entries was added, removed or differs from the manifest,
+        or if their folder no longer exists.
+        """
+
+        current = {}
+        with CentralDirectory(zippy) as zfile:
+            for info, student, filename in manager._planEntries(zfile):
+                if student is None:
+                    continue
+                entries = current.setdefault(_unicode(student), {})
+                entries[_unicode(info.filename)] = [info.CRC, info.file_size, list(info.date_time)]
+
+        self.current = current
+        return set(student for student, entries in current.iteritems()
+                   if self.students.get(student) != entries or
+                   not os.path.isdir(os.path.join(self.directory, student)))
+
+    def save(self):
+        """Write the manifest, keeping students that were not part of the last zip."""
+
+        self.students.update(self.current)
+        with open(self.path, 'wb') as f:
+            json.dump({'move': self.move, 'students': self.students}, f, sort_keys=True)
+
+class RosterCache(object):
+    """Compiled copy of a Canvas roll, kept in a cache folder so later runs don't parse the csv again.
+
+    Caches go in $XDG_CACHE_HOME/submissionfix (~/.cache/submissionfix by default), one marshal
+    file per roll named after the hash of its absolute path. Each holds the roll dictionaries keyed
+    by the roll's path, size and modification time, so editing or replacing the roll makes the next
+    run parse it again. A cache that can't be read is ignored and one that can't be written skipped.
+    """
+
+    version = 1
+
+    def __init__(self, roll, directory=None):
+        self.roll = os.path.abspath(roll)
+        self.directory = directory or os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                                                   os.path.expanduser(os.path.join('~', '.cache')), 'submissionfix')
+        self.path = os.path.join(self.directory, hashlib.sha1(self.roll).hexdigest() + '.roster')
+        self.key = None
+
+    def load(self):
+        """Return the cached (roster, sections) of the roll, or None if the roll changed since."""
+
+        try:
+            stat = os.stat(self.roll)
+            self.key = [self.version, self.roll, stat.st_size, stat.st_mtime]
+            with open(self.path, 'rb') as f:
+                saved = marshal.load(f)
+            if saved['key'] == self.key:
+                return saved['roster'], saved['sections']
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError):
+            pass
+        return None
+
+    def save(self, roster, sections):
+        """Write the cache for the roll as it was when load was called."""
+
+        if self.key is None:
+            return
+        temp = '{path}.{pid}'.format(path=self.path, pid=os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp, 'wb') as f:
+                marshal.dump({'key': self.key, 'roster': roster, 'sections': sections}, f)
+            # rename so other runs never read a half written cache
+            os.rename(temp, self.path)
+        except (IOError, OSError):
+            if os.path.exists(temp):
+                os.remove(temp)
+
+class Profiler(object):
+    """Records the time and resources used by each phase of a run and the slowest students.
+
+    Each phase record holds the wall and CPU time, bytes read and written, the peak RSS so far and
+    the number of files and directories in the phase's folder once it finished. CPU time includes
+    finished worker processes, bytes read and written only count the main process. Hooks are called
+    as hook(phase, record) as soon as a phase finishes, so they can watch a run while it happens.
+    """
+
+    def __init__(self, slowest=10, hooks=()):
+        self.slowest = slowest
+        self.hooks = list(hooks)
+        self.phases = []
+        self.studentTimes = {}
+
+    def addHook(self, hook):
+        self.hooks.append(hook)
+
+    @contextmanager
+    def phase(self, name, path=None):
+        """Context manager recording everything done within it as the named phase."""
+
+        start = self._sample()
+        try:
+            yield
+        finally:
+            end = self._sample()
+            record = {'phase': name}
+            for key in ('wall', 'cpu', 'readBytes', 'writtenBytes'):
+                record[key] = None if start[key] is None else end[key] - start[key]
+            record['peakRssKb'] = end['peakRssKb']
+            record['files'], record['directories'] = self._countTree(path)
+            self.phases.append(record)
+            for hook in self.hooks:
+                hook(name, record)
+
+    def recordStudents(self, folderArgs, timedResults):
+        """Add the time taken for each student folder and return the results without the times."""
+
+        results = []
+        for args, (seconds, result) in zip(folderArgs, timedResults):
+            self.recordStudent(args[0], seconds)
+            results.append(result)
+        return results
+
+    def recordStudent(self, folder, seconds):
+        """Add time taken for the student of a student folder."""
+
+        student = os.path.basename(folder)
+        self.studentTimes[student] = self.studentTimes.get(student, 0.0) + seconds
+
+    def report(self):
+        slowest = sorted(self.studentTimes.iteritems(), key=lambda item: (-item[1], item[0]))[:self.slowest]
+        return {
+            'phases': self.phases,
+            'wall': sum(record['wall'] for record in self.phases),
+            'slowestStudents': [{'student': student, 'seconds': seconds} for student, seconds in slowest],
+        }
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def _sample(self):
+        times = os.times()
+        sample = {'wall': time.time(), 'cpu': sum(times[:4]), 'readBytes': None, 'writtenBytes': None,
+                  'peakRssKb': None}
+        try:
+            with open('/proc/self/io') as f:
+                counters = dict(line.split(':', 1) for line in f if ':' in line)
+            sample['readBytes'], sample['writtenBytes'] = int(counters['rchar']), int(counters['wchar'])
+        except (IOError, KeyError, ValueError):
+            pass
+        if resource:
+            sample['peakRssKb'] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return sample
+
+    def _countTree(self, path):
+        if not path or not os.path.isdir(path):
+            return None, None
+        files = directories = 0
+        for root, dirs, names in os.walk(path):
+            files += len(names)
+            directories += len(dirs)
+        return files, directories
+
+class Grader(object):
+    """Grades student folders as soon as they are complete, on a pool of worker threads.
+
+    Folders handed to submit() are queued for the workers, so grading earlier students overlaps
+    with extracting later ones. A command is run through the shell in the student folder, with
+    {dir} replaced by the quoted folder path, and its exit code, duration and output (the last
+    outputLimit bytes of stdout and stderr) are recorded. A callback is called with the folder
+    path instead and its return value is recorded as the exit code, None counting as 0. If a
+    summary path is given, close() writes the records to it as json.
+    """
+
+    outputLimit = 64 * 1024
+
+    def __init__(self, command=None, callback=None, workers=1, summary=None):
+        self.command = command
+        self.callback = callback
+        self.summary = summary
+        self.results = []
+        self._queue = Queue.Queue()
+        self._workers = []
+        for _ in range(max(workers, 1)):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, folder):
+        """Queue a complete student folder to be graded."""
+
+        self._queue.put(folder)
+
+    def close(self):
+        """Wait for every queued folder to be graded, write the summary and return the records."""
+
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self.results.sort(key=lambda record: record['student'])
+
+        failed = sum(1 for record in self.results if record['exitCode'] != 0)
+        print "Graded {count} students, {failed} failed.".format(count=len(self.results), failed=failed)
+        if self.summary:
+            with open(self.summary, 'wb') as f:
+                json.dump({'command': self.command, 'results': self.results}, f, indent=2, sort_keys=True)
+            print "Grading summary written to " + self.summary
+        return self.results
+
+    def _work(self):
+        while True:
+            folder = self._queue.get()
+            if folder is None:
+                break
+            start = time.time()
+            try:
+                exitCode, output = self._grade(folder)
+            except Exception:
+                exitCode, output = None, traceback.format_exc()
+            self.results.append({'student': _unicode(os.path.basename(folder)), 'folder': _unicode(folder),
+                                 'exitCode': exitCode, 'seconds': time.time() - start,
+                                 'output': output[-self.outputLimit:].decode('utf-8', 'replace')})
+
+    def _grade(self, folder):
+        if self.callback:
+            exitCode = self.callback(folder)
+            return (0 if exitCode is None else exitCode), ''
+        command = self.command.replace('{dir}', pipes.quote(folder))
+        process = subprocess.Popen(command, shell=True, cwd=folder, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, close_fds=True)
+        output = process.communicate()[0]
+        return process.returncode, output
+
+def binPack(sizes, count):
+    """Split sized items into count bins with totals as even as possible.
+
+    Items are placed largest first, each into the bin with the smallest total so far (longest
+    processing time first), so no bin ends up more than one item past an even split.
+
+    Args:
+        sizes: dictionary of item to size
+        count: number of bins
+
+    Returns:
+        List of (total, items) tuples, one per bin, with the items sorted
+    """
+
+    bins = [(0, n, []) for n in range(count)]
+    for item in sorted(sizes, key=lambda item: (-sizes[item], item)):
+        total, n, items = heapq.heappop(bins)
+        items.append(item)
+        heapq.heappush(bins, (total + sizes[item], n, items))
+    return [(total, sorted(items)) for total, n, items in sorted(bins, key=lambda b: b[1])]
+
+
+def _unicode(name):
+    """Return a zip entry or student name as unicode, the way it is read back from json."""
+
+    if isinstance(name, str):
+        return name.decode('utf-8', 'replace')
+    return name
+
+class AssignmentManager(object):
+    """Manager to handle a given assignment submission and collection tool."""
+
+    jobs = 1
+    threads = 1
+    dedup = False
+    profiler = None
+    flatten = None
+    keepFolders = ()
+    limits = None
+    violations = ()
+    routes = None
+    follow = None
+    governor = None
+    lateStudents = frozenset()
+
+    def __getstate__(self):
+        """Leave the profiler behind when the manager is sent to pool workers."""
+
+        state = dict(self.__dict__)
+        state.pop('profiler', None)
+        return state
+
+    @property
+    def students(self):
+        """List of student names to extract. Setting it indexes the names for _isSelected."""
+
+        return self._students
+
+    @students.setter
+    def students(self, names):
+        self._students = names
+        self.studentIndex = NameIndex(names or [])
+
+    def extractBulk(self, zippy, students=[], directory=os.getcwd()):
+        """Handle extraction of bulk submission zip file.
+
+        Creates a list of paths out of the zip file. If a csv file was input, this list is shortened
+        using a list from the csv file. All paths within the list are extracted into the given path.
+        If no path is given, paths are extracted into the current working directory.
+
+        Args:
+            zippy: bulk submission zip file
+            students: list of student names to grade (optional)
+            directory: directory to extract zip into (optional, default: working directory)
+
+        Returns:
+            Path of newly created directory with extracted files
+        """
+
+    def _extractEntries(self, zippy, directory):
+        """Extract the zip entries of the students to extract as they are, reading the zip once.
+
+        Raises:
+            BadCSVError: if a student list was given but none of the entries belong to them
+        """
+
+        matched = False
+        with CentralDirectory(zippy) as zfile, EntryWriter(zippy, self.threads, dedup=self.dedup) as writer:
+            for info in zfile.entries():
+                if self.students and not self._extractsEntry(info.filename):
+                    continue
+                matched = True
+                writer.write(info, entryPath(directory, info.filename))
+
+        if self.students and not matched:
+            raise BadCSVError("Error: csv file matches no submissions.")
+
+    def _extractsEntry(self, filename):
+        """Check if the zip entry belongs to one of the students to extract."""
+
+        raise NotImplementedError
+
+    def readCSV(self, csvfile):
+        """Create a list of students to grade from input csv file.
+
+        Reads through csv file and appends each student name to a list, creating a list of lists.
+        List comprehension transforms this into a single list of student names and converts each
+        name to uppercase. A delimiter of ';' is used to allow commas in students name (ex. Doe, John).
+
+        Args:
+            csvfile: csvfile with names of students to grade, delimited with ';'
+
+        Returns:
+            A list of student names to grade, all in uppercase.
+        """
+
+        students = []
+        with open(csvfile, 'rb') as f :
+            reader = csv.reader(f, delimiter=';')
+            for row in reader :
+                students.append(row)
+
+        students = [s[0].rstrip() for s in students]
+
+        return students
+
+    def createPath(self, path):
+        """Create the input path.
+
+        As long as the entered path is not the current working directory, try to create the path. If
+        this fails, report error and handle collision.
+
+        Args:
+            path: path to be created (relative to cwd unless otherwise stated)
+        """
+        if os.path.abspath('.') != os.path.abspath(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                print "Error: Path already exists."
+                self._handleCollision(path)
+
+    def stream(self, zippy, directory=None, only=None, done=None, records=None):
+        """Extract the bulk submission zip straight into student folders.
+
+        Every entry of the zip is routed to its final location by the manager's _planEntries and
+        its decompressed bytes are written there once, skipping the temporary extraction folder and
+        the moves that follow it. Archives submitted by a student are extracted into their folder
+        straight from the zip, without writing the archive itself. If the manager's move option is
+        set, every file is written to its flattened location right away. If follow is set, the zip
+        is read with LocalHeaders and each entry is written as soon as it has arrived. If routes are set, each
+        student folder goes in the student's folders of the directory instead (see _studentTrees);
+        a student with several is written once and copied. Student folders that already exist are
+        overwritten. If a filename collision is detected, user is warned and the later file is
+        skipped. Bulk submission zips list each student's entries together, so a student folder
+        is complete once the next student's entries start.
+
+        Args:
+            zippy: bulk submission zip file
+            directory: directory the student folders are created in (optional, default: working directory)
+            only: collection of students to extract, the others are left untouched (optional)
+            done: function called with each student folder (and copy) as soon as it is complete,
+                possibly from another thread, while later students are still extracted (optional)
+            records: list to add a record of every file written to as soon as its student folder is
+                complete, see _recordFiles (optional)
+
+        Returns:
+            createdFolders: list of student folder paths that were created
+        """
+
+        directory = directory or os.getcwd()
+        createdFolders = set()
+        copies = {}
+        matched = False
+        current = None
+
+        def finished(folder, files):
+            for copy in copies.get(folder, ()):
+                if os.path.exists(copy):
+                    shutil.rmtree(copy)
+                shutil.copytree(folder, copy, symlinks=True)
+                if done:
+                    done(copy)
+            if records is not None:
+                self._recordFiles(records, directory, folder, files, copies.get(folder, ()))
+            if done:
+                done(folder)
+
+        governor = self._governor()
+        quarantined = len(governor.violations) if governor else 0
+        writer = EntryWriter(zippy, self.threads, dedup=self.dedup, flattener=self._flattener(self.flatten),
+                             governor=governor, opener=self._openZip, done=finished, record=records is not None)
+        with self._openZip(zippy) as zfile, writer:
+            for info, student, filename, reason in self._layout(zfile):
+                if student is None:
+                    continue
+                matched = True
+                if only is not None and _unicode(student) not in only:
+                    continue
+
+                trees = self._studentTrees(directory, student)
+                studentFolder = self._createStudentFolder(trees[0], student, createdFolders)
+                if studentFolder != current:
+                    copies[studentFolder] = [os.path.abspath(os.path.join(tree, student)) for tree in trees[1:]]
+                    createdFolders.update(copies[studentFolder])
+                    writer.group(studentFolder)
+                    current = studentFolder
+                if reason == 'flattened':
+                    continue
+                newPath = os.path.join(studentFolder, filename)
+
+                if filename.endswith(os.sep):
+                    if not os.path.isdir(newPath):
+                        os.makedirs(newPath)
+                    continue
+                if reason == 'collision':
+                    self._warnCollision(student, filename)
+                    continue
+                writer.write(info, newPath, expand=self._expandsInStream(filename))
+
+        if self.profiler:
+            for folder, seconds in writer.times.iteritems():
+                self.profiler.recordStudent(folder, seconds)
+        if self.follow is not None:
+            self._endFollow(zfile)
+
+        if governor:
+            self.violations += tuple(governor.violations[quarantined:])
+        if self.students and not matched:
+            raise BadCSVError("Error: csv file matches no submissions.")
+        return map(os.path.abspath, createdFolders)
+
+    def _recordFiles(self, records, directory, folder, files, copies=()):
+        """Add a record of every file a student folder was written with to records, and the same for its copies.
+
+        Each record is (student, path, source, archive, size, crc), with path relative to
+        directory, source the zip entry the file came from and archive the name of the submitted
+        archive it was extracted from, if any. A path written more than once is recorded with
+        what was written last, which is what is left on disk.
+        """
+
+        student = os.path.basename(folder)
+        final = {}
+        for path, source, archive, size, crc in files:
+            final[os.path.relpath(path, folder)] = (source, archive, size, crc)
+        for base in [folder] + list(copies):
+            prefix = os.path.relpath(base, directory)
+            for name, (source, archive, size, crc) in sorted(final.items()):
+                records.append((student, os.path.join(prefix, name), source, archive, size, crc))
+
+    def plan(self, zippy):
+        """Work out where every entry of the bulk submission zip goes without extracting anything.
+
+        Returns:
+            List of dictionaries, one per zip entry or planned folder, with the source entry, the
+            student, the destination relative to the extraction path (None if skipped), the size,
+            whether the file is a submitted archive to be decompressed and the reason it is skipped,
+            if any
+        """
+
+        entries = []
+        with CentralDirectory(zippy) as zfile:
+            for info, student, filename, reason in self._layout(zfile):
+                # folders the managers add themselves, such as T-Square's 'Text', have no entry
+                added = filename is not None and filename.endswith(os.sep) and not info.filename.endswith('/')
+                entries.append({
+                    'source': None if added else _unicode(info.filename),
+                    'student': _unicode(student) if student else None,
+                    'destination': (_unicode(os.path.join(self._studentTrees('', student)[0], student, filename))
+                                    if filename else None),
+                    'size': 0 if added else info.file_size,
+                    'expand': filename is not None and self._expandsInStream(filename),
+                    'reason': reason,
+                })
+        return entries
+
+    def writePlan(self, zippy, path):
+        """Write the plan of the bulk submission zip to path as json and print a summary."""
+
+        entries = self.plan(zippy)
+        with open(path, 'wb') as f:
+            json.dump({'bulksubmission': zippy, 'entries': entries}, f, indent=2, sort_keys=True)
+
+        written = [e for e in entries if e['destination'] and not e['reason']]
+        print ("Planned {files} files for {students} students, skipping {skipped} entries"
+               " ({collisions} filename collisions).".format(
+                   files=sum(1 for e in written if not e['destination'].endswith(os.sep)),
+                   students=len(set(e['student'] for e in written)),
+                   skipped=sum(1 for e in entries if e['reason']),
+                   collisions=sum(1 for e in entries if e['reason'] == 'collision')))
+        print "Plan written to " + path
+
+    def shard(self, zippy, count):
+        """Split the students with submissions into count shards of about the same total size.
+
+        A student's size is the uncompressed size of the files planned for them, read from the
+        central directory of the zip without extracting anything.
+
+        Returns:
+            List of (bytes, students) tuples, one per shard (see binPack)
+        """
+
+        sizes = {}
+        with CentralDirectory(zippy) as zfile:
+            for info, student, filename, reason in self._layout(zfile):
+                if student is None:
+                    continue
+                written = filename is not None and not filename.endswith(os.sep) and not reason
+                sizes[student] = sizes.get(student, 0) + (info.file_size if written else 0)
+        return binPack(sizes, count)
+
+    def writeShards(self, zippy, count, path):
+        """Shard the students of the bulk submission zip, write the assignment table to path as json
+        and route each student to their shard's folder.
+        """
+
+        routes = {}
+        table = []
+        for n, (size, students) in enumerate(self.shard(zippy, count), 1):
+            folder = _shard_folder.format(n=n)
+            routes.update((student, [folder]) for student in students)
+            table.append({'shard': folder, 'bytes': size, 'students': map(_unicode, students)})
+        with open(path, 'wb') as f:
+            json.dump({'bulksubmission': zippy, 'shards': table}, f, indent=2, sort_keys=True)
+        self.routes = routes
+
+        print "Split {students} students into {count} shards of {low} to {high} bytes.".format(
+            students=len(routes), count=count, low=min(s['bytes'] for s in table),
+            high=max(s['bytes'] for s in table))
+        print "Shard assignments written to " + path
+
+    def view(self, zippy):
+        """Return a read-only SubmissionView of the student folders the zip extracts to, without extracting it."""
+
+        return SubmissionView(self, zippy)
+
+    def writeArchive(self, zippy, sink, records=None):
+        """Write the student folders the zip extracts to into an ArchiveSink, without writing them to disk.
+
+        The folders are read from a SubmissionView, so they are laid out like extraction (routes
+        included), with the archives students submitted already extracted. Given a records list,
+        a record of every file is added to it as the file is written, like stream() does.
+        """
+
+        with self.view(zippy) as view:
+            for student in view.students():
+                folder = view[student]
+                for tree in self._studentTrees('', student):
+                    base = os.path.join(tree, student)
+                    sink.addFolder(base)
+                    for name in folder.folders():
+                        sink.addFolder(os.path.join(base, name))
+                    for name in folder.files():
+                        size, dateTime = folder.stat(name)
+                        with folder.open(name) as source:
+                            reader = ChecksumReader(source)
+                            sink.addFile(os.path.join(base, name), reader, size, dateTime)
+                        if records is not None:
+                            info, archive = folder.origin(name)
+                            records.append((student, os.path.join(base, name), info.filename, archive, size,
+                                            reader.crc))
+                folder.close()
+            students = len(view)
+        print "Wrote {files} files ({size} bytes) for {students} students to {path}.".format(
+            files=sink.files, size=sink.bytes, students=students, path=sink.path)
+
+    def writeIndex(self, records, index):
+        """Write the records of extracted files kept by stream() or writeArchive() into an IndexWriter.
+
+        Records are written in order of their paths, which are relative to the extraction path.
+        Sizes are uncompressed and crc is the CRC32 in hex. late is set for students in
+        lateStudents, filled in by the manager's late submission check once the files are written.
+        """
+
+        sections = self._studentSections()
+        for student, path, source, archive, size, crc in sorted(records, key=lambda record: record[1]):
+            index.add({
+                'student': _unicode(student),
+                'section': sections.get(student),
+                'source': _unicode(source),
+                'path': _unicode(path),
+                'size': size,
+                'crc': '{crc:08x}'.format(crc=crc),
+                'late': student in self.lateStudents,
+                'archive': _unicode(archive) if archive else None,
+            })
+        print "Index of {records} files written to {path}".format(records=index.records, path=index.path)
+
+    def _studentSections(self):
+        """Return a dictionary of student to their grading section. Managers without sections have none."""
+
+        return {}
+
+    def _layout(self, zfile):
+        """Yield (entry, student, filename, reason) for every planned file and every skipped entry.
+
+        reason is None for entries that are written. If the move option is set, filenames are
+        where flattening puts them and folders it removes have no filename and are 'flattened'. A
+        later file planned to the same path in a student folder as an earlier one is a 'collision'.
+        Entries _planEntries leaves out have no student or filename, and the reason given by
+        _skipReason.
+        """
+
+        flattener = self._flattener(self.flatten)
+        claimed = set()
+        for info, student, filename in self._planEntries(zfile):
+            if student is None:
+                yield (info, None, None, self._skipReason(info))
+                continue
+            if flattener:
+                filename = flattener.path(filename)
+                if filename is None:
+                    yield (info, student, None, 'flattened')
+                    continue
+            if not filename.endswith(os.sep):
+                path = os.path.join(student, filename)
+                if path in claimed:
+                    yield (info, student, filename, 'collision')
+                    continue
+                claimed.add(path)
+            yield (info, student, filename, None)
+
+    def _skipReason(self, info):
+        """Return why _planEntries leaves the zip entry out."""
+
+        raise NotImplementedError
 
+    def _openZip(self, zippy, fileobj=None):
+        """Open the bulk submission zip, with LocalHeaders (given the follow options) if it is being followed.
 
-def unzip(directory, zippy):
-    """Unzips a given zip file into the given directory
+        fileobj, an open handle on the zip, is used instead of its name if given and not following.
+        """
 
-    Takes in a zip file and extracts its contents to the given directory. Afterwards, the
-    zip file is removed.
+        if self.follow is not None:
+            return LocalHeaders(zippy, **self.follow)
+        return CentralDirectory(fileobj or zippy)
 
-    Args:
-        directory: directory where files will be extracted to
-        zippy: zip file to unzip
-    """
+    def _endFollow(self, zfile):
+        """Warn about problems found reading a followed zip and stop waiting for it to be written."""
 
-    with zipfile.ZipFile(zippy) as zfile:
-        for filename in zfile.namelist() :
-            zfile.extract(filename, directory)
-    os.remove(zippy)
+        if zfile.truncated:
+            print ("Warning: The bulk submissions zip ended before its central directory."
+                    " Only the complete files before the end were extracted.")
+        for filename in zfile.mismatched:
+            print ("Warning: '{file}' does not match the zip's central directory."
+                    " Please manually check it.".format(file=filename))
+        # the zip is now as complete as it will get
+        self.follow = {'idle': 0} if zfile.truncated else None
 
+    def _studentTrees(self, directory, student):
+        """Return the folders a student's folder goes in: directory, or the student's routes within it.
 
-def untar(directory, tarry):
-    """Extracts a the tar file into the given directory
+        routes maps each student to the list of folders (relative to the extraction path) their
+        folder is written to, such as one folder per grading section.
+        """
 
-    The system tar function will be attempted first to extract the tar file. This will
-    most likley fail on Windows. If the system call fails, the Python tar functions
-    are tried next. The tar file is checked against a blacklist for bad folder
-    names and creates a copy of the tar filed (named 'backup_<tarname>'). If
-    extraction succeeds, the backup file is removed. If if fails, an error is printed
-    and the user must handle that file manually.
+        if self.routes is None:
+            return [directory]
+        return [os.path.join(directory, tree) for tree in self.routes[student]]
 
-    Note: Python may extract some files before failing. If the error is printed, Python
-    failed to extract some number of files and deleted them from the original archive.
-    The user must manually use the backup to extract all files in this case.
+    def _expandsInStream(self, filename):
+        """Check if a planned file is an archive that extract() would decompress in the student folder."""
 
-    Args:
-        directory: directory where files will be extracted to
-        tarry: tar file to extract
-    """
+        return os.path.dirname(filename) == '' and archiveType(filename) is not None
 
-    blacklist = ['.', '..', '~']
+    def _planEntries(self, zfile):
+        """Yield (entry, student, filename) for every zip entry to be written to a student folder.
 
+        Filenames are relative to the student folder. A filename ending in a separator is a folder
+        to be created rather than a file to be written. Entries that are left out are yielded with
+        student and filename None, so the zip is only read once however it is used.
+        """
 
-    result = systemTar(directory, tarry)
-    if result != 0:
-        head, tail = os.path.split(tarry)
-        backup = os.path.join(head, 'backup_' + tail)
+        raise NotImplementedError
 
-        try:
-            tar = tarfile.open(tarry)
-        except tarfile.ReadError:
-            print ("Warning: Could not open tar file. "
-                    "The file could have been compressed as another type and renamed. "
-                    "File: " + tarry)
-            return
+    def _isSelected(self, student):
+        """Check if student is one of the students to extract. Everyone is selected without a list."""
 
-        if list(set(blacklist) & set(tar.getnames())):
-            shutil.copy(tarry, backup)
+        if not self.students:
+            return True
+        return student in self.studentIndex
 
-        try:
-            tar.extractall(directory)
-            if os.path.isfile(backup):
-                os.remove(backup)
-        except struct.error:
-            print ("Error: Python extraction failed. Extract backup tar manually. "
-                    "File: " + tarry)
+    def _createStudentFolder(self, directory, student, createdFolders):
+        """Creates a folder with student's name, overwriting it if the folder already exists."""
 
-        tar.close()
-    os.remove(tarry)
+        studentFolder = os.path.join(directory, student)
+        if os.path.exists(studentFolder):
+            if studentFolder not in createdFolders:
+                shutil.rmtree(studentFolder)
+                os.makedirs(studentFolder)
+        else:
+            os.makedirs(studentFolder)
+        createdFolders.add(studentFolder)
+        return os.path.abspath(studentFolder)
 
-def systemTar(directory, tarry):
-    """Extracts a tar file into a directory using the system tar function.
+    def _warnCollision(self, student, filename):
+        """Warn user that a student's file would overwrite another of their files."""
 
-    This is Unix only. Returns the returncode for the process if there was an error
-    and 1 if the subprocess was unable to start.
+        print ("Warning: {student} has a filename collision on '{file}'."
+                " Please manually check, move, and rename their files.".format(student=student, file=filename))
 
-    Args:
-        directory: directory where files will be extracted to
-        tarry: tar file to extract
-    """
+    def _flattener(self, move):
+        """Return a Flattener for the move option, or None if folders are not flattened."""
 
-    try:
-        process = Popen(['tar', '-xzvf', tarry, '-C', directory], stdout=PIPE, stderr=PIPE)
-        stdout, stderr = process.communicate()
-        if process.returncode:
-            print "System tar extraction failed."
-        return process.returncode
-    except:
-        return 1
+        if not move:
+            return None
+        return Flattener(move, self.keepFolders)
 
+    def _governor(self):
+        """Return the run's Governor for the extraction limits, or None if there are none.
 
+        Every phase of a run shares it, so a student's limits cover everything their archives
+        extracted, whether while streaming or once their folder is inspected.
+        """
 
-def prepareTimeCheck(time):
-    """Prepares user input timestamp for later use
+        if not self.limits:
+            return None
+        if self.governor is None:
+            self.governor = Governor(self.limits)
+        return self.governor
 
-    Takes in a timestamp in the format 'mm/dd/yy HH:MM' to be used as a due date for an assignment and
-    converts it into a localized datetime object. This feature only works if the user has the pytz
-    module installed.
+    def _inspectFolder(self, folderPath, move):
+        """Decompresses any compressed files in a student folder and flattens it if requested.
 
-    Args:
-        time: duedate timestamp in format 'mm/dd/yy HH:MM'
-    """
-    if not findTime :
-        print "\nModule pytz not found. To use the late submission checking feature, please install pytz.\n"
-        return None
+        Archives are extracted straight to their flattened location, after the files that came in
+        folders of the bulk submissions zip are moved there. Archives inside those archives are left
+        as they are, like when streaming.
 
-    duetime = datetime.strptime(time[0] + " " + time[1], "%m/%d/%y %H:%M")
-    eastern = timezone('US/Eastern')
-    duetime = eastern.localize(duetime)
-    return duetime
+        Returns:
+            List of archives quarantined for passing the extraction limits
+        """
 
-class BadCSVError(RuntimeError):
-    pass
+        flattener = self._flattener(move)
+        if flattener:
+            self._flattenFolder(folderPath, flattener)
+        governor = self._governor()
+        quarantined = len(governor.violations) if governor else 0
+        extract(folderPath, flattener, governor)
+        return governor.violations[quarantined:] if governor else []
 
-class MismatchError(RuntimeError):
-    pass
+    def _flattenFolder(self, folderPath, flattener):
+        """Move the files in a student folder's folders to where flattening puts them.
 
-class AssignmentManager(object):
-    """Manager to handle a given assignment submission and collection tool."""
+        Folders left empty are removed. Files that would overwrite another file stay where they are.
+        """
 
-    def extractBulk(self, zippy, students=[], directory=os.getcwd()):
-        """Handle extraction of bulk submission zip file.
+        walked = list(os.walk(folderPath))[1:]
+        # shallow folders first, so their files are out of the way of the deeper ones moving up
+        for root, directories, files in sorted(walked, key=lambda level: level[0].count(os.sep)):
+            relativeRoot = os.path.join(os.path.relpath(root, folderPath), '')
+            flattenedRoot = flattener.path(relativeRoot)
+            if flattenedRoot == relativeRoot:
+                continue
+            if flattenedRoot and not os.path.isdir(os.path.join(folderPath, flattenedRoot)):
+                os.makedirs(os.path.join(folderPath, flattenedRoot))
+            for name in files:
+                path = flattener.target(folderPath, os.path.join(relativeRoot, name))
+                if path:
+                    parent = os.path.dirname(path)
+                    if not os.path.isdir(parent):
+                        os.makedirs(parent)
+                    shutil.move(os.path.join(root, name), path)
+
+        for root, directories, files in reversed(walked):
+            relativeRoot = os.path.join(os.path.relpath(root, folderPath), '')
+            if flattener.path(relativeRoot) != relativeRoot:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
 
-        Creates a list of paths out of the zip file. If a csv file was input, this list is shortened
-        using a list from the csv file. All paths within the list are extracted into the given path.
-        If no path is given, paths are extracted into the current working directory.
+    def _mapFolders(self, method, folderArgs, done=None):
+        """Run a per-student method once for each tuple of arguments.
+
+        Student folders are independent of each other, so if more than one job was requested the
+        calls are spread across a process pool. Results are always returned in the same order as
+        folderArgs.
 
         Args:
-            zippy: bulk submission zip file
-            students: list of student names to grade (optional)
-            directory: directory to extract zip into (optional, default: working directory)
+            method: name of the manager method to run
+            folderArgs: list of argument tuples, one per student folder
+            done: function called with the student folder (first argument) of each call as soon as
+                it returns (optional)
 
         Returns:
-            Path of newly created directory with extracted files
+            List of results of each call
         """
 
-    def readCSV(self, csvfile):
-        """Create a list of students to grade from input csv file.
+        call = _timedCall if self.profiler else _callMethod
+        calls = [(method, args) for args in folderArgs]
+        if self.jobs > 1 and len(folderArgs) > 1:
+            pool = multiprocessing.Pool(min(self.jobs, len(folderArgs)), _initWorker, (self,))
+            try:
+                results = self._collect(folderArgs, pool.imap(call, calls), done)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = self._collect(folderArgs, (call(task, self) for task in calls), done)
 
-        Reads through csv file and appends each student name to a list, creating a list of lists.
-        List comprehension transforms this into a single list of student names and converts each
-        name to uppercase. A delimiter of ';' is used to allow commas in students name (ex. Doe, John).
+        if self.profiler:
+            return self.profiler.recordStudents(folderArgs, results)
+        return results
 
-        Args:
-            csvfile: csvfile with names of students to grade, delimited with ';'
+    def _collect(self, folderArgs, results, done):
+        """Gather results as they come in, calling done with each one's student folder."""
+
+        collected = []
+        for args, result in itertools.izip(folderArgs, results):
+            collected.append(result)
+            if done:
+                done(args[0])
+        return collected
+
+    def _moveFolder(self, destination, folderPath):
+        """Move a student folder into the destination directory, replacing any folder of the same name.
 
         Returns:
-            A list of student names to grade, all in uppercase.
+            New path of the student folder
         """
 
-        students = []
-        with open(csvfile, 'rb') as f :
-            reader = csv.reader(f, delimiter=';')
-            for row in reader :
-                students.append(row)
-
-        students = [s[0].rstrip() for s in students]
+        destPath = os.path.join(destination, os.path.basename(folderPath))
+        if os.path.exists(destPath):
+            shutil.rmtree(destPath)
+        shutil.move(folderPath, destPath)
+        return os.path.abspath(destPath)
 
-        return students
+    @contextmanager
+    def _phase(self, name, path=None):
+        """Record everything done within as the named phase if the run is being profiled."""
 
-    def createPath(self, path):
-        """Create the input path.
+        if self.profiler is None:
+            yield
+        else:
+            with self.profiler.phase(name, path):
+                yield
 
-        As long as the entered path is not the current working directory, try to create the path. If
-        this fails, report error and handle collision.
+    def _printStatus(self, late, noSub, lateChecked):
+        """Print the formatted late and no submission lists, and any archives that were quarantined."""
 
-        Args:
-            path: path to be created (relative to cwd unless otherwise stated)
-        """
-        if os.path.abspath('.') != os.path.abspath(path):
-            try:
-                os.makedirs(path)
-            except OSError:
-                print "Error: Path already exists."
-                self._handleCollision(path)
+        if lateChecked and not late and not noSub:
+            print "\n\nNo Late Submissions \n "
+        if late :
+            print "\n\nLate Submissions: "
+            print '\n'.join(late)
+        if noSub :
+            print "\n\nNo Submissions: "
+            print '\n'.join(noSub)
+        if self.violations :
+            print "\n\nQuarantined Archives: "
+            print '\n'.join(sorted(self.violations))
 
     def _handleCollision(self, path):
         """Poll user to overwrite path structure or cancel."""
@@ -262,85 +2775,268 @@ class AssignmentManager(object):
 class TSquare(AssignmentManager):
     """Manager to handle T-Square submissions."""
 
+    # flattening leaves the folder of extra files from T-Square alone
+    keepFolders = ('Text',)
+
     @classmethod
-    def execute(cls, zipfile, path, move, csv, time):
-        """Run all neccessary fix up functions for T-Square submissions."""
+    def execute(cls, zipfile, path, move, csv, time, stream=False, jobs=1, threads=1, incremental=False,
+                dedup=False, profile=None, profiler=None, report=False, plan=None, limits=None, grader=None,
+                shards=None, shardTable='submissionfix_shards.json', follow=None, outputArchive=None, index=None):
+        """Run all neccessary fix up functions for T-Square submissions.
+
+        With report set nothing is extracted, the late and no submission lists are read from the zip.
+        If plan is a filename nothing is extracted either, the planned layout is written to it as json.
+        If profile is a filename, the time and resources used by each phase are written to it as json.
+        A Profiler may also be passed in to record (and hook into) the run. With ExtractionLimits,
+        archives students submitted that pass a limit are quarantined and listed at the end. A
+        Grader is handed each student folder as soon as it is complete in the destination.
+
+        With a number of shards, the students are split into that many folders of about the same
+        total size in a single pass, and which student went where is written to shardTable.
+        follow, a dictionary of LocalHeaders options, streams the zip while it is still being
+        written. With an outputArchive file name (or '-' for stdout), the student folders are
+        written into that tar instead of the extraction path (see ArchiveSink). If index is a file
+        name, a record of every extracted file is written to it (see IndexWriter); the zip is then
+        streamed, so files are recorded as they are written.
+        """
 
         duetime = None
         if time:
             duetime = prepareTimeCheck(time)
 
         manager = cls(duetime)
+        manager.jobs = jobs
+        manager.threads = threads
+        manager.dedup = dedup
+        manager.flatten = move
+        manager.limits = limits
+        manager.follow = follow
+        manager.profiler = profiler or (Profiler() if profile else None)
         directory = path or os.getcwd()
+        graded = grader.submit if grader else None
+        records = [] if index and not report else None
 
         if csv :
             manager.students = manager.readCSV(csv)
             print "Extracting students using list: {list}.".format(list=csv)
 
-        if path :
+        if shards and not report:
+            with manager._phase('shard'):
+                manager.writeShards(zipfile, shards, shardTable)
+
+        if plan:
+            manager.writePlan(zipfile, plan)
+            return
+
+        if path and not report and not outputArchive and not (incremental and os.path.isdir(path)):
             manager.createPath(path)
 
-        tempPath = os.path.join(os.getcwd(), 'temp_extraction_folder')
-        try:
-            os.makedirs(tempPath)
-        except OSError:
-                print "Error: Temporary extraction path already exists."
-
-        print "Extracting bulk submissions."
-        manager.extractBulk(zipfile, directory=tempPath)
-        print "Renaming student folders"
-        manager.rename(tempPath)
-        print "Moving submission files."
-        late, noSub = manager.move(tempPath)
-        print "Decompressing any compressed files."
-        manager._inspectFolders(tempPath, move)
-        print "Moving submissions out of temporary folder."
-        manager._moveAllFiles(directory, tempPath)
-        shutil.rmtree(tempPath)
-
-        if findTime and time and not late and not noSub:
-            print "\n\nNo Late Submissions \n "
-        if late :
-            print "\n\nLate Submissions: "
-            print '\n'.join(late)
-        if noSub :
-            print "\n\nNo Submissions: "
-            print '\n'.join(noSub)
+        if report:
+            print "Reading submissions from bulk submissions zip."
+            with manager._phase('report'):
+                late, noSub = manager.report(zipfile)
+        elif outputArchive:
+            print "Writing student folders to " + outputArchive
+            with manager._phase('writeArchive'), ArchiveSink(outputArchive) as sink:
+                manager.writeArchive(zipfile, sink, records)
+            with manager._phase('report'):
+                late, noSub = manager.report(zipfile)
+        elif manager.routes is not None:
+            print "Extracting bulk submissions into grader folders."
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, done=graded, records=records)
+            with manager._phase('report'):
+                late, noSub = manager.report(zipfile)
+        elif incremental:
+            manifest = Manifest(directory, move)
+            changed = manifest.update(manager, zipfile)
+            print "Extracting {changed} new or changed student folders.".format(changed=len(changed))
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, changed, done=graded, records=records)
+            with manager._phase('report'):
+                late, noSub = manager.report(zipfile)
+            manifest.save()
+        elif stream or follow is not None or index:
+            print "Extracting bulk submissions into student folders."
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, done=graded, records=records)
+            with manager._phase('report'):
+                late, noSub = manager.report(zipfile)
+        else:
+            tempPath = os.path.join(os.getcwd(), 'temp_extraction_folder')
+            try:
+                os.makedirs(tempPath)
+            except OSError:
+                    print "Error: Temporary extraction path already exists."
+
+            print "Extracting bulk submissions."
+            with manager._phase('extractBulk', tempPath):
+                manager.extractBulk(zipfile, directory=tempPath)
+            print "Renaming student folders"
+            with manager._phase('rename', tempPath):
+                manager.rename(tempPath)
+            print "Moving submission files."
+            with manager._phase('move', tempPath):
+                late, noSub = manager.move(tempPath)
+            print "Decompressing any compressed files."
+            if grader:
+                # move each student out as soon as it is done, so it can be graded while the others are decompressed
+                graded = lambda folder: grader.submit(manager._moveFolder(directory, folder))
+            with manager._phase('_inspectFolders', tempPath):
+                manager._inspectFolders(tempPath, None, move, done=graded)
+            print "Moving submissions out of temporary folder."
+            with manager._phase('_moveAllFiles', directory):
+                manager._moveAllFiles(directory, tempPath)
+            shutil.rmtree(tempPath)
+
+        if index and not report:
+            with manager._phase('index'), IndexWriter(index) as writer:
+                manager.writeIndex(records, writer)
+        if grader:
+            with manager._phase('grade'):
+                grader.close()
+        manager._printStatus(late, noSub, findTime and time)
+
+        if profile:
+            manager.profiler.dump(profile)
+            print "\nProfile written to " + profile
 
     def __init__(self, duetime=None, students=None):
         self.duetime = duetime
         self.students = students
 
+    @property
+    def duetime(self):
+        """US/Eastern duedate. Setting it also keeps it as a naive UTC time for comparing timestamps."""
+
+        return self._duetime
+
+    @duetime.setter
+    def duetime(self, duetime):
+        self._duetime = duetime
+        self.dueUTC = duetime.astimezone(pytz.utc).replace(tzinfo=None) if duetime else None
+
     def extractBulk(self, zippy, directory=None):
         """Handle extraction of bulk submission zip file."""
 
         directory = directory or os.getcwd()
-        students = self.students or []
+        self._extractEntries(zippy, directory)
+
+        # Pull student folders out of assignment directory
+        self._flattenOneLevel(directory)
 
-        zfile = zipfile.ZipFile(zippy)
-        filelist = zfile.namelist()
+    def _extractsEntry(self, filename):
+        """Check if the zip entry belongs to one of the students to extract."""
 
-        if students:
-            filelist = self._findStudentsToExtract(filelist, students)
+        parts = filename.split('/')
+        return len(parts) > 1 and parts[1] != '' and self._isSelected(parts[1].split('(')[0])
 
-        for filename in filelist:
-            zfile.extract(filename, directory)
+    def _planEntries(self, zfile):
+        """Yield (entry, student, filename) giving the final location of every entry in the zip.
 
-        # Pull student folders out of assignment directory
-        self._flattenOneLevel(directory)
+        Maps each 'Assignment/Name(hash)/...' path to where rename, move and the flattening of
+        the assignment folder would have put it: files in 'Submission attachment(s)' go to the base
+        of the student folder, while loose T-Square files and the 'Feedback Attachment(s)' folder go
+        to the 'Text' folder. Every student gets a 'Text' folder, even if it stays empty.
+        """
 
-    def _findStudentsToExtract(self, filelist, students):
-        """Given list of paths and students, return list of which paths to be extracted."""
+        seen = set()
+        for info in zipEntries(zfile):
+            parts = info.filename.split('/')
+            if len(parts) < 2 or not parts[1]:
+                yield (info, None, None)
+                continue
 
-        extractFiles = []
-        for filename in filelist:
-            student = filename.split(os.sep)[1].split('(')[0]
-            if any([s.upper() == student.upper() for s in students]):
-                extractFiles.append(filename)
+            student = parts[1].split('(')[0]
+            if not self._isSelected(student):
+                yield (info, None, None)
+                continue
 
-        if not extractFiles:
-            raise BadCSVError("Error: csv file matches no submissions.")
-        return extractFiles
+            destination = self._planDestination(parts[2:])
+            if student not in seen:
+                seen.add(student)
+                yield (info, student, os.path.join('Text', ''))
+            elif not destination:
+                yield (info, None, None)
+
+            if destination:
+                yield (info, student, destination)
+
+    def _planDestination(self, parts):
+        """Return path within the student folder for the remaining parts of a T-Square entry path."""
+
+        if not parts or parts == ['']:
+            return None
+
+        if parts[0] == "Submission attachment(s)":
+            parts = parts[1:]
+            if not parts or parts == ['']:
+                return None
+        elif parts[0] == "Feedback Attachment(s)" or len(parts) == 1:
+            parts = ["Text"] + parts
+
+        return os.path.join(*parts)
+
+    def _skipReason(self, info):
+        """Return why _planEntries leaves the zip entry out."""
+
+        parts = info.filename.split('/')
+        if len(parts) < 2 or not parts[1]:
+            return 'not in a student folder'
+        if not self._isSelected(parts[1].split('(')[0]):
+            return 'student not selected'
+        return 'folder'
+
+    def report(self, zippy):
+        """Find late and missing submissions from the bulk submissions zip without extracting it.
+
+        Reads the zip's central directory once: only the timestamp.txt entries are decompressed, and a
+        student has a submission if any of their files is planned outside of the 'Text' folder.
+
+        Returns:
+            late: list of students who submitted past the duedate. Empty if duetime is zero.
+            noSub: list of students without any submission files
+        """
+
+        stamps = {}
+        submitted = set()
+        students = set()
+        textFolder = os.path.join('Text', '')
+        # ZipFile reopens a zip given by name for every read, so hand it one open file instead
+        with open(zippy, 'rb') as f, self._openZip(zippy, f) as zfile:
+            for info, student, filename in self._planEntries(zfile):
+                if student is None:
+                    continue
+                students.add(student)
+                if filename == os.path.join('Text', 'timestamp.txt'):
+                    stamps[student] = info
+                elif not filename.startswith(textFolder):
+                    submitted.add(student)
+
+            results = []
+            for student in sorted(students):
+                lateStatus = None
+                if self.duetime:
+                    if student in stamps:
+                        lateStatus = self._lateStatus(student, zfile.read(stamps[student]))
+                    else:
+                        print "Warning: No timestamp found for " + student
+                results.append((lateStatus, None if student in submitted else student))
+        return self._collectStatus(results)
+
+    def _collectStatus(self, results):
+        """Format (lateStatus, noSubmission) results into the late and no submission lists."""
+
+        late = []
+        noSub = []
+        self.lateStudents = set()
+        for lateStatus, noSubmission in results:
+            if lateStatus:
+                self.lateStudents.add(lateStatus[1])
+                late.append('  {timestamp}    {student}'.format(timestamp=lateStatus[0], student=(lateStatus[1])))
+            if noSubmission:
+                noSub.append('  {student}'.format(student=noSubmission))
+        return (late, noSub)
 
     def rename(self, directory):
         """Renames all student folders in directory to their names.
@@ -370,17 +3066,23 @@ class TSquare(AssignmentManager):
 
         for path in strayFiles:
             if os.path.basename(path) == 'timestamp.txt' :
-                f = open(path, 'r')
-                stamp = f.read()
-                f.close()
-                subtime = self.stripTime(stamp)
-
-                if not subtime <= self.duetime :
-                    fmt = '%m/%d/%Y  %H:%M'
-                    return (subtime.strftime(fmt), student)
-                return None
+                with open(path, 'r') as f:
+                    return self._lateStatus(student, f.read())
         print "Warning: No timestamp found for " + student
 
+    def _lateStatus(self, student, stamp):
+        """Returns the formatted submission time and student if the timestamp is past the duedate.
+
+        Timestamps are in UTC, so they are compared against the duedate converted to UTC once and only
+        late submissions are converted to US/Eastern for printing.
+        """
+
+        submitted = datetime(*map(int, _timestamp_pattern.search(stamp).groups()))
+        if submitted <= self.dueUTC:
+            return None
+        fmt = '%m/%d/%Y  %H:%M'
+        return (self.stripTime(stamp).strftime(fmt), student)
+
     def _moveFeedbackAttachments(self, source, dest):
         """Moves the Feedback Attachment(s) folder."""
 
@@ -429,28 +3131,20 @@ class TSquare(AssignmentManager):
         """Processes each student folder.
 
         Goes through each folder in the given directory and processes it. If late status is being checked
-        a list returned with the late students for that assignment. If out is specified, all student
-        folders are moved outside of the base assignment directory. That directory is then removed.
+        a list returned with the late students for that assignment. Folders are processed in sorted
+        order (in parallel if more than one job was requested), so the lists are always in the same order.
 
         Args:
             directory: directory with student submission folders
-            out: flag for moving the student folders out of the assignment directory
 
         Returns:
             late: list of students who submitted past the duedate. Empty if duetime is zero.
+            noSub: list of students without any submission files
         """
 
-        late = []
-        noSub = []
-        for fn in os.listdir(directory) :
-            studentFolder = os.path.join(directory, fn)
-            if os.path.isdir(studentFolder) :
-                lateStatus, noSubmission = self._processStudentFolder(studentFolder)
-                if lateStatus:
-                    late.append('  {timestamp}    {student}'.format(timestamp=lateStatus[0], student=(lateStatus[1])))
-                if noSubmission:
-                    noSub.append('  {student}'.format(student=noSubmission))
-        return (late, noSub)
+        folders = sorted(os.path.join(directory, fn) for fn in os.listdir(directory))
+        folders = [(folder,) for folder in folders if os.path.isdir(folder)]
+        return self._collectStatus(self._mapFolders('_processStudentFolder', folders))
 
     def stripTime(self, stamp):
         """Converts the timestamp for the student's submission into a timezone aware time.
@@ -464,28 +3158,27 @@ class TSquare(AssignmentManager):
         Returns:
             subtime: US/Eastern timezone aware submission time
         """
-        rawtime = re.compile(r"^(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})")
-        timey = rawtime.search(stamp).groups()        # ('YYYY', 'mm', 'dd', 'HH', 'mm')
-        timelist = list(timey)
-        timey = '-'.join(timelist)
-        timey = datetime.strptime(timey, "%Y-%m-%d-%H-%M")
+        timey = _timestamp_pattern.search(stamp).groups()        # ('YYYY', 'mm', 'dd', 'HH', 'mm')
+        timey = datetime(*map(int, timey))
 
-        eastern = timezone('US/Eastern')
-        subtime = timey.replace(tzinfo=pytz.utc).astimezone(eastern)
-        subtime = eastern.normalize(subtime)
+        subtime = timey.replace(tzinfo=pytz.utc).astimezone(_eastern)
+        subtime = _eastern.normalize(subtime)
         return subtime
 
-    def _inspectFolders(self, path, move):
-        """Looks through each student folder in the directory and decompresses any compressed files."""
+    def _inspectFolders(self, path, folderList, move, done=None):
+        """Looks through each student folder in the directory and decompresses any compressed files.
+
+        If folderList is given, only those student folders are inspected. done is called with each
+        student folder as soon as it is finished.
+        """
 
-        for folder in os.listdir(path):
+        folders = []
+        for folder in sorted(os.listdir(path)):
             folderPath = os.path.abspath(os.path.join(path, folder))
-            if os.path.isdir(folderPath):
-                extract(os.path.join(path, folder))
-                if move == '1':
-                    self._flattenOneLevel(folderPath)
-                if move == 'all':
-                    self._flattenAllLevels(folderPath)
+            if os.path.isdir(folderPath) and (folderList is None or folderPath in folderList):
+                folders.append((folderPath, move))
+        for violations in self._mapFolders('_inspectFolder', folders, done):
+            self.violations += tuple(violations)
 
     def _flattenOneLevel(self, source):
         """Flatten the source directory's structure by one level."""
@@ -501,42 +3194,55 @@ class TSquare(AssignmentManager):
                 except OSError:
                     print "Error: Unable to remove path: " + os.path.abspath(path)
 
-    def _flattenAllLevels(self, source):
-        """Flatten the source directory's struture by all levels."""
-
-        for root, directories, files in os.walk(source):
-            for file in files:
-                filePath = os.path.join(root, file)
-                if os.path.basename(os.path.dirname(filePath)) == "Text":
-                    continue
-                destination = os.path.join(source, file)
-                if filePath != destination:
-                    shutil.move(filePath, destination)
-
-        for directory in os.listdir(source):
-            if os.path.isdir(os.path.join(source, directory)) and directory != "Text":
-                shutil.rmtree(os.path.join(source,directory))
-
     def _moveAllFiles(self, destination, source):
         """Moves every file in the source directory to the destination directory."""
 
         for directory in os.listdir(source):
             if os.path.isdir(os.path.join(source, directory)):
-                destPath = os.path.join(destination, directory)
-                if os.path.exists(destPath):
-                    shutil.rmtree(destPath)
-                shutil.move(os.path.join(source, directory), destPath)
+                self._moveFolder(destination, os.path.join(source, directory))
 
 
 class Canvas(AssignmentManager):
     """Manager to handle Canvas submissions."""
 
     @classmethod
-    def execute(cls, zipfile, roll, path, csv, section, move):
-        """Run all neccessary fix up functions for Canvas submissions."""
+    def execute(cls, zipfile, roll, path, csv, section, move, stream=False, jobs=1, threads=1,
+                incremental=False, dedup=False, profile=None, profiler=None, report=False, plan=None,
+                limits=None, grader=None, sections=None, pathTemplate='{section}', shards=None,
+                shardTable='submissionfix_shards.json', follow=None, outputArchive=None, index=None,
+                cache=False):
+        """Run all neccessary fix up functions for Canvas submissions.
+
+        With report set nothing is extracted, the late and no submission lists are read from the zip.
+        If plan is a filename nothing is extracted either, the planned layout is written to it as json.
+        If profile is a filename, the time and resources used by each phase are written to it as json.
+        A Profiler may also be passed in to record (and hook into) the run. With ExtractionLimits,
+        archives students submitted that pass a limit are quarantined and listed at the end. A
+        Grader is handed each student folder as soon as it is complete in the destination.
+
+        With a list of sections (or ['all']), the zip is read once and every section's students
+        are written to their own folder, pathTemplate with {section} replaced by the section name.
+        With a number of shards instead, the students are split into that many folders of about
+        the same total size, and which student went where is written to shardTable. follow, a
+        dictionary of LocalHeaders options, streams the zip while it is still being written. With
+        an outputArchive file name (or '-' for stdout), the student folders are written into that
+        tar instead of the extraction path (see ArchiveSink). If index is a file name, a record of
+        every extracted file is written to it (see IndexWriter); the zip is then streamed, so files
+        are recorded as they are written. With cache set, the roll is read from its RosterCache, as
+        the command line does unless --no-cache is given.
+        """
 
-        manager = cls(roll)
+        manager = cls(roll, cache=cache)
+        manager.jobs = jobs
+        manager.threads = threads
+        manager.dedup = dedup
+        manager.flatten = move
+        manager.limits = limits
+        manager.follow = follow
+        manager.profiler = profiler or (Profiler() if profile else None)
         directory = path or os.getcwd()
+        graded = grader.submit if grader else None
+        records = [] if index and not report else None
 
         if csv :
             manager.students = manager.readCSV(csv)
@@ -546,29 +3252,130 @@ class Canvas(AssignmentManager):
             manager.students = manager.sections[section.upper()]
             print "Extracting only section {section}.".format(section=section.upper())
 
-        if path :
+        if sections:
+            names = manager._sectionNames(sections)
+            manager.students = [student for name in names for student in manager.sections[name]]
+            manager.routes = manager._sectionRoutes(names, pathTemplate)
+            print "Extracting sections {sections} in one pass.".format(sections=', '.join(names))
+        elif shards and not report:
+            with manager._phase('shard'):
+                manager.writeShards(zipfile, shards, shardTable)
+
+        if plan:
+            manager.writePlan(zipfile, plan)
+            return
+
+        if path and not report and not outputArchive and not (incremental and os.path.isdir(path)):
             manager.createPath(path)
 
-        tempPath = os.path.join(os.getcwd(), 'temp_extraction_folder')
-        try:
-            os.makedirs(tempPath)
-        except OSError:
-                print "Error: Temporary extraction path already exists."
-
-        print "Extracting bulk submissions."
-        manager.extractBulk(zipfile, directory=tempPath)
-        print "Moving and renaming submission files."
-        folders = manager.move(tempPath, roll, zipfile, csv)
-        print "Decompressing any compressed files."
-        manager._inspectFolders(tempPath, folders, move)
-        print "Moving submissions out of temporary folder."
-        manager._moveAllFiles(directory, tempPath)
-        shutil.rmtree(tempPath)
-
-    def __init__(self, roll, students=None):
-        self.roll, self.sections = self._createRollDict(roll)
+        if report:
+            print "Reading submissions from bulk submissions zip."
+        elif outputArchive:
+            print "Writing student folders to " + outputArchive
+            with manager._phase('writeArchive'), ArchiveSink(outputArchive) as sink:
+                manager.writeArchive(zipfile, sink, records)
+        elif manager.routes is not None:
+            print "Extracting bulk submissions into grader folders."
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, done=graded, records=records)
+        elif incremental:
+            manifest = Manifest(directory, move)
+            changed = manifest.update(manager, zipfile)
+            print "Extracting {changed} new or changed student folders.".format(changed=len(changed))
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, changed, done=graded, records=records)
+            manifest.save()
+        elif stream or follow is not None or index:
+            print "Extracting bulk submissions into student folders."
+            with manager._phase('stream', directory):
+                manager.stream(zipfile, directory, done=graded, records=records)
+        else:
+            tempPath = os.path.join(os.getcwd(), 'temp_extraction_folder')
+            try:
+                os.makedirs(tempPath)
+            except OSError:
+                    print "Error: Temporary extraction path already exists."
+
+            print "Extracting bulk submissions."
+            with manager._phase('extractBulk', tempPath):
+                manager.extractBulk(zipfile, directory=tempPath)
+            print "Moving and renaming submission files."
+            with manager._phase('move', tempPath):
+                folders = manager.move(tempPath, roll, zipfile, csv)
+            print "Decompressing any compressed files."
+            if grader:
+                # move each student out as soon as it is done, so it can be graded while the others are decompressed
+                graded = lambda folder: grader.submit(manager._moveFolder(directory, folder))
+            with manager._phase('_inspectFolders', tempPath):
+                manager._inspectFolders(tempPath, folders, move, done=graded)
+            print "Moving submissions out of temporary folder."
+            with manager._phase('_moveAllFiles', directory):
+                manager._moveAllFiles(directory, tempPath)
+            shutil.rmtree(tempPath)
+
+        with manager._phase('report'):
+            late, noSub = manager.report(zipfile)
+        if index and not report:
+            with manager._phase('index'), IndexWriter(index) as writer:
+                manager.writeIndex(records, writer)
+        if grader:
+            with manager._phase('grade'):
+                grader.close()
+        manager._printStatus(late, noSub, True)
+
+        if profile:
+            manager.profiler.dump(profile)
+            print "\nProfile written to " + profile
+
+    def __init__(self, roll, students=None, cache=False):
+        self.roll, self.sections = self._readRoll(roll, cache)
+        self.rollIndex = NameIndex.fromRoll(self.roll)
         self.students = students
 
+    def _studentSections(self):
+        """Return a dictionary of student to their section on the roll."""
+
+        sections = {}
+        for name, students in sorted(self.sections.iteritems()):
+            for student in students:
+                sections.setdefault(student, name)
+        return sections
+
+    def _sectionNames(self, sections):
+        """Return the roll's section names for the given names, or all of them if one is 'all'.
+
+        Exits with an error if a section is not on the roll.
+        """
+
+        names = [section.upper() for section in sections]
+        if 'ALL' in names:
+            return sorted(self.sections)
+        missing = [name for name in names if name not in self.sections]
+        if missing:
+            sys.exit("Error: Sections not found in roll: " + ', '.join(missing))
+        return sorted(set(names))
+
+    def _sectionRoutes(self, names, pathTemplate):
+        """Map each student of the sections to the section folders their folder goes in."""
+
+        routes = {}
+        for name in names:
+            for student in self.sections[name]:
+                routes.setdefault(student, []).append(pathTemplate.replace('{section}', name))
+        return routes
+
+    def _readRoll(self, roll, cache):
+        """Return _createRollDict of the roll, loaded from its RosterCache if cache is set."""
+
+        if not cache:
+            return self._createRollDict(roll)
+        rosterCache = RosterCache(roll)
+        compiled = rosterCache.load()
+        if compiled is None:
+            compiled = self._createRollDict(roll)
+            rosterCache.save(*compiled)
+        return compiled
+
     def _createRollDict(self, roll):
         """Create a dictionary of the roll, mapping formated names ('lastfirstmiddle') to names."""
 
@@ -580,7 +3387,7 @@ class Canvas(AssignmentManager):
             reader.next()
             for row in reader:
                 section = row[3].rsplit(' ', 1)[1].upper()
-                squishedName = re.sub(r'\W+', '', row[0]).upper()
+                squishedName = NameIndex.squish(row[0])
                 sections.setdefault(section, list()).append(row[0])
                 roster[squishedName] = row[0]
 
@@ -590,48 +3397,18 @@ class Canvas(AssignmentManager):
         """Handle extraction of bulk submissions zip file."""
 
         directory = directory or os.getcwd()
-        students = self.students or []
-
-        zfile = zipfile.ZipFile(zippy)
-        filelist = zfile.namelist()
-
-        if students:
-            filelist = self._findStudentsToExtract(filelist, students)
-
-        for filename in filelist:
-            zfile.extract(filename, directory)
+        self._extractEntries(zippy, directory)
 
-    def _findStudentsToExtract(self, filelist, students):
-        """Given list of paths and students, return list of which paths to be extracted."""
+    def _extractsEntry(self, filename):
+        """Check if the zip entry belongs to one of the students to extract, warning if not on the roll."""
 
-        extractFiles = []
-        for filename in filelist:
-            squishedName, _ = self._parseFileName(filename)
+        squishedName, _ = self._parseFileName(filename)
 
-            if squishedName.upper() in self.roll.keys():
-                student = self.roll[squishedName.upper()]
-            else:
-                print "Warning: {student} not found in roll. Skipping.".format(student=squishedName)
-                continue
-
-            if any([s.upper() == student.upper() for s in students]):
-                extractFiles.append(filename)
-
-        if not extractFiles:
-            raise BadCSVError("Error: csv file matches no submissions.")
-        return extractFiles
-
-    def _processStudentFolder(self, studentFolder):
-        """Collects and moves stray files, checks for late status, and handles submission files."""
-
-        strayFiles = list(self._getFilePaths(studentFolder))
-
-        lateStatus = self._checkTimeStamp(os.path.basename(studentFolder), strayFiles)
-
-        self._moveStrayFiles(studentFolder, strayFiles)
-        self._extractSubmissionAttachments(studentFolder)
-
-        return lateStatus
+        student = self.rollIndex.find(squishedName)
+        if not student:
+            print "Warning: {student} not found in roll. Skipping.".format(student=squishedName)
+            return False
+        return self._isSelected(student)
 
     def move(self, directory, roster, submissions, csv):
         """Moves files into the correct student folder.
@@ -649,40 +3426,93 @@ class Canvas(AssignmentManager):
         """
 
         createdFolders = set()
-        for filename in os.listdir(directory):
-            if os.path.isdir(os.path.join(directory, filename)):
+        with CentralDirectory(submissions) as zfile:
+            for info in zfile.entries():
+                path = entryPath(directory, info.filename)
+                if info.filename.endswith('/') or not os.path.isfile(path):
+                    continue
+
+                studentName, studentFile = self._parseFileName(info.filename)
+                student = self.rollIndex.find(studentName)
+
+                if student:
+                    studentFolder = self._createStudentFolder(directory, student, createdFolders)
+                    newFilename = self._renameFile(studentFile)
+                    newPath = os.path.join(studentFolder, newFilename)
+
+                    if os.path.exists(newPath):
+                        self._warnCollision(student, newFilename)
+                        continue
+                    shutil.move(path, newPath)
+
+        return map(os.path.abspath, createdFolders)
+
+    def _planEntries(self, zfile):
+        """Yield (entry, student, filename) for every submission file belonging to a student on the roll."""
+
+        for info in zipEntries(zfile):
+            if info.filename.endswith('/'):
+                yield (info, None, None)
                 continue
 
-            studentName, studentFile = self._parseFileName(filename)
+            studentName, studentFile = self._parseFileName(info.filename)
+            student = self.rollIndex.find(studentName)
+            if student and self._isSelected(student):
+                yield (info, student, self._renameFile(studentFile))
+            else:
+                yield (info, None, None)
+
+    def _skipReason(self, info):
+        """Return why _planEntries leaves the zip entry out."""
+
+        if info.filename.endswith('/'):
+            return 'folder'
+        studentName, _ = self._parseFileName(info.filename)
+        if not self.rollIndex.find(studentName):
+            return 'student not on roll'
+        return 'student not selected'
 
-            if studentName.upper() in self.roll.keys():
-                student = self.roll[studentName.upper()]
+    def report(self, zippy):
+        """Find late and missing submissions from the names in the bulk submissions zip.
 
-                studentFolder = self._createStudentFolder(directory, student, createdFolders)
-                newFilename = self._renameFile(studentFile)
-                newPath = os.path.join(studentFolder, newFilename)
+        Canvas marks files submitted past the due date with '_late_' in their name. Students on the
+        roll (limited to the selected students or section) without any file in the zip have no
+        submission.
+
+        Returns:
+            late: list of students with a late submission
+            noSub: list of students without any submission files
+        """
 
-                if os.path.exists(newPath):
-                    print ("Warning: {student} has a filename collision on '{file}'."
-                            " The student may have named files using the format 'file-1.txt' on purpose."
-                            " Please manually check, move, and rename their files.".format(student=student, file=newFilename))
+        submitted = set()
+        late = set()
+        with self._openZip(zippy) as zfile:
+            for info in zfile.entries():
+                filename = info.filename
+                if filename.endswith('/'):
                     continue
-                shutil.move(os.path.join(directory, filename), newPath)
 
-        return map(os.path.abspath, createdFolders)
+                match = self._getMatch(filename)
+                if not match:
+                    raise MismatchError('Pattern not matched on: {filename}'.format(filename=filename))
+                student = self.rollIndex.find(match.group('student').replace('_', ''))
+                if student:
+                    submitted.add(student)
+                    if match.groupdict().get('late'):
+                        late.add(student)
+
+        selected = set(student for student in self.roll.itervalues() if self._isSelected(student))
+        self.lateStudents = late & selected
+        late = ['  ' + student for student in sorted(late & selected)]
+        noSub = ['  ' + student for student in sorted(selected - submitted)]
+        return (late, noSub)
 
-    def _createStudentFolder(self, directory, student, createdFolders):
-        """Creates a folder with student's name, overwriting it if the folder already exists."""
+    def _warnCollision(self, student, filename):
+        """Warn user that a student's resubmitted file would overwrite another of their files."""
 
-        studentFolder = os.path.join(directory, student)
-        if os.path.exists(studentFolder):
-            if studentFolder not in createdFolders:
-                shutil.rmtree(studentFolder)
-                os.makedirs(studentFolder)
-        else:
-            os.makedirs(studentFolder)
-        createdFolders.add(studentFolder)
-        return os.path.abspath(studentFolder)
+        print ("Warning: {student} has a filename collision on '{file}'."
+                " The student may have named files using the format 'file-1.txt' on purpose."
+                " Please manually check, move, and rename their files.".format(student=student, file=filename))
 
     def _getMatch(self, student):
         """Try to match student string with pattern and stop when the pattern is found."""
@@ -711,55 +3541,26 @@ class Canvas(AssignmentManager):
             filename = '.'.join(tempfilename)
         return filename
 
-    def _inspectFolders(self, path, folderList, move):
-        """Looks through each student folder in the directory and decompresses any compressed files."""
+    def _inspectFolders(self, path, folderList, move, done=None):
+        """Looks through each student folder in the directory and decompresses any compressed files.
+
+        done is called with each student folder as soon as it is finished.
+        """
 
-        for folder in os.listdir(path):
+        folders = []
+        for folder in sorted(os.listdir(path)):
             folderPath = os.path.abspath(os.path.join(path, folder))
             if os.path.isdir(folderPath) and folderPath in folderList:
-                extract(os.path.join(path, folder))
-                if move == '1':
-                    self._flattenOneLevel(folderPath)
-                if move == 'all':
-                    self._flattenAllLevels(folderPath)
-
-    def _flattenOneLevel(self, source):
-        """Flatten the source directory's structure by one level."""
-
-        for directory in os.listdir(source):
-            currentFolder = os.path.join(source, directory)
-            if os.path.isdir(currentFolder):
-                for file in os.listdir(currentFolder):
-                    shutil.move(os.path.join(currentFolder, file), os.path.join(source, file))
-
-                try:
-                    shutil.rmtree(currentFolder)
-                except OSError:
-                    print "Error: Unable to remove path: " + os.path.abspath(path)
-
-    def _flattenAllLevels(self, source):
-        """Flatten the source directory's struture by all levels."""
-
-        for root, directories, files in os.walk(source):
-            for file in files:
-                filePath = os.path.join(root, file)
-                destination = os.path.join(source, file)
-                if filePath != destination:
-                    shutil.move(filePath, destination)
-
-        for directory in os.listdir(source):
-            if os.path.isdir(os.path.join(source, directory)):
-                shutil.rmtree(os.path.join(source,directory))
+                folders.append((folderPath, move))
+        for violations in self._mapFolders('_inspectFolder', folders, done):
+            self.violations += tuple(violations)
 
     def _moveAllFiles(self, destination, source):
         """Moves every file in the source directory to the destination directory."""
 
         for directory in os.listdir(source):
             if os.path.isdir(os.path.join(source, directory)):
-                destPath = os.path.join(destination, directory)
-                if os.path.exists(destPath):
-                    shutil.rmtree(destPath)
-                shutil.move(os.path.join(source, directory), destPath)
+                self._moveFolder(destination, os.path.join(source, directory))
 
 
 
@@ -768,7 +3569,8 @@ def main(sysargs):
                                     ' The submission manager must be chosen (TSquare, Canvas). If using Canvas, the class'
                                     ' roster (from Canvas) must be included as well. Note that with Canvas only csv or'
                                     ' section may be used at a time. If both are used, section will override csv.')
-    parser.add_argument('bulksubmission', help='bulk submissions zip file', metavar='submissions.zip')
+    parser.add_argument('bulksubmission', help='bulk submissions zip file, or - to read it from stdin',
+                        metavar='submissions.zip')
 
     subparsers = parser.add_subparsers(title='Submission Managers')
 
@@ -781,6 +3583,57 @@ def main(sysargs):
     t2.add_argument('-t', '--time', help=('Flag late submissions past due date. '
                                           'Checks submissions using the US/Eastern timezone. Requires pytz to use.'),
                                         nargs='+', action=requiredLength(2), metavar=('mm/dd/yy', 'hh:mm'))
+    t2.add_argument('--stream', help=('write each file straight into its student folder in a single pass'
+                    ' instead of extracting to a temporary folder first'), action='store_true')
+    t2.add_argument('-j', '--jobs', help='number of student folders to process in parallel (default: 1)',
+                    type=int, default=1)
+    t2.add_argument('--threads', help='number of threads decompressing the bulk submissions zip (default: 1)',
+                    type=int, default=1)
+    t2.add_argument('--incremental', help=('only extract students whose submissions changed since the last'
+                    ' incremental run into the same path, leaving other student folders untouched'),
+                    action='store_true')
+    t2.add_argument('--dedup', help=('write identical files only once and hardlink the other copies to it'
+                    ' (editing one copy in place changes all of them)'), action='store_true')
+    t2.add_argument('-r', '--report', help=('only list late students and students without a submission,'
+                    ' read straight from the zip without extracting anything'), action='store_true')
+    t2.add_argument('--plan', help=('write where every file of the zip would be extracted to, and why files'
+                    ' would be skipped, as json to FILE without extracting anything (default: submissionfix_plan.json)'),
+                    nargs='?', const='submissionfix_plan.json', metavar='FILE')
+    t2.add_argument('--profile', help=('write the time and resources used by each phase and the slowest'
+                    ' students as json to FILE (default: submissionfix_profile.json)'), nargs='?',
+                    const='submissionfix_profile.json', metavar='FILE')
+    t2.add_argument('--max-archive-size', help=('quarantine a submitted archive once it extracts more than SIZE'
+                    ' bytes (K, M and G suffixes allowed)'), type=byteSize, metavar='SIZE')
+    t2.add_argument('--max-archive-files', help='quarantine a submitted archive once it extracts more than N files',
+                    type=int, metavar='N')
+    t2.add_argument('--max-ratio', help=('quarantine a submitted archive once it extracts more than RATIO times'
+                    ' its own size'), type=float, metavar='RATIO')
+    t2.add_argument('--max-student-size', help=('quarantine the archive that takes what a student\'s archives'
+                    ' extract past SIZE bytes (K, M and G suffixes allowed)'), type=byteSize, metavar='SIZE')
+    t2.add_argument('--max-student-files', help=('quarantine the archive that takes what a student\'s archives'
+                    ' extract past N files'), type=int, metavar='N')
+    t2.add_argument('--exec', help=('run CMD in each student folder as soon as it is extracted, with {dir}'
+                    ' replaced by the folder path'), dest='command', metavar='CMD')
+    t2.add_argument('--exec-workers', help='number of student folders graded by --exec at once (default: 1)',
+                    type=int, default=1, metavar='N')
+    t2.add_argument('--exec-summary', help=('json file for the exit code, duration and output of --exec in each'
+                    ' student folder (default: submissionfix_exec.json)'), default='submissionfix_exec.json',
+                    metavar='FILE')
+    t2.add_argument('--shards', help=('split the students into N folders of about the same total submission'
+                    ' size, extracted in a single pass'), type=int, metavar='N')
+    t2.add_argument('--shard-table', help=('json file for which students went in which of the --shards'
+                    ' (default: submissionfix_shards.json)'), default='submissionfix_shards.json', metavar='FILE')
+    t2.add_argument('--follow', help=('extract each file as soon as it is downloaded, reading the zip front'
+                    ' to back while it is still being written (always on when the zip is read from stdin)'),
+                    action='store_true')
+    t2.add_argument('--follow-timeout', help=('seconds the zip may stop growing before --follow takes the'
+                    ' download as finished (default: 30)'), type=float, default=30, metavar='SECONDS')
+    t2.add_argument('--output-archive', help=('write the student folders into one tar file instead of a folder'
+                    ' tree: FILE.tar, FILE.tar.gz, FILE.tar.bz2 or FILE.tar.zst (needs zstandard), or - for an'
+                    ' uncompressed tar on stdout'), metavar='FILE')
+    t2.add_argument('--index', help=('write a record of every extracted file (student, section, zip entry,'
+                    ' path, size, CRC, late and the archive it came from) to FILE, as JSON Lines or, for FILE.db'
+                    ' or FILE.sqlite, an SQLite table'), metavar='FILE')
     t2.set_defaults(action='tsquare')
 
     canv = subparsers.add_parser('canvas', help='Submission files downloaded from Canvas')
@@ -788,9 +3641,67 @@ def main(sysargs):
     canv.add_argument('-c', '--csv', help='csv file of particular students to extract (semicolon seperated)')
     canv.add_argument('-p', '--path', help='extraction path for bulk submissions zip')
     canv.add_argument('-s', '--section', help='grading section to extract from submissions')
+    canv.add_argument('--sections', help=('grading sections to extract in a single pass over the zip, each into'
+                    ' its own folder, or "all" for every section on the roll'), nargs='+', metavar='SECTION')
+    canv.add_argument('--path-template', help=('folder each of --sections is extracted to, within the extraction'
+                    ' path, with {section} replaced by the section (default: {section})'), default='{section}',
+                    metavar='TEMPLATE')
     canv.add_argument('-m', '--move', help=('move extracted files within student folder out'
                     ' one level or all levels (completely collapse directory structure)'),
                     choices=['1', 'all'])
+    canv.add_argument('--stream', help=('write each file straight into its student folder in a single pass'
+                    ' instead of extracting to a temporary folder first'), action='store_true')
+    canv.add_argument('-j', '--jobs', help='number of student folders to process in parallel (default: 1)',
+                    type=int, default=1)
+    canv.add_argument('--threads', help='number of threads decompressing the bulk submissions zip (default: 1)',
+                    type=int, default=1)
+    canv.add_argument('--incremental', help=('only extract students whose submissions changed since the last'
+                    ' incremental run into the same path, leaving other student folders untouched'),
+                    action='store_true')
+    canv.add_argument('--dedup', help=('write identical files only once and hardlink the other copies to it'
+                    ' (editing one copy in place changes all of them)'), action='store_true')
+    canv.add_argument('-r', '--report', help=('only list late students and students on the roll without a'
+                    ' submission, read straight from the zip without extracting anything'), action='store_true')
+    canv.add_argument('--plan', help=('write where every file of the zip would be extracted to, and why files'
+                    ' would be skipped, as json to FILE without extracting anything (default: submissionfix_plan.json)'),
+                    nargs='?', const='submissionfix_plan.json', metavar='FILE')
+    canv.add_argument('--profile', help=('write the time and resources used by each phase and the slowest'
+                    ' students as json to FILE (default: submissionfix_profile.json)'), nargs='?',
+                    const='submissionfix_profile.json', metavar='FILE')
+    canv.add_argument('--max-archive-size', help=('quarantine a submitted archive once it extracts more than SIZE'
+                    ' bytes (K, M and G suffixes allowed)'), type=byteSize, metavar='SIZE')
+    canv.add_argument('--max-archive-files', help='quarantine a submitted archive once it extracts more than N files',
+                    type=int, metavar='N')
+    canv.add_argument('--max-ratio', help=('quarantine a submitted archive once it extracts more than RATIO times'
+                    ' its own size'), type=float, metavar='RATIO')
+    canv.add_argument('--max-student-size', help=('quarantine the archive that takes what a student\'s archives'
+                    ' extract past SIZE bytes (K, M and G suffixes allowed)'), type=byteSize, metavar='SIZE')
+    canv.add_argument('--max-student-files', help=('quarantine the archive that takes what a student\'s archives'
+                    ' extract past N files'), type=int, metavar='N')
+    canv.add_argument('--exec', help=('run CMD in each student folder as soon as it is extracted, with {dir}'
+                    ' replaced by the folder path'), dest='command', metavar='CMD')
+    canv.add_argument('--exec-workers', help='number of student folders graded by --exec at once (default: 1)',
+                    type=int, default=1, metavar='N')
+    canv.add_argument('--exec-summary', help=('json file for the exit code, duration and output of --exec in each'
+                    ' student folder (default: submissionfix_exec.json)'), default='submissionfix_exec.json',
+                    metavar='FILE')
+    canv.add_argument('--shards', help=('split the students into N folders of about the same total submission'
+                    ' size, extracted in a single pass'), type=int, metavar='N')
+    canv.add_argument('--shard-table', help=('json file for which students went in which of the --shards'
+                    ' (default: submissionfix_shards.json)'), default='submissionfix_shards.json', metavar='FILE')
+    canv.add_argument('--follow', help=('extract each file as soon as it is downloaded, reading the zip front'
+                    ' to back while it is still being written (always on when the zip is read from stdin)'),
+                    action='store_true')
+    canv.add_argument('--follow-timeout', help=('seconds the zip may stop growing before --follow takes the'
+                    ' download as finished (default: 30)'), type=float, default=30, metavar='SECONDS')
+    canv.add_argument('--output-archive', help=('write the student folders into one tar file instead of a folder'
+                    ' tree: FILE.tar, FILE.tar.gz, FILE.tar.bz2 or FILE.tar.zst (needs zstandard), or - for an'
+                    ' uncompressed tar on stdout'), metavar='FILE')
+    canv.add_argument('--index', help=('write a record of every extracted file (student, section, zip entry,'
+                    ' path, size, CRC, late and the archive it came from) to FILE, as JSON Lines or, for FILE.db'
+                    ' or FILE.sqlite, an SQLite table'), metavar='FILE')
+    canv.add_argument('--no-cache', help=('parse the roll again instead of reading the compiled copy cached by'
+                    ' earlier runs in ~/.cache/submissionfix'), dest='cache', action='store_false')
     canv.set_defaults(action='canvas')
 
     if len(sysargs) == 1 :
@@ -812,13 +3723,65 @@ def main(sysargs):
         sys.exit(1)
 
     args = parser.parse_args(sysargs[1:])
+    if args.action == "canvas" and '{section}' not in args.path_template:
+        parser.error('--path-template must contain {section}')
+    if args.shards is not None and args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if args.action == "canvas" and args.shards and args.sections:
+        parser.error('--shards cannot be used with --sections')
+    if args.incremental and (args.shards or getattr(args, 'sections', None)):
+        parser.error('--incremental cannot be used with --shards or --sections')
+    if args.bulksubmission == '-':
+        args.follow = True
+    if args.follow and (args.plan or args.incremental or args.shards or getattr(args, 'sections', None)):
+        parser.error('--follow cannot be used with --plan, --incremental, --shards or --sections')
+    if args.output_archive and (args.follow or args.incremental or args.command or args.plan or any(
+            [args.max_archive_size, args.max_archive_files, args.max_ratio, args.max_student_size,
+             args.max_student_files])):
+        parser.error('--output-archive cannot be used with --follow, --incremental, --exec, --plan or the extraction'
+                     ' limits')
+    if args.output_archive and (args.jobs > 1 or args.threads > 1 or args.dedup):
+        parser.error('--output-archive cannot be used with -j, --threads or --dedup')
+    if args.output_archive and ArchiveSink.mode(args.output_archive) is None:
+        parser.error('--output-archive must end in .tar, .tar.gz, .tgz, .tar.bz2, .tbz2, .tar.zst or .tzst, or be -')
+    if args.output_archive and ArchiveSink.mode(args.output_archive) == 'zst' and zstandard is None:
+        parser.error('the zstandard module is needed to write .zst archives')
+    stdout = sys.stdout
+    if args.output_archive == '-':
+        # the archive goes to stdout, so everything printed goes to stderr instead
+        sys.stdout = sys.stderr
+    follow = None
+    if args.follow:
+        follow = {'idle': args.follow_timeout}
+    if args.bulksubmission == '-':
+        args.bulksubmission, follow['finished'] = spoolStream(sys.stdin)
+
+    limits = ExtractionLimits(args.max_archive_size, args.max_archive_files, args.max_ratio,
+                              args.max_student_size, args.max_student_files)
+    grader = None
+    if args.command:
+        grader = Grader(args.command, workers=args.exec_workers, summary=args.exec_summary)
 
-    if args.action == "tsquare":
-        TSquare.execute(args.bulksubmission, args.path, args.move, args.csv, args.time)
-    elif args.action == "canvas":
-        Canvas.execute(args.bulksubmission, args.roll, args.path, args.csv, args.section, args.move)
-
-    print "\nDone"
+    try:
+        if args.action == "tsquare":
+            TSquare.execute(args.bulksubmission, args.path, args.move, args.csv, args.time, stream=args.stream,
+                            jobs=args.jobs, threads=args.threads, incremental=args.incremental,
+                            dedup=args.dedup, profile=args.profile, report=args.report, plan=args.plan,
+                            limits=limits, grader=grader, shards=args.shards, shardTable=args.shard_table,
+                            follow=follow, outputArchive=args.output_archive, index=args.index)
+        elif args.action == "canvas":
+            Canvas.execute(args.bulksubmission, args.roll, args.path, args.csv, args.section, args.move,
+                           stream=args.stream, jobs=args.jobs, threads=args.threads,
+                           incremental=args.incremental, dedup=args.dedup, profile=args.profile,
+                           report=args.report, plan=args.plan, limits=limits, grader=grader,
+                           sections=args.sections, pathTemplate=args.path_template, shards=args.shards,
+                           shardTable=args.shard_table, follow=follow, outputArchive=args.output_archive,
+                           index=args.index, cache=args.cache)
+        print "\nDone"
+    finally:
+        if follow and 'finished' in follow:
+            os.remove(args.bulksubmission)
+        sys.stdout = stdout
 
 
 if __name__ == '__main__' :
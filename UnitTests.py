@@ -6,10 +6,23 @@ A collection of unit tests for the submission script.
 """
 __author__ = "Marie Weeks"
 
+import os
+import sys
+import json
+import zlib
+import time
+import struct
+import shutil
+import sqlite3
+import zipfile
+import threading
+import tarfile
+import tempfile
 import unittest
 import datetime
 from contextlib import contextmanager
 import SubmissionFix
+import Benchmarks
 
 try: 
     from pytz import timezone
@@ -63,6 +76,849 @@ class TestSubfixMethods(unittest.TestCase):
         roll, _ = SubmissionFix.Canvas('testingcsv6.csv')._createRollDict('testingcsv6.csv')
         self.assertEqual(roll, answer)
 
+    #RosterCache
+    def test_rosterCacheReusedUntilRollChanges(self):
+        path = tempfile.mkdtemp()
+        cacheHome = os.environ.get('XDG_CACHE_HOME')
+        try:
+            roll = os.path.join(path, 'roll.csv')
+            shutil.copy('testingcsv6.csv', roll)
+            os.environ['XDG_CACHE_HOME'] = os.path.join(path, 'cache')
+            canvas = SubmissionFix.Canvas(roll, cache=True)
+            cache = SubmissionFix.RosterCache(roll)
+            self.assertEqual(os.listdir(os.path.join(path, 'cache', 'submissionfix')), [os.path.basename(cache.path)])
+            self.assertEqual(cache.load(), (canvas.roll, canvas.sections))
+
+            # the cache is read instead of the roll while the roll is unchanged
+            roster = {'SNAKESOLID': 'Snake, Solid'}
+            cache.save(roster, {'A1': ['Snake, Solid']})
+            self.assertEqual(SubmissionFix.Canvas(roll, cache=True).rollIndex.find('snakesolid'), 'Snake, Solid')
+            self.assertEqual(SubmissionFix.Canvas(roll).roll, canvas.roll)
+
+            with open(roll, 'ab') as f:
+                f.write('"Snake, Solid",123,snake3,Course - B2\n')
+            self.assertIn('Snake, Solid', SubmissionFix.Canvas(roll, cache=True).sections['B2'])
+            self.assertEqual(cache.load()[0]['SNAKESOLID'], 'Snake, Solid')
+        finally:
+            if cacheHome is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = cacheHome
+            shutil.rmtree(path)
+
+    #NameIndex
+    def test_nameIndexContains(self):
+        index = SubmissionFix.NameIndex(SubmissionFix.TSquare().readCSV('testingcsv1.csv'))
+        self.assertTrue('SNAKE, SOLID' in index)
+        self.assertTrue('ocelot, revolver' in index)
+        self.assertFalse('Snake, Solidus' in index)
+
+    def test_nameIndexFindRoll(self):
+        canvas = SubmissionFix.Canvas('testingcsv6.csv')
+        self.assertEqual(canvas.rollIndex.find('silverburghsasakimeryl'), 'Silverburgh-Sasaki, Meryl')
+        self.assertEqual(canvas.rollIndex.find('ndramsophie'), 'N\'dram, Sophie')
+        self.assertEqual(canvas.rollIndex.find('snakesolid'), None)
+
+    def test_studentsSetterIndexesNames(self):
+        manager = SubmissionFix.TSquare(students=['Fox, Grey'])
+        self.assertTrue(manager._isSelected('FOX, GREY'))
+        self.assertFalse(manager._isSelected('Ling, Mei'))
+        manager.students = None
+        self.assertTrue(manager._isSelected('Ling, Mei'))
+
+    #EntryWriter
+    def test_entryWriterThreadsSmallBudget(self):
+        path = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile('testing_set1.zip') as zfile:
+                with SubmissionFix.EntryWriter('testing_set1.zip', threads=4, budget=64) as writer:
+                    for info in zfile.infolist():
+                        writer.write(info, SubmissionFix.entryPath(path, info.filename))
+                for info in zfile.infolist():
+                    if not info.filename.endswith('/'):
+                        with open(os.path.join(path, info.filename), 'rb') as f:
+                            self.assertEqual(f.read(), zfile.read(info))
+        finally:
+            shutil.rmtree(path)
+
+    #expandEntry
+    def test_expandEntrySpooledZip(self):
+        path = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile('testing_setc4.zip') as zfile:
+                info = zfile.getinfo('sasakijohnny_1111_1111_HW01.zip')
+                SubmissionFix.expandEntry(zfile, info, os.path.join(path, 'HW01.zip'), spoolSize=1)
+            self.assertTrue(os.path.isfile(os.path.join(path, 'sasakijohnny_1111_1111_HW01', 'patriots.asm')))
+            self.assertFalse(os.path.exists(os.path.join(path, 'HW01.zip')))
+        finally:
+            shutil.rmtree(path)
+
+    def test_expandEntryStreamedTar(self):
+        path = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile('testing_setc5.zip') as zfile:
+                info = zfile.getinfo('sasakijohnny_1111_1111_HW01.tar.gz')
+                SubmissionFix.expandEntry(zfile, info, os.path.join(path, 'HW01.tar.gz'), spoolSize=1)
+            self.assertTrue(os.path.isfile(os.path.join(path, 'sasakijohnny_1111_1111_HW01', 'patriots.asm')))
+            self.assertFalse(os.path.exists(os.path.join(path, 'HW01.tar.gz')))
+        finally:
+            shutil.rmtree(path)
+
+    def test_expandEntryNotArchive(self):
+        path = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile('testing_setc1.zip') as zfile:
+                info = zfile.getinfo('andersondonald_0001_0001_patriots.asm')
+                with self.suppressOutput():
+                    SubmissionFix.expandEntry(zfile, info, os.path.join(path, 'patriots.zip'))
+                with open(os.path.join(path, 'patriots.zip'), 'rb') as f:
+                    self.assertEqual(f.read(), zfile.read(info))
+        finally:
+            shutil.rmtree(path)
+
+    def test_streamLeavesArchivesInArchives(self):
+        path = tempfile.mkdtemp()
+        try:
+            inner = os.path.join(path, 'inner.zip')
+            with zipfile.ZipFile(inner, 'w') as zfile:
+                zfile.writestr('deep.txt', 'deep')
+            nested = os.path.join(path, 'project.zip')
+            with zipfile.ZipFile(nested, 'w') as zfile:
+                zfile.writestr('a.txt', 'a')
+                zfile.write(inner, 'inner.zip')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.write(nested, 'snakesolid_1_1_project.zip')
+
+            for stream in (False, True):
+                out = os.path.join(path, 'stream' if stream else 'default')
+                with self.suppressOutput():
+                    SubmissionFix.Canvas.execute(bulk, 'testroll.csv', out, None, None, None, stream=stream)
+                self.assertEqual(sorted(os.listdir(os.path.join(out, 'Snake, Solid'))), ['a.txt', 'inner.zip'])
+        finally:
+            shutil.rmtree(path)
+
+    #extractArchive
+    def test_sniffArchive(self):
+        self.assertEqual(SubmissionFix.sniffArchive('PK\x03\x04rest'), 'zip')
+        self.assertEqual(SubmissionFix.sniffArchive('\x1f\x8b\x08'), 'gzip')
+        self.assertEqual(SubmissionFix.sniffArchive('BZh91AY'), 'bzip2')
+        self.assertEqual(SubmissionFix.sniffArchive('\x00' * 257 + 'ustar\x00'), 'tar')
+        self.assertEqual(SubmissionFix.sniffArchive('; patriots.asm'), None)
+
+    def test_extractArchiveZipRenamedTar(self):
+        path = tempfile.mkdtemp()
+        try:
+            renamed = os.path.join(path, 'HW01.tar')
+            with zipfile.ZipFile('testing_setc4.zip') as zfile:
+                with open(renamed, 'wb') as f:
+                    f.write(zfile.read('sasakijohnny_1111_1111_HW01.zip'))
+            SubmissionFix.unarchive(path, renamed)
+            self.assertTrue(os.path.isfile(os.path.join(path, 'sasakijohnny_1111_1111_HW01', 'patriots.asm')))
+            self.assertFalse(os.path.exists(renamed))
+        finally:
+            shutil.rmtree(path)
+
+    def test_extractArchivePlainTarUnsafeMembers(self):
+        path = tempfile.mkdtemp()
+        try:
+            tarry = os.path.join(path, 'HW01.tar')
+            tar = tarfile.open(tarry, 'w')
+            tar.add('testingtxt1.txt', arcname='./testingtxt1.txt')
+            tar.add('testingtxt1.txt', arcname='../escaped.txt')
+            tar.close()
+            out = os.path.join(path, 'out')
+            os.makedirs(out)
+            with self.suppressOutput():
+                SubmissionFix.unarchive(out, tarry)
+            self.assertTrue(os.path.isfile(os.path.join(out, 'testingtxt1.txt')))
+            self.assertFalse(os.path.exists(os.path.join(path, 'escaped.txt')))
+            self.assertFalse(os.path.exists(tarry))
+        finally:
+            shutil.rmtree(path)
+
+    def test_extractArchiveTarLinksOutOfFolder(self):
+        path = tempfile.mkdtemp()
+        try:
+            victim = os.path.join(path, 'victim')
+            os.makedirs(victim)
+            tarry = os.path.join(path, 'HW01.tar')
+            tar = tarfile.open(tarry, 'w')
+            for name, kind, target in (('link', tarfile.SYMTYPE, victim), ('up', tarfile.SYMTYPE, '..'),
+                                       ('hard', tarfile.LNKTYPE, '../victim/secret'), ('inside', tarfile.SYMTYPE, 'hw')):
+                info = tarfile.TarInfo(name)
+                info.type = kind
+                info.linkname = target
+                tar.addfile(info)
+            tar.add('testingtxt1.txt', arcname='link/owned.txt')
+            tar.add('testingtxt1.txt', arcname='hw/kept.txt')
+            tar.close()
+            out = os.path.join(path, 'out')
+            os.makedirs(out)
+            with self.suppressOutput():
+                SubmissionFix.unarchive(out, tarry)
+            self.assertEqual(os.listdir(victim), [])
+            # without the link, link/owned.txt lands in a real folder of the student's
+            self.assertEqual(sorted(os.listdir(out)), ['hw', 'inside', 'link'])
+            self.assertFalse(os.path.islink(os.path.join(out, 'link')))
+            self.assertTrue(os.path.isfile(os.path.join(out, 'inside', 'kept.txt')))
+        finally:
+            shutil.rmtree(path)
+
+    @contextmanager
+    def suppressOutput(self):
+        with open(os.devnull, 'w') as devnull:
+            oldstdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                yield
+            finally:
+                sys.stdout = oldstdout
+
+    def test_entryWriterDedupLinks(self):
+        path = tempfile.mkdtemp()
+        try:
+            with zipfile.ZipFile('testing_setc7.zip') as zfile:
+                with self.suppressOutput():
+                    with SubmissionFix.EntryWriter('testing_setc7.zip', threads=2, dedup=True) as writer:
+                        for info in zfile.infolist():
+                            writer.write(info, SubmissionFix.entryPath(path, info.filename))
+                for info in zfile.infolist():
+                    with open(os.path.join(path, info.filename), 'rb') as f:
+                        self.assertEqual(f.read(), zfile.read(info))
+            first = os.stat(os.path.join(path, 'andersondonald_0001_0001_patriots.asm'))
+            second = os.stat(os.path.join(path, 'wolfsniper_0006_00006_patriots.asm'))
+            if not writer.cloned:
+                self.assertEqual(first.st_ino, second.st_ino)
+            self.assertEqual(writer.savedBytes, 20 * first.st_size)
+        finally:
+            shutil.rmtree(path)
+
+    def test_dedupLinksNeverShareArchiveOverwrites(self):
+        path = tempfile.mkdtemp()
+        try:
+            nested = os.path.join(path, 'project.zip')
+            with zipfile.ZipFile(nested, 'w') as zfile:
+                zfile.writestr('Makefile', 'STUDENT A CUSTOM MAKEFILE')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_1_1_Makefile', 'STARTER MAKEFILE')
+                zfile.write(nested, 'snakesolid_1_1_project.zip')
+                zfile.writestr('snakeliquid_2_2_Makefile', 'STARTER MAKEFILE')
+
+            for stream in (False, True):
+                out = os.path.join(path, 'stream' if stream else 'default')
+                with self.suppressOutput():
+                    SubmissionFix.Canvas.execute(bulk, 'testroll.csv', out, None, None, None, stream=stream,
+                                                 dedup=True)
+                with open(os.path.join(out, 'Snake, Solid', 'Makefile'), 'rb') as f:
+                    self.assertEqual(f.read(), 'STUDENT A CUSTOM MAKEFILE')
+                with open(os.path.join(out, 'Snake, Liquid', 'Makefile'), 'rb') as f:
+                    self.assertEqual(f.read(), 'STARTER MAKEFILE')
+                self.assertEqual(os.stat(os.path.join(out, 'Snake, Liquid', 'Makefile')).st_nlink, 1)
+        finally:
+            shutil.rmtree(path)
+
+    #CentralDirectory
+    def test_centralDirectoryMatchesZipFile(self):
+        with zipfile.ZipFile('testing_set7.zip') as zfile:
+            expected = [(i.filename, i.CRC, i.file_size, i.header_offset, i.date_time) for i in zfile.infolist()]
+            last = zfile.read(expected[-1][0])
+        with SubmissionFix.CentralDirectory('testing_set7.zip') as zfile:
+            entries = list(zfile.entries(chunkSize=50))
+            self.assertEqual([(i.filename, i.CRC, i.file_size, i.header_offset, i.date_time) for i in entries], expected)
+            self.assertEqual(zfile.namelist(), [])
+            self.assertEqual(zfile.open(entries[-1]).read(), last)
+
+    #entryPath
+    def test_entryPathUnsafe(self):
+        self.assertEqual(SubmissionFix.entryPath('out', '../../a/./b.txt'), os.path.join('out', 'a', 'b.txt'))
+
+    #Canvas report
+    def test_canvasReportLateAndNoSubmission(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_late_123_123_patriots.asm', 'x')
+                zfile.writestr('snakesolid_123_123_notes-1.txt', 'x')
+                zfile.writestr('snakeliquid_456_456_patriots.asm', 'x')
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            late, noSub = canvas.report(bulk)
+            self.assertEqual(late, ['  Snake, Solid'])
+            self.assertNotIn('  Snake, Liquid', noSub)
+            self.assertIn('  Snake, Solidus', noSub)
+
+            canvas.students = canvas.sections['B2']
+            late, noSub = canvas.report(bulk)
+            self.assertEqual(late, [])
+            self.assertEqual(noSub, ['  ' + name for name in sorted(canvas.students) if name != 'Snake, Liquid'])
+        finally:
+            shutil.rmtree(path)
+
+    #plan
+    def test_canvasPlanCollisionAndSkips(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_123_123_patriots.asm', 'x')
+                zfile.writestr('snakesolid_123_123_patriots-1.asm', 'xy')
+                zfile.writestr('snakeliquid_456_456_hw.zip', 'xyz')
+                zfile.writestr('pliskinsnake_999_999_patriots.asm', 'x')
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            canvas.students = canvas.sections['A1']
+            plan = dict((e['source'], e) for e in canvas.plan(bulk))
+            self.assertEqual(plan['snakesolid_123_123_patriots.asm']['destination'],
+                             os.path.join('Snake, Solid', 'patriots.asm'))
+            self.assertEqual(plan['snakesolid_123_123_patriots-1.asm']['reason'], 'collision')
+            self.assertEqual(plan['snakesolid_123_123_patriots-1.asm']['size'], 2)
+            self.assertEqual(plan['snakeliquid_456_456_hw.zip']['reason'], 'student not selected')
+            self.assertEqual(plan['pliskinsnake_999_999_patriots.asm']['reason'], 'student not on roll')
+            self.assertIsNone(plan['pliskinsnake_999_999_patriots.asm']['destination'])
+        finally:
+            shutil.rmtree(path)
+
+    #sections
+    def test_canvasSectionRoutesStreamOnce(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_123_123_patriots.asm', 'solid')
+                zfile.writestr('snakeliquid_456_456_patriots.asm', 'liquid')
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            self.assertEqual(canvas._sectionNames(['all']), sorted(canvas.sections))
+            self.assertEqual(canvas._sectionNames(['b2', 'a1', 'A1']), ['A1', 'B2'])
+            canvas.routes = canvas._sectionRoutes(['A1', 'B2'], 'TA_{section}')
+            canvas.routes['Snake, Solid'].append('Extra')
+            canvas.students = list(canvas.routes)
+            plan = dict((e['source'], e) for e in canvas.plan(bulk))
+            self.assertEqual(plan['snakeliquid_456_456_patriots.asm']['destination'],
+                             os.path.join('TA_B2', 'Snake, Liquid', 'patriots.asm'))
+
+            with self.suppressOutput():
+                folders = canvas.stream(bulk, os.path.join(path, 'out'))
+            self.assertEqual(len(folders), 3)
+            for tree, student, data in (('TA_A1', 'Snake, Solid', 'solid'), ('Extra', 'Snake, Solid', 'solid'),
+                                        ('TA_B2', 'Snake, Liquid', 'liquid')):
+                with open(os.path.join(path, 'out', tree, student, 'patriots.asm'), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+        finally:
+            shutil.rmtree(path)
+
+    #shards
+    def test_binPackBalancesLargestFirst(self):
+        sizes = {'a': 50, 'b': 40, 'c': 30, 'd': 20, 'e': 10, 'f': 10}
+        self.assertEqual(SubmissionFix.binPack(sizes, 2), [(80, ['a', 'd', 'e']), (80, ['b', 'c', 'f'])])
+        self.assertEqual(SubmissionFix.binPack(sizes, 4), [(50, ['a']), (40, ['b']), (40, ['c', 'f']), (30, ['d', 'e'])])
+        self.assertEqual(SubmissionFix.binPack({}, 2), [(0, []), (0, [])])
+
+    def test_canvasShardSizesFromCentralDirectory(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w', zipfile.ZIP_DEFLATED) as zfile:
+                zfile.writestr('snakesolid_123_123_project.asm', 'x' * 5000)
+                zfile.writestr('snakeliquid_456_456_patriots.asm', 'x' * 3000)
+                zfile.writestr('snakesolidus_789_789_patriots.asm', 'x' * 1000)
+                zfile.writestr('foxgrey_852_852_patriots.asm', 'x' * 1000)
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            self.assertEqual(canvas.shard(bulk, 2), [(5000, ['Snake, Solid']),
+                                                     (5000, ['Fox, Grey', 'Snake, Liquid', 'Snake, Solidus'])])
+
+            table = os.path.join(path, 'shards.json')
+            with self.suppressOutput():
+                canvas.writeShards(bulk, 2, table)
+                canvas.stream(bulk, os.path.join(path, 'out'))
+            with open(table) as f:
+                self.assertEqual([s['students'] for s in json.load(f)['shards']],
+                                 [['Snake, Solid'], ['Fox, Grey', 'Snake, Liquid', 'Snake, Solidus']])
+            self.assertTrue(os.path.isfile(os.path.join(path, 'out', 'shard2', 'Fox, Grey', 'patriots.asm')))
+        finally:
+            shutil.rmtree(path)
+
+    #SubmissionView
+    def test_canvasViewOpensNestedArchivesLazily(self):
+        path = tempfile.mkdtemp()
+        try:
+            nested = os.path.join(path, 'hw.zip')
+            with zipfile.ZipFile(nested, 'w') as zfile:
+                zfile.writestr('hw/hw.c', 'int main;')
+                zfile.writestr('hw/patriots.asm', 'archived')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_123_123_patriots.asm', 'submitted')
+                zfile.write(nested, 'snakesolid_123_123_hw.zip')
+                zfile.writestr('snakeliquid_456_456_notes.txt', 'notes')
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            canvas.flatten = '1'
+            with canvas.view(bulk) as view:
+                self.assertEqual(view.students(), ['Snake, Liquid', 'Snake, Solid'])
+                self.assertEqual(view['Snake, Solid'].open('patriots.asm').read(), 'submitted')
+                self.assertIsNone(view['Snake, Solid']._members)
+                self.assertEqual(view['Snake, Solid'].open('hw.c').read(), 'int main;')
+                self.assertEqual(view['Snake, Solid'].files(), ['hw.c', 'patriots.asm'])
+                self.assertNotIn('hw.zip', view['Snake, Solid'])
+                self.assertIn('notes.txt', view['Snake, Liquid'])
+                self.assertRaises(IOError, view['Snake, Liquid'].open, 'hw.c')
+                self.assertRaises(KeyError, view.__getitem__, 'Fox, Grey')
+        finally:
+            shutil.rmtree(path)
+
+    #ArchiveSink
+    def test_archiveSinkPicksCompressionFromName(self):
+        path = tempfile.mkdtemp()
+        stderr = sys.stderr
+        try:
+            self.assertEqual(SubmissionFix.ArchiveSink.mode('out.tbz2'), 'w|bz2')
+            self.assertIsNone(SubmissionFix.ArchiveSink.mode('out.zip'))
+            self.assertRaises(ValueError, SubmissionFix.ArchiveSink, os.path.join(path, 'out.tar.xz'))
+            out = os.path.join(path, 'out.tar.bz2')
+            with SubmissionFix.ArchiveSink(out) as sink:
+                sink.addFolder('Fox, Grey')
+            with tarfile.open(out, 'r:bz2') as tar:
+                self.assertEqual(tar.getnames(), ['Fox, Grey'])
+
+            sys.stderr = open(os.devnull, 'w')
+            for options in (['--output-archive', 'out.zip'], ['--output-archive', 'out.tar', '--dedup'],
+                            ['--output-archive', 'out.tar', '--threads', '4']):
+                self.assertRaises(SystemExit, SubmissionFix.main, ['', 'testing_set1.zip', 'tsquare'] + options)
+        finally:
+            if sys.stderr is not stderr:
+                sys.stderr.close()
+                sys.stderr = stderr
+            shutil.rmtree(path)
+
+    def test_tsquareWriteArchiveMatchesStream(self):
+        path = tempfile.mkdtemp()
+        try:
+            manager = SubmissionFix.TSquare()
+            manager.flatten = '1'
+            out = os.path.join(path, 'out.tar.gz')
+            with self.suppressOutput():
+                with SubmissionFix.ArchiveSink(out) as sink:
+                    manager.writeArchive('testing_set6.zip', sink)
+                manager.stream('testing_set6.zip', os.path.join(path, 'streamed'))
+            with tarfile.open(out) as tar:
+                names = sorted(member.name for member in tar)
+                self.assertEqual(tar.extractfile('Anderson, Donald/Text/timestamp.txt').read().strip(),
+                                 open(os.path.join(path, 'streamed', 'Anderson, Donald', 'Text', 'timestamp.txt')).read().strip())
+
+            streamed = []
+            for root, dirs, files in os.walk(os.path.join(path, 'streamed')):
+                streamed += [os.path.relpath(os.path.join(root, name), os.path.join(path, 'streamed')) for name in dirs + files]
+            self.assertEqual(names, sorted(streamed))
+        finally:
+            shutil.rmtree(path)
+
+    #IndexWriter
+    def test_canvasIndexRecordsFilesAsWritten(self):
+        path = tempfile.mkdtemp()
+        try:
+            for name in ('a', 'b'):
+                with zipfile.ZipFile(os.path.join(path, name + '.zip'), 'w') as zfile:
+                    zfile.writestr('hw/hw.c', 'int ' + name + ';')
+            with open(os.path.join(path, 'lab.c'), 'wb') as f:
+                f.write('int lab;')
+            with tarfile.open(os.path.join(path, 'lab.tar.gz'), 'w:gz') as tar:
+                tar.add(os.path.join(path, 'lab.c'), arcname='lab.c')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_late_123_123_patriots.asm', 'submitted')
+                zfile.write(os.path.join(path, 'b.zip'), 'snakesolid_123_123_b.zip')
+                zfile.write(os.path.join(path, 'a.zip'), 'snakesolid_123_123_a.zip')
+                zfile.write(os.path.join(path, 'lab.tar.gz'), 'snakesolid_123_123_lab.tar.gz')
+
+            with self.suppressOutput():
+                SubmissionFix.Canvas.execute(bulk, 'testroll.csv', os.path.join(path, 'out'), None, None, '1',
+                                             index=os.path.join(path, 'index.jsonl'))
+            with open(os.path.join(path, 'index.jsonl')) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([r['path'] for r in records],
+                             [os.path.join('Snake, Solid', name) for name in ('hw.c', 'lab.c', 'patriots.asm')])
+            self.assertEqual(records[0], {'student': 'Snake, Solid', 'section': 'A1', 'source': 'snakesolid_123_123_a.zip',
+                                          'path': os.path.join('Snake, Solid', 'hw.c'), 'size': 6,
+                                          'crc': '{crc:08x}'.format(crc=zlib.crc32('int a;') & 0xffffffff),
+                                          'late': True, 'archive': 'a.zip'})
+            self.assertEqual(records[1]['crc'], '{crc:08x}'.format(crc=zlib.crc32('int lab;') & 0xffffffff))
+            self.assertEqual((records[2]['source'], records[2]['archive']), ('snakesolid_late_123_123_patriots.asm', None))
+        finally:
+            shutil.rmtree(path)
+
+    def test_canvasIndexSqliteRecordsQuarantinedArchive(self):
+        path = tempfile.mkdtemp()
+        try:
+            nested = os.path.join(path, 'hw.zip')
+            with zipfile.ZipFile(nested, 'w') as zfile:
+                for n in range(3):
+                    zfile.writestr('hw{n}.c'.format(n=n), 'int main;')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakesolid_late_123_123_patriots.asm', 'submitted')
+                zfile.write(nested, 'snakesolid_123_123_hw.zip')
+
+            with self.suppressOutput():
+                SubmissionFix.Canvas.execute(bulk, 'testroll.csv', os.path.join(path, 'out'), None, None, None,
+                                             limits=SubmissionFix.ExtractionLimits(archiveFiles=2),
+                                             index=os.path.join(path, 'index.db'))
+            connection = sqlite3.connect(os.path.join(path, 'index.db'))
+            self.assertEqual(connection.execute('SELECT path, archive, late FROM files ORDER BY path').fetchall(),
+                             [(os.path.join('Snake, Solid', 'Quarantine', 'hw.zip'), None, 1),
+                              (os.path.join('Snake, Solid', 'patriots.asm'), None, 1)])
+            connection.close()
+        finally:
+            shutil.rmtree(path)
+
+    #LocalHeaders
+    def writeDescriptorZip(self, path, files):
+        """Write a zip of deflated entries with data descriptors, like zips streamed over a socket."""
+
+        central = ''
+        with open(path, 'wb') as f:
+            for name, data in files:
+                offset = f.tell()
+                compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+                body = compressor.compress(data) + compressor.flush()
+                crc = zlib.crc32(data) & 0xffffffff
+                f.write(struct.pack(zipfile.structFileHeader, 'PK\x03\x04', 20, 0, 8, 8, 0, 0x21, 0, 0, 0, len(name), 0))
+                f.write(name + body + struct.pack('<4sLLL', 'PK\x07\x08', crc, len(body), len(data)))
+                central += struct.pack(zipfile.structCentralDir, 'PK\x01\x02', 20, 3, 20, 0, 8, 8, 0, 0x21, crc,
+                                       len(body), len(data), len(name), 0, 0, 0, 0, 0, offset) + name
+            start = f.tell()
+            f.write(central + struct.pack(zipfile.structEndArchive, 'PK\x05\x06', 0, 0, len(files), len(files),
+                                          len(central), start, 0))
+            return start
+
+    def test_localHeadersDataDescriptorsAndTruncation(self):
+        path = tempfile.mkdtemp()
+        try:
+            files = [('snakesolid_123_123_patriots.asm', 'x' * 5000 + 'y'), ('snakeliquid_456_456_hw.asm', 'liquid')]
+            bulk = os.path.join(path, 'bulk.zip')
+            start = self.writeDescriptorZip(bulk, files)
+            zfile = SubmissionFix.LocalHeaders(bulk, idle=0)
+            entries = list(zfile.entries())
+            self.assertEqual([(info.filename, info.file_size) for info in entries], [(n, len(d)) for n, d in files])
+            self.assertEqual(zfile.read(entries[0]), files[0][1])
+            self.assertFalse(zfile.truncated)
+
+            with open(bulk, 'rb') as f:
+                data = f.read()
+            partial = os.path.join(path, 'partial.zip')
+            with open(partial, 'wb') as f:
+                f.write(data[:start - 5])
+            zfile = SubmissionFix.LocalHeaders(partial, idle=0)
+            self.assertEqual([info.filename for info in zfile.entries()], [files[0][0]])
+            self.assertTrue(zfile.truncated)
+
+            canvas = SubmissionFix.Canvas('testroll.csv')
+            canvas.follow = {'idle': 0}
+            with self.suppressOutput():
+                canvas.stream(partial, os.path.join(path, 'out'))
+            self.assertEqual(os.listdir(os.path.join(path, 'out')), ['Snake, Solid'])
+            self.assertEqual(canvas.follow, {'idle': 0})
+        finally:
+            shutil.rmtree(path)
+
+    def test_localHeadersWaitsForGrowingFile(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(os.path.join(path, 'whole.zip'), 'w', zipfile.ZIP_DEFLATED) as zfile:
+                zfile.writestr('snakesolid_123_123_patriots.asm', 'solid')
+                zfile.writestr('snakeliquid_456_456_patriots.asm', 'liquid')
+            with open(os.path.join(path, 'whole.zip'), 'rb') as f:
+                data = f.read()
+            finished = threading.Event()
+
+            def download():
+                with open(bulk, 'ab') as f:
+                    for i in range(0, len(data), 50):
+                        f.write(data[i:i + 50])
+                        f.flush()
+                        time.sleep(0.01)
+                finished.set()
+
+            open(bulk, 'wb').close()
+            downloader = threading.Thread(target=download)
+            downloader.start()
+            zfile = SubmissionFix.LocalHeaders(bulk, finished=finished, poll=0.01)
+            self.assertEqual([zfile.read(info) for info in zfile.entries()], ['solid', 'liquid'])
+            self.assertFalse(zfile.truncated)
+            self.assertEqual(zfile.mismatched, [])
+            downloader.join()
+        finally:
+            shutil.rmtree(path)
+
+    #Flattener
+    def test_flattenerPaths(self):
+        one = SubmissionFix.Flattener('1', ('Text',))
+        everything = SubmissionFix.Flattener('all', ('Text',))
+        self.assertEqual(one.path(os.path.join('hw', 'src', 'a.c')), os.path.join('src', 'a.c'))
+        self.assertEqual(one.path(os.path.join('hw', 'src', '')), os.path.join('src', ''))
+        self.assertIsNone(one.path(os.path.join('hw', '')))
+        self.assertEqual(everything.path(os.path.join('hw', 'src', 'a.c')), 'a.c')
+        self.assertIsNone(everything.path(os.path.join('hw', 'src', '')))
+        self.assertEqual(everything.path(os.path.join('Text', 'timestamp.txt')), os.path.join('Text', 'timestamp.txt'))
+        self.assertEqual(everything.path('a.c'), 'a.c')
+
+    def test_entryWriterFlattensEachStudentsArchivesInOrder(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            for name in ('a', 'b'):
+                with zipfile.ZipFile(os.path.join(path, name + '.zip'), 'w') as archive:
+                    archive.writestr('hw/x.txt', 'from ' + name)
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                for student in range(20):
+                    for name in ('b', 'a'):
+                        zfile.write(os.path.join(path, name + '.zip'),
+                                    '{student}/{name}.zip'.format(student=student, name=name))
+
+            flattener = SubmissionFix.Flattener('1')
+            with zipfile.ZipFile(bulk) as zfile, self.suppressOutput():
+                with SubmissionFix.EntryWriter(bulk, threads=4, flattener=flattener) as writer:
+                    for info in zfile.infolist():
+                        if info.filename.endswith('b.zip'):
+                            writer.group()
+                        writer.write(info, SubmissionFix.entryPath(path, info.filename), expand=True)
+            for student in range(20):
+                with open(os.path.join(path, str(student), 'x.txt'), 'rb') as f:
+                    self.assertEqual(f.read(), 'from a')
+            self.assertEqual(flattener.clashes, [os.path.join('hw', 'x.txt')] * 20)
+        finally:
+            shutil.rmtree(path)
+
+    def test_flattenClashKeepsSameArchiveWithAndWithoutStream(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                for name in ('b', 'a'):
+                    nested = os.path.join(path, name + '.zip')
+                    with zipfile.ZipFile(nested, 'w') as archive:
+                        archive.writestr('hw/x.txt', 'from ' + name)
+                    zfile.write(nested, 'snakesolid_1_1_{name}.zip'.format(name=name))
+
+            for stream in (False, True):
+                out = os.path.join(path, 'stream' if stream else 'default')
+                with self.suppressOutput():
+                    SubmissionFix.Canvas.execute(bulk, 'testroll.csv', out, None, None, '1', stream=stream)
+                with open(os.path.join(out, 'Snake, Solid', 'x.txt'), 'rb') as f:
+                    self.assertEqual(f.read(), 'from a')
+        finally:
+            shutil.rmtree(path)
+
+    def test_archiveReplacesSubmittedFileWithAndWithoutStream(self):
+        path = tempfile.mkdtemp()
+        try:
+            bulk = os.path.join(path, 'bulk.zip')
+            nested = os.path.join(path, 'a.zip')
+            with zipfile.ZipFile(nested, 'w') as archive:
+                archive.writestr('main.c', 'from archive')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.write(nested, 'snakesolid_1_1_a.zip')
+                zfile.writestr('snakesolid_1_1_main.c', 'submitted')
+
+            for stream in (False, True):
+                out = os.path.join(path, 'stream' if stream else 'default')
+                with self.suppressOutput():
+                    SubmissionFix.Canvas.execute(bulk, 'testroll.csv', out, None, None, None, stream=stream)
+                with open(os.path.join(out, 'Snake, Solid', 'main.c'), 'rb') as f:
+                    self.assertEqual(f.read(), 'from archive')
+            with SubmissionFix.Canvas('testroll.csv').view(bulk) as view:
+                self.assertEqual(view['Snake, Solid'].open('main.c').read(), 'from archive')
+        finally:
+            shutil.rmtree(path)
+
+    def test_inspectFolderFlattenClashKeepsFile(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'a.c'), 'wb') as f:
+                f.write('submitted')
+            with zipfile.ZipFile(os.path.join(path, 'hw.zip'), 'w') as zfile:
+                zfile.writestr('hw/a.c', 'archived')
+                zfile.writestr('hw/src/b.c', 'b')
+            with self.suppressOutput():
+                SubmissionFix.Canvas('testroll.csv')._inspectFolder(path, '1')
+            with open(os.path.join(path, 'a.c'), 'rb') as f:
+                self.assertEqual(f.read(), 'submitted')
+            self.assertEqual(sorted(os.listdir(path)), ['a.c', 'src'])
+            self.assertTrue(os.path.isfile(os.path.join(path, 'src', 'b.c')))
+        finally:
+            shutil.rmtree(path)
+
+    #ExtractionLimits
+    def test_byteSize(self):
+        self.assertEqual(SubmissionFix.byteSize('512'), 512)
+        self.assertEqual(SubmissionFix.byteSize('20k'), 20 * 1024)
+        self.assertEqual(SubmissionFix.byteSize('2G'), 2 * 1024 ** 3)
+        self.assertRaises(SubmissionFix.argparse.ArgumentTypeError, SubmissionFix.byteSize, 'lots')
+
+    def test_unarchiveRatioLimitQuarantines(self):
+        path = tempfile.mkdtemp()
+        try:
+            bomb = os.path.join(path, 'hw.zip')
+            with zipfile.ZipFile(bomb, 'w', zipfile.ZIP_DEFLATED) as zfile:
+                zfile.writestr('hw/a.asm', 'x')
+                zfile.writestr('hw/big.bin', '\0' * 1024 * 1024)
+            governor = SubmissionFix.Governor(SubmissionFix.ExtractionLimits(ratio=10))
+            with self.suppressOutput():
+                SubmissionFix.unarchive(path, bomb, governor=governor)
+            self.assertEqual(os.listdir(path), ['Quarantine'])
+            self.assertTrue(os.path.isfile(os.path.join(path, 'Quarantine', 'hw.zip')))
+            self.assertEqual(len(governor.violations), 1)
+            self.assertIn('hw.zip', governor.violations[0])
+        finally:
+            shutil.rmtree(path)
+
+    def test_studentFileLimitSpansArchives(self):
+        path = tempfile.mkdtemp()
+        try:
+            governor = SubmissionFix.Governor(SubmissionFix.ExtractionLimits(studentFiles=3))
+            for name in ('one.tar', 'two.tar'):
+                tar = tarfile.open(os.path.join(path, name), 'w')
+                tar.add('testingtxt1.txt', arcname=name + '1.txt')
+                tar.add('testingtxt1.txt', arcname=name + '2.asm')
+                tar.close()
+            with self.suppressOutput():
+                SubmissionFix.extract(path, governor=governor)
+            self.assertEqual(len(governor.violations), 1)
+            self.assertEqual(len([f for f in os.listdir(path) if f.endswith(('.txt', '.asm'))]), 2)
+            self.assertEqual(len(os.listdir(os.path.join(path, 'Quarantine'))), 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_streamStudentFileLimitCoversWholeRun(self):
+        path = tempfile.mkdtemp()
+        try:
+            inner = os.path.join(path, 'inner.zip')
+            with zipfile.ZipFile(inner, 'w') as zfile:
+                zfile.writestr('deep.txt', 'deep')
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                for name in ('one', 'two'):
+                    nested = os.path.join(path, name + '.zip')
+                    with zipfile.ZipFile(nested, 'w') as archive:
+                        archive.writestr(name + '.txt', name)
+                        archive.write(inner, name + '_inner.zip')
+                    zfile.write(nested, 'snakesolid_1_1_{name}.zip'.format(name=name))
+
+            for options in ({'stream': True}, {'stream': True, 'threads': 2}, {}, {'jobs': 2}):
+                out = os.path.join(path, 'out{n}'.format(n=len(os.listdir(path))))
+                with self.suppressOutput():
+                    SubmissionFix.Canvas.execute(bulk, 'testroll.csv', out, None, None, None,
+                                                 limits=SubmissionFix.ExtractionLimits(studentFiles=3), **options)
+                # either archive may be extracted first, the other one passes the limit
+                folder = os.path.join(out, 'Snake, Solid')
+                quarantined = os.listdir(os.path.join(folder, 'Quarantine'))
+                self.assertIn(quarantined, [['one.zip'], ['two.zip']])
+                kept = 'two' if quarantined == ['one.zip'] else 'one'
+                self.assertEqual(sorted(os.listdir(folder)), ['Quarantine', kept + '.txt', kept + '_inner.zip'])
+        finally:
+            shutil.rmtree(path)
+
+    #Grader
+    def test_graderCallbackAndCommand(self):
+        path = tempfile.mkdtemp()
+        try:
+            for name in ('Fox, Grey', 'Ling, Mei'):
+                os.makedirs(os.path.join(path, name))
+            graded = []
+            grader = SubmissionFix.Grader(callback=lambda folder: graded.append(folder) or len(graded) - 1, workers=1)
+            for name in ('Ling, Mei', 'Fox, Grey'):
+                grader.submit(os.path.join(path, name))
+            with self.suppressOutput():
+                results = grader.close()
+            self.assertEqual([r['student'] for r in results], ['Fox, Grey', 'Ling, Mei'])
+            self.assertEqual([r['exitCode'] for r in results], [1, 0])
+
+            summary = os.path.join(path, 'summary.json')
+            grader = SubmissionFix.Grader('echo {dir}; exit 3', workers=2, summary=summary)
+            grader.submit(os.path.join(path, 'Fox, Grey'))
+            with self.suppressOutput():
+                results = grader.close()
+            self.assertEqual(results[0]['exitCode'], 3)
+            self.assertEqual(results[0]['output'].strip(), os.path.join(path, 'Fox, Grey'))
+            self.assertTrue(os.path.isfile(summary))
+        finally:
+            shutil.rmtree(path)
+
+    def test_streamGradesStudentsWhileExtracting(self):
+        path = tempfile.mkdtemp()
+        try:
+            out = os.path.join(path, 'out')
+            extracted = []
+
+            class CountingGrader(SubmissionFix.Grader):
+                def submit(self, folder):
+                    extracted.append(len(os.listdir(out)))
+                    SubmissionFix.Grader.submit(self, folder)
+
+            grader = CountingGrader(callback=lambda folder: None)
+            with self.suppressOutput():
+                SubmissionFix.TSquare.execute('testing_set1.zip', out, None, None, None, stream=True, grader=grader)
+            students = os.listdir(out)
+            self.assertEqual(len(grader.results), len(students))
+            self.assertLess(extracted[0], len(students))
+        finally:
+            shutil.rmtree(path)
+
+    def test_mapFoldersKeepsManagerInPoolWorkers(self):
+        manager = SubmissionFix.TSquare(students=['Fox, Grey'])
+        self.assertTrue(SubmissionFix._callMethod(('_isSelected', ('FOX, GREY',)), manager))
+        manager.jobs = 2
+        self.assertEqual(manager._mapFolders('_isSelected', [('Fox, Grey',), ('Ling, Mei',), ('FOX, GREY',)]),
+                         [True, False, True])
+
+    #Profiler
+    def test_profilerPhaseHooksAndSlowestStudents(self):
+        seen = []
+        profiler = SubmissionFix.Profiler(slowest=2, hooks=[lambda phase, record: seen.append(phase)])
+        with profiler.phase('move', os.getcwd()):
+            results = profiler.recordStudents([('a/Fox, Grey',), ('a/Ling, Mei',), ('b/Fox, Grey',)],
+                                              [(1.0, 'x'), (3.0, 'y'), (2.5, 'z')])
+        self.assertEqual(results, ['x', 'y', 'z'])
+        self.assertEqual(seen, ['move'])
+        report = profiler.report()
+        self.assertEqual([s['student'] for s in report['slowestStudents']], ['Fox, Grey', 'Ling, Mei'])
+        self.assertTrue(report['phases'][0]['files'] > 0)
+
+    def test_streamProfilesArchiveExpansionPerStudent(self):
+        path = tempfile.mkdtemp()
+        try:
+            nested = os.path.join(path, 'hw.zip')
+            with zipfile.ZipFile(nested, 'w', zipfile.ZIP_DEFLATED) as zfile:
+                for n in range(20):
+                    zfile.writestr('part{n}.txt'.format(n=n), os.urandom(256 * 1024))
+            bulk = os.path.join(path, 'bulk.zip')
+            with zipfile.ZipFile(bulk, 'w') as zfile:
+                zfile.writestr('snakeliquid_2_2_notes.txt', 'notes')
+                zfile.write(nested, 'snakesolid_1_1_hw.zip')
+
+            profiler = SubmissionFix.Profiler()
+            with self.suppressOutput():
+                SubmissionFix.Canvas.execute(bulk, 'testroll.csv', os.path.join(path, 'out'), None, None, None,
+                                             stream=True, profiler=profiler)
+            slowest = profiler.report()['slowestStudents']
+            self.assertEqual([s['student'] for s in slowest], ['Snake, Solid', 'Snake, Liquid'])
+        finally:
+            shutil.rmtree(path)
+
+    #Benchmarks
+    def test_benchmarkCanvasZipMatchesRoll(self):
+        path = tempfile.mkdtemp()
+        try:
+            config = Benchmarks.BenchConfig(students=30, late=0.5, resubmitted=0.5)
+            Benchmarks.makeCanvasZip(os.path.join(path, 'bulk.zip'), config)
+            Benchmarks.makeRoll(os.path.join(path, 'roll.csv'), config)
+            canvas = SubmissionFix.Canvas(os.path.join(path, 'roll.csv'))
+            with zipfile.ZipFile(os.path.join(path, 'bulk.zip')) as zfile:
+                students = set(student for info, student, filename in canvas._planEntries(zfile) if student)
+            self.assertEqual(len(students), 30)
+        finally:
+            shutil.rmtree(path)
+
 
 if __name__ == '__main__' :
     suite = unittest.TestLoader().loadTestsFromTestCase(TestSubfixMethods)